@@ -0,0 +1,46 @@
+"""
+Benchmarks running loop-heavy custom commands, which is where most of a CC's time goes, as written and optimized.
+Run from the repository root with: python -m benchmarks.rslisp_eval
+"""
+from timeit import repeat
+from red_star.plugins.rs_lisp import parse, compile_ast, optimize, standard_env
+
+PROGRAMS = {
+    "while loop": """(do (define i 0) (define total 0)
+                         (while (< i 20000) (do (:= total (+ total (% i 7))) (:= i (+ i 1))))
+                         total)""",
+    "recursion": """(do (define fib (lambda (n) (if (< n 2) n (+ (fib (- n 1)) (fib (- n 2))))))
+                        (fib 18))""",
+    "list building": """(do (define l (list)) (define i 0)
+                            (while (< i 5000) (do (append l (* i i)) (:= i (+ i 1))))
+                            (len (tolist (filter (lambda (x) (== (% x 2) 0)) l))))""",
+    "pipeline": """(fold + 0 (take 1000 (lfilter (lambda (x) (== (% x 7) 0))
+                                                    (lmap (lambda (x) (* x x)) (range 1000000)))))""",
+    "dice stats": """(do (define rolls (v+ (randints 20000 1 6) (randints 20000 1 6)))
+                         (list (mean rolls) (histogram rolls 11 2 12)))""",
+    "string output": """(do (define i 0)
+                            (while (< i 2000) (do (print (f "line " i ": " (str "upper" username))) (:= i (+ i 1)))))""",
+    "template": """(do (define width 40) (define bar (lambda (n) (* "#" n))) (define i 0)
+                       (while (< i (// width 4))
+                         (do (print (f (str "upper" "row ") i ": " (bar (// (* i 100) (* width 2))) " of " (* 60 (* 60 24))))
+                             (:= i (+ i 1)))))""",
+}
+
+
+def best_time(program) -> float:
+    def run():
+        env = standard_env()
+        env['username'] = "benchmark"
+        program(env)
+    return min(repeat(run, number=1, repeat=5))
+
+
+def main():
+    for name, source in PROGRAMS.items():
+        plain = best_time(compile_ast(parse(source)))
+        optimized = best_time(compile_ast(optimize(parse(source))))
+        print(f"{name:>14}: {plain * 1000:8.2f} ms, optimized {optimized * 1000:8.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
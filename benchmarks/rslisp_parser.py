@@ -0,0 +1,61 @@
+"""
+Benchmarks the RSLisp parser on large custom commands, like those uploaded as files.
+Run from the repository root with: python -m benchmarks.rslisp_parser [size in KB]
+"""
+import random
+import sys
+from timeit import repeat
+from red_star.plugins.rs_lisp import parse, reprint
+
+
+def generate_cc(size: int, seed: int = 0) -> str:
+    """
+    Generates a custom command of roughly the given size in bytes, with a mix of nesting, strings, escapes and comments.
+    """
+    rng = random.Random(seed)
+    atoms = ["x", "args:0", "+", "-", "len", "define", "if", "42", "0x1f", "3.14", "true", "username"]
+    strings = ['"hello"', '"a \\"quoted\\" word"', '"line\\nbreak"', '"semi\\;colon"', '"back\\\\slash"']
+    parts = ["(do"]
+    length = 3
+    depth = 1
+    while length < size:
+        roll = rng.random()
+        if roll < 0.15 and depth < 40:
+            token = "\n" + "  " * depth + "("
+            depth += 1
+        elif roll < 0.3 and depth > 1:
+            token = ")"
+            depth -= 1
+        elif roll < 0.35:
+            token = " ; a comment\n" + "  " * depth
+        elif roll < 0.5:
+            token = " " + rng.choice(strings)
+        else:
+            token = " " + rng.choice(atoms)
+        parts.append(token)
+        length += len(token)
+    parts.append(")" * depth)
+    return "".join(parts)
+
+
+def main():
+    size = int(sys.argv[1]) * 1024 if len(sys.argv) > 1 else 100 * 1024
+    source = generate_cc(size)
+    # Minifying drops the comments and indentation, so it's started from larger sources until it ends up as large.
+    minified = reprint(parse(source))
+    source_size = size
+    while len(minified) < size:
+        source_size = source_size * 11 // 10
+        minified = reprint(parse(generate_cc(source_size)))
+    for name, program in (("source", source), ("minified", minified)):
+        best = min(repeat(lambda: parse(program), number=5, repeat=5)) / 5
+        print(f"{name:>8}: {len(program) / 1024:7.1f} KB parsed in {best * 1000:8.2f} ms "
+              f"({len(program) / 1024 / 1024 / best:6.2f} MB/s)")
+
+    nested = "(" * 100000 + ")" * 100000
+    best = min(repeat(lambda: parse(nested), number=1, repeat=3))
+    print(f"  nested: 100000 levels parsed in {best * 1000:8.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
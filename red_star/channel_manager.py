@@ -1,6 +1,5 @@
 from __future__ import annotations
 
-import json
 import logging
 
 from red_star.rs_errors import ChannelNotFoundError
@@ -27,8 +26,6 @@ class ChannelManager:
         }
         self.storage_file = self.config_manager.get_plugin_storage(self)
 
-        self._port_old_storage()
-
         if not self.conf:
             self.conf = {
                 "channels": {i: None for i in self.channel_types},
@@ -51,25 +48,6 @@ class ChannelManager:
     def conf(self, value):
         self.storage_file.contents = value
 
-    def _port_old_storage(self):
-        old_storage_path = self.config_manager.config_path / "channel_manager.json"
-        if old_storage_path.exists():
-            with old_storage_path.open(encoding="utf-8") as fp:
-                old_storage = json.load(fp)
-            for guild_id, channel_data in old_storage.items():
-                try:
-                    new_storage = self.config_manager.storage_files[guild_id][self.name]
-                except KeyError:
-                    self.logger.warning(f"Server with ID {guild_id} not found! Is the bot still in this server?\n"
-                                        f"Skipping conversion of this server's channel manager storage...")
-                    continue
-                new_storage.contents = channel_data
-                new_storage.save()
-                new_storage.load()
-            old_storage_path = old_storage_path.replace(old_storage_path.with_suffix(".json.old"))
-            self.logger.info(f"Old channel manager storage converted to new format. "
-                             f"Old data now located at {old_storage_path} - you may delete this file.")
-
     def storage_save_args(self):
         return {}
 
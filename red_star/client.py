@@ -5,6 +5,7 @@ from argparse import Namespace
 from pathlib import Path
 from sys import exc_info
 from red_star.config_manager import ConfigManager
+from red_star.config_watcher import ConfigWatcher
 from red_star.plugin_manager import PluginManager
 
 
@@ -34,6 +35,7 @@ class RedStar(discord.AutoShardedClient):
 
         self.config_manager = ConfigManager(storage_dir / "config", storage_dir / "storage")
         self.config = self.config_manager.config
+        self.config_watcher = ConfigWatcher(self.config_manager)
 
         self.plugin_manager = PluginManager(self)
         self.plugin_manager.load_all_plugins(self.plugin_directories)
@@ -41,6 +43,10 @@ class RedStar(discord.AutoShardedClient):
         self.logged_in = False
         self.last_error = None
 
+    async def setup_hook(self):
+        self.config_watcher.start()
+        self.config_manager.storage_cache.start()
+
     async def on_ready(self):
         if not self.logged_in:
             self.logged_in = True
@@ -58,6 +64,8 @@ class RedStar(discord.AutoShardedClient):
 
     async def close(self):
         self.logger.warning("Logging out and shutting down.")
+        self.config_watcher.stop()
+        self.config_manager.storage_cache.stop()
         await self.plugin_manager.deactivate_all()
         self.config_manager.save_config()
         await super().close()
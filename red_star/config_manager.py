@@ -1,14 +1,20 @@
 from __future__ import annotations
+import asyncio
 import json
 import logging
 import shutil
 import sys
+from collections import OrderedDict
+from collections.abc import MutableMapping, MutableSequence
+from copy import deepcopy
 from pathlib import Path
 from shutil import copyfile
+from time import monotonic
+from typing import NamedTuple
 
 from typing import TYPE_CHECKING
 if TYPE_CHECKING:
-    from typing import Optional
+    from typing import Callable, Iterator, Optional
     import discord
     from red_star.plugin_manager import BasePlugin
 
@@ -16,10 +22,30 @@ if TYPE_CHECKING:
 JsonValues = None | bool | str | int | float | list | dict
 
 
+class ConfigChange(NamedTuple):
+    # scope is a server ID, "default" or "global"; path starts with the plugin name.
+    scope: str
+    path: tuple[str, ...]
+
+
+class ConfigSubscription(NamedTuple):
+    callback: Callable[[ConfigChange], None]
+    scope: str
+    path: tuple[str, ...]
+
+
 class ConfigManager:
     """
     Manages the loading and modification of the configuration files.
     """
+    default_global_config = {
+        "storage_idle_ttl": 60 * 60,
+        "storage_memory_budget": 64 * 1024 * 1024,  # 64 megabytes of serialized JSON
+        "storage_sweep_interval": 60,
+        "config_hot_reload": True,
+        "config_poll_interval": 5
+    }
+
     def __init__(self, config_path: Path, storage_path: Path):
         self.logger = logging.getLogger("red_star.config_manager")
         self.logger.debug("Initialized config manager.")
@@ -28,14 +54,30 @@ class ConfigManager:
         self.config_file_path = config_path / "config.json"
         self.storage_path = storage_path
         self.storage_files = {}
+        self.last_saved_hash: Optional[int] = None
+        # The config as it was last read from or written to the file, which hand edits are compared against.
+        self.file_config: dict[str, JsonValues] = {}
+        # Bumped on every config change, invalidating the layer chains cached by ConfigDict views.
+        self.config_generation = 0
+        self.global_defaults: dict[str, dict[str, JsonValues]] = {}
+        self.server_defaults: dict[str, dict[str, JsonValues]] = {}
+        self.global_view = ConfigDict(self, lambda: [self.config["global"], self.global_defaults], scope="global")
+        self.default_view = ConfigDict(self, lambda: [self.config["default"], self.server_defaults], scope="default")
+        self.server_views: dict[str, ConfigDict] = {}
+        # Keyed by plugin name, or None for subscriptions to an entire scope.
+        self.config_subscriptions: dict[Optional[str], list[ConfigSubscription]] = {}
         self.load_config()
+        self.storage_cache = StorageCache(self.get_global_config("config_manager", self.default_global_config))
 
     def load_config(self):
         temp_path = Path(str(self.config_file_path) + "_bak")
         self.logger.debug("Loading configuration...")
         try:
             with self.config_file_path.open(encoding="utf-8") as fd:
-                self.config = json.load(fd)
+                text = fd.read()
+            self.config = json.loads(text)
+            self.last_saved_hash = hash(text)
+            self.file_config = deepcopy(self.config)
         except FileNotFoundError:
             if temp_path.exists():
                 temp_path.rename(self.config_file_path)
@@ -62,6 +104,9 @@ class ConfigManager:
 
         if self.config.get("global", {}).get("__config_version", 0) < 2:
             self._port_config_to_v2()
+        if self.config["global"]["__config_version"] < 3:
+            self._port_config_to_v3()
+        self.invalidate()
 
     def _port_config_to_v2(self):
         # Function to reorganize from plugin-first hierarchy to server-first hierarchy. Plugins that use their own
@@ -88,34 +133,162 @@ class ConfigManager:
         self.config = new_config
         self.save_config()
 
+    def _port_config_to_v3(self):
+        # Server configs used to be stored as full copies of the defaults. Strip every value that's identical to the
+        # server default, so that only actual overrides remain and changes to defaults apply to all servers.
+        def prune(overrides: dict, defaults: dict):
+            for k, v in tuple(overrides.items()):
+                if k not in defaults:
+                    continue
+                if isinstance(v, dict) and isinstance(defaults[k], dict):
+                    prune(v, defaults[k])
+                    if not v:
+                        del overrides[k]
+                elif v == defaults[k]:
+                    del overrides[k]
+
+        self.logger.warning("Porting configuration to newer format. Backup will be created.")
+        backup_path = self.config_file_path.with_stem(self.config_file_path.stem + "_old_v2")
+        shutil.copyfile(str(self.config_file_path), str(backup_path))
+        for server_id, server_config in self.config.items():
+            if server_id.isdigit():
+                prune(server_config, self.config["default"])
+        self.config["global"]["__config_version"] = 3
+        self.save_config()
+
+    def invalidate(self):
+        """
+        Invalidates all cached config views. Must be called after modifying the config dict directly.
+        """
+        self.config_generation += 1
+
     def save_config(self):
         temp_path = Path(str(self.config_file_path) + "_bak")
+        text = json.dumps(self.config, sort_keys=True, indent=2)
         with temp_path.open("w", encoding="utf-8") as f:
-            json.dump(self.config, f, sort_keys=True, indent=2)
+            f.write(text)
+        self.last_saved_hash = hash(text)
+        self.file_config = json.loads(text)
         self.config_file_path.unlink()
         temp_path.rename(self.config_file_path)
-        for guild_files in self.storage_files.values():
-            for file in guild_files.values():
-                file.save()
+        self.invalidate()
+        self.save_all_plugin_storage()
         self.logger.debug("Saved config files.")
 
-    def get_global_config(self, plugin: str, default_config=None):
-        if default_config is None:
-            default_config = {}
-        default_config = default_config | self.config["global"].setdefault(plugin, {})
-        global_config = ConfigDict(self.config["global"].setdefault(plugin, default_config), default_config)
-        self.config["global"][plugin] = global_config
-        return global_config
-
-    def get_server_config(self, guild: discord.Guild, plugin: str, default_config=None):
-        if default_config is None:
-            default_config = {}
-        default_config |= self.config["default"].setdefault(plugin, default_config)
-        server_config = ConfigDict(self.config.setdefault(str(guild.id), {}).setdefault(plugin, default_config),
-                                   default_config)
-        self.config[str(guild.id)][plugin] = server_config
-        self.config["default"][plugin] = default_config
-        return server_config
+    def apply_config(self, new_config: dict[str, JsonValues]) -> list[ConfigChange]:
+        """
+        Applies a freshly loaded config to the live config in place, replacing only the values that differ, so that
+        existing views stay valid. Subscribers are notified of every changed path.
+        Only values changed in the file since it was last read or written are applied, so that changes made at runtime
+        and not saved yet, like sections of newly joined servers, survive a hand edit elsewhere in the file.
+
+        :param new_config: The new config, as loaded from the config file.
+        :return: The changes that were applied.
+        """
+        def apply_diff(live: dict, base: dict, new: dict, path: tuple[str, ...]):
+            for k in base:
+                if k not in new and k in live:
+                    del live[k]
+                    changed_paths.append((*path, k))
+            for k, v in new.items():
+                if k in base and type(base[k]) is type(v) and base[k] == v:
+                    continue  # Not edited in the file.
+                old = live.get(k)
+                if isinstance(old, dict) and isinstance(v, dict):
+                    base_value = base.get(k)
+                    apply_diff(old, base_value if isinstance(base_value, dict) else {}, v, (*path, k))
+                elif k not in live or type(old) is not type(v) or old != v:
+                    if isinstance(old, list) and isinstance(v, list):
+                        old[:] = v  # Others may hold on to lists, such as the bot maintainers list.
+                    else:
+                        live[k] = v
+                    changed_paths.append((*path, k))
+
+        changed_paths = []
+        apply_diff(self.config, self.file_config, new_config, ())
+        self.file_config = deepcopy(new_config)
+        self.invalidate()
+        changes = [ConfigChange(path[0], path[1:]) for path in changed_paths]
+        for change in changes:
+            self.logger.debug(f"Config value {change.scope}/{'/'.join(change.path)} changed.")
+            self.publish_change(change.scope, change.path)
+        return changes
+
+    def get_global_config(self, plugin: str, default_config=None) -> ConfigDict:
+        """
+        Returns a view of a plugin's global config, falling back to the plugin's defaults for values not set in the
+        config file.
+        """
+        if default_config is not None or plugin not in self.global_defaults:
+            self.global_defaults[plugin] = {} if default_config is None else default_config
+            self.invalidate()
+        return self.global_view[plugin]
+
+    def get_server_config(self, guild: discord.Guild, plugin: str, default_config=None) -> ConfigDict:
+        """
+        Returns a view of a plugin's config for a server. Lookups fall through from the server's overrides to the
+        server defaults in the config file, and then to the plugin's defaults; only overrides are stored per server.
+        """
+        if default_config is not None or plugin not in self.server_defaults:
+            self.server_defaults[plugin] = {} if default_config is None else default_config
+            self.invalidate()
+        return self.get_server_view(str(guild.id))[plugin]
+
+    def get_server_view(self, guild_id: str) -> ConfigDict:
+        """
+        Returns a view of the entire config of a server, with every plugin's section resolved through its defaults.
+        """
+        try:
+            return self.server_views[guild_id]
+        except KeyError:
+            view = ConfigDict(self, lambda: [self.config.setdefault(guild_id, {}), self.config["default"],
+                                             self.server_defaults], scope=guild_id)
+            self.server_views[guild_id] = view
+            return view
+
+    def subscribe(self, callback: Callable[[ConfigChange], None], scope: str,
+                  path: tuple[str, ...] = ()) -> ConfigSubscription:
+        """
+        Registers a callback to be called with a ConfigChange whenever the config at the given path changes, including
+        changes to anything beneath it or to the sections containing it. Subscriptions to a server's config are also
+        notified of changes to the server defaults.
+
+        :param callback: The function to call.
+        :param scope: The server ID, "default" or "global".
+        :param path: The path to the value, starting with the plugin name.
+        :return: The subscription, to be passed to unsubscribe() later.
+        """
+        subscription = ConfigSubscription(callback, scope, path)
+        self.config_subscriptions.setdefault(path[0] if path else None, []).append(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: ConfigSubscription):
+        try:
+            self.config_subscriptions[subscription.path[0] if subscription.path else None].remove(subscription)
+        except (KeyError, ValueError):
+            self.logger.debug(f"Attempted to remove non-existent config subscription {subscription}.")
+
+    def publish_change(self, scope: str, path: tuple[str, ...]):
+        """
+        Notifies all subscribers whose subscriptions overlap with the changed path.
+        """
+        change = ConfigChange(scope, path)
+        if path:
+            candidates = self.config_subscriptions.get(path[0], []) + self.config_subscriptions.get(None, [])
+        else:
+            candidates = [sub for subs in self.config_subscriptions.values() for sub in subs]
+        for subscription in candidates:
+            if subscription.scope != scope and not (scope == "default" and subscription.scope.isdigit()):
+                continue
+            common = min(len(path), len(subscription.path))
+            if path[:common] != subscription.path[:common]:
+                continue
+            # noinspection PyBroadException
+            try:
+                subscription.callback(change)
+            except Exception:
+                self.logger.exception(f"Exception encountered in config subscriber for {scope}/{'/'.join(path)}: ",
+                                      exc_info=True)
 
     def get_plugin_storage(self, plugin: BasePlugin) -> PluginStorageFile:
         guild_id = str(plugin.guild.id)
@@ -124,14 +297,21 @@ class ConfigManager:
         filename = guild_storage_path / (plugin.name + ".json")
 
         storage_file = PluginStorageFile(filename, json_save_args=plugin.storage_save_args(),
-                                         json_load_args=plugin.storage_load_args())
+                                         json_load_args=plugin.storage_load_args(), cache=self.storage_cache)
         self.storage_files.setdefault(guild_id, {})[plugin.name] = storage_file
         return storage_file
 
+    def forget_guild_storage(self, guild_id: str):
+        """
+        Drops all storage files of a guild from memory without writing them, so that purged data isn't written back.
+        """
+        for file in self.storage_files.pop(guild_id, {}).values():
+            self.storage_cache.discard(file)
+
     def save_all_plugin_storage(self):
-        for guild in self.storage_files:
-            for file in guild:
-                file.save()
+        for guild_files in self.storage_files.values():
+            for file in guild_files.values():
+                file.flush()
 
     def is_maintainer(self, user: discord.abc.User):
         return user.id in self.config["global"].get('bot_maintainers', [])
@@ -139,35 +319,342 @@ class ConfigManager:
 # Utility classes
 
 
-class ConfigDict(dict):
+class ConfigDict(MutableMapping):
+    """
+    A layered, read-through view of a section of the config. Each view resolves a chain of layers, from the overrides
+    actually stored in the config down to the defaults, and looks keys up through it, so values are never copied
+    between layers. Writes always go to the topmost layer. Nested sections are returned as views themselves, and lists
+    as ConfigLists, which are copied into the topmost layer when first modified.
+    The resolved chain is cached until the config manager's generation changes. All modifications through a view are
+    published to the config manager's subscribers.
+    """
+    def __init__(self, config_manager: ConfigManager, layers: Optional[Callable[[], list[dict]]] = None,
+                 parent: Optional[ConfigDict] = None, key: Optional[str] = None, scope: Optional[str] = None):
+        self.config_manager = config_manager
+        self._layers = layers
+        self._parent = parent
+        self._key = key
+        self.scope = parent.scope if parent else scope
+        self.path: tuple[str, ...] = (*parent.path, key) if parent else ()
+        self._children: dict[str, ConfigDict | ConfigList] = {}
+        self._chain: list[Optional[dict]] = []
+        self._generation = -1
+
+    def __repr__(self):
+        return f"ConfigDict({self.resolve()})"
 
-    def __init__(self, config: dict[str, JsonValues], default_config: dict[str, JsonValues]):
-        super().__init__()
-        new_dict = default_config | config
-        for k, v in new_dict.items():
-            if isinstance(v, dict):
-                self[k] = ConfigDict(v, default_config.get(k, {}))
+    def _get_chain(self) -> list[Optional[dict]]:
+        """
+        :return: The layers of this section, topmost first. The topmost layer is None if it doesn't exist yet.
+        """
+        if self._generation != self.config_manager.config_generation:
+            if self._parent is None:
+                self._chain = self._layers()
             else:
-                self[k] = v
+                chain = [layer.get(self._key) if layer is not None else None for layer in self._parent._get_chain()]
+                self._chain = [chain[0] if isinstance(chain[0], dict) else None] + \
+                              [layer for layer in chain[1:] if isinstance(layer, dict)]
+            self._generation = self.config_manager.config_generation
+        return self._chain
+
+    def _own(self) -> dict:
+        """
+        :return: The topmost layer of this section, creating it if necessary.
+        """
+        own = self._get_chain()[0]
+        if own is None:
+            own = self._parent._own()[self._key] = {}
+            self.config_manager.invalidate()
+        return own
+
+    def lookup(self, key: str) -> JsonValues:
+        """
+        Returns the raw value of a key from the first layer which has it, without wrapping it in a view.
+        """
+        for layer in self._get_chain():
+            if layer is not None and key in layer:
+                return layer[key]
+        raise KeyError(key)
+
+    def __getitem__(self, key: str) -> JsonValues | ConfigDict | ConfigList:
+        value = self.lookup(key)
+        if isinstance(value, dict):
+            view_type = ConfigDict
+        elif isinstance(value, list):
+            view_type = ConfigList
+        else:
+            return value
+        view = self._children.get(key)
+        if type(view) is not view_type:
+            view = self._children[key] = view_type(self.config_manager, parent=self, key=key)
+        return view
+
+    def __setitem__(self, key: str, value: JsonValues | ConfigDict | ConfigList):
+        if isinstance(value, (ConfigDict, ConfigList)):
+            value = value.resolve()
+        self._own()[key] = value
+        self.config_manager.invalidate()
+        self.config_manager.publish_change(self.scope, (*self.path, key))
+
+    def __delitem__(self, key: str):
+        """
+        Removes a key's override. Keys that are only set in lower layers can't be deleted.
+        """
+        own = self._get_chain()[0]
+        if own is None or key not in own:
+            raise KeyError(key)
+        del own[key]
+        self.config_manager.invalidate()
+        self.config_manager.publish_change(self.scope, (*self.path, key))
+
+    def __iter__(self) -> Iterator[str]:
+        keys = {}
+        for layer in reversed(self._get_chain()):
+            if layer is not None:
+                keys.update(dict.fromkeys(layer))
+        return iter(keys)
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self)
+
+    def __contains__(self, key: str) -> bool:
+        return any(layer is not None and key in layer for layer in self._get_chain())
+
+    def copy(self) -> dict[str, JsonValues]:
+        return self.resolve()
+
+    def resolve(self) -> dict[str, JsonValues]:
+        """
+        :return: A plain, independent dict of the values as currently visible through this view.
+        """
+        return {k: v.resolve() if isinstance(v, (ConfigDict, ConfigList)) else deepcopy(v) for k, v in self.items()}
+
+
+class ConfigList(MutableSequence):
+    """
+    A view of a list in the config. Reads go to whichever layer currently provides the list; the first modification
+    copies it into the topmost layer, so that defaults are never modified through a server's config.
+    """
+    def __init__(self, config_manager: ConfigManager, parent: ConfigDict, key: str):
+        self.config_manager = config_manager
+        self._parent = parent
+        self._key = key
+
+    def __repr__(self):
+        return f"ConfigList({self._current()})"
+
+    def __eq__(self, other):
+        if isinstance(other, ConfigList):
+            other = other._current()
+        return self._current() == other
+
+    def _current(self) -> list:
+        return self._parent.lookup(self._key)
+
+    def _own(self) -> list:
+        own = self._parent._own()
+        if not isinstance(own.get(self._key), list):
+            own[self._key] = deepcopy(self._current())
+            self.config_manager.invalidate()
+        return own[self._key]
+
+    def _changed(self):
+        self.config_manager.publish_change(self._parent.scope, (*self._parent.path, self._key))
+
+    def __getitem__(self, index: int | slice) -> JsonValues:
+        return self._current()[index]
+
+    def __setitem__(self, index: int | slice, value: JsonValues):
+        self._own()[index] = value
+        self._changed()
+
+    def __delitem__(self, index: int | slice):
+        del self._own()[index]
+        self._changed()
+
+    def __len__(self) -> int:
+        return len(self._current())
+
+    def insert(self, index: int, value: JsonValues):
+        self._own().insert(index, value)
+        self._changed()
+
+    def resolve(self) -> list[JsonValues]:
+        return deepcopy(self._current())
 
 
 class PluginStorageFile:
-    def __init__(self, path: Path, json_save_args: Optional[dict] = None, json_load_args: Optional[dict] = None):
+    """
+    A JSON file holding a plugin's persistent data for one guild. The file is only read when its contents are first
+    accessed, and may be evicted from memory again by the StorageCache it belongs to.
+    """
+    def __init__(self, path: Path, json_save_args: Optional[dict] = None, json_load_args: Optional[dict] = None,
+                 cache: Optional[StorageCache] = None):
         self.path = path
         self.json_save_args = {} if json_save_args is None else json_save_args
         self.json_load_args = {} if json_load_args is None else json_load_args
-        self.contents: JsonValues = {}
-        self.load()
+        self.cache = cache
+        self.size = 0
+        self._contents: Optional[JsonValues] = None
+        self._saved_hash: Optional[int] = None
 
     def __repr__(self):
         return f"<PluginStorageFile ({self.path})>"
 
+    @property
+    def contents(self) -> JsonValues:
+        if self._contents is None:
+            self.load()
+        elif self.cache is not None:
+            self.cache.touch(self)
+        return self._contents
+
+    @contents.setter
+    def contents(self, value: JsonValues):
+        self._contents = value
+        if self.cache is not None:
+            self.cache.touch(self)
+
     def load(self):
+        self._contents = {}
+        # A file that doesn't exist yet is as good as saved until something's put in it.
+        self._saved_hash = hash(json.dumps(self._contents, **self.json_save_args))
+        self.size = 0
         if self.path.exists():
             with self.path.open(encoding="utf-8") as fp:
-                self.contents = json.load(fp, **self.json_load_args)
+                text = fp.read()
+            self._contents = json.loads(text, **self.json_load_args)
+            self._saved_hash = hash(text)
+            self.size = len(text)
+        if self.cache is not None:
+            self.cache.loaded(self)
 
     def save(self):
-        if self.contents:
-            with self.path.open("w", encoding="utf-8") as fp:
-                json.dump(self.contents, fp, **self.json_save_args)
+        if self._contents is not None:
+            self._write(json.dumps(self._contents, **self.json_save_args))
+
+    def flush(self) -> bool:
+        """
+        Writes the contents to disk only if they differ from what was last read or written, even if they've been
+        emptied, so that what was deleted doesn't come back when the file is reloaded.
+        :return: True if the file was written.
+        """
+        if self._contents is None:
+            return False
+        text = json.dumps(self._contents, **self.json_save_args)
+        if hash(text) == self._saved_hash:
+            return False
+        self._write(text)
+        return True
+
+    def unload(self, flush: bool = True) -> bool:
+        """
+        Flushes the contents to disk if necessary and drops them from memory.
+        :param flush: Whether to write out unsaved changes first.
+        :return: True if the file was written.
+        """
+        written = flush and self.flush()
+        self._contents = None
+        return written
+
+    def _write(self, text: str):
+        with self.path.open("w", encoding="utf-8") as fp:
+            fp.write(text)
+        self._saved_hash = hash(text)
+        self.size = len(text)
+
+
+class StorageCache:
+    """
+    Keeps track of which storage files are resident in memory, in least-recently-used order. Files that have been idle
+    for longer than the configured TTL, or the least recently used ones when the memory budget is exceeded, are
+    flushed to disk and dropped from memory. They will be transparently reloaded on their next access.
+    """
+    def __init__(self, config: dict[str, JsonValues]):
+        self.logger = logging.getLogger("red_star.config_manager.storage_cache")
+        self.config = config
+        self.resident: OrderedDict[PluginStorageFile, float] = OrderedDict()
+        self.last_sweep = monotonic()
+        self.sweep_task: Optional[asyncio.Task] = None
+        self.stats = {
+            "loads": 0,
+            "flushes": 0,
+            "idle_evictions": 0,
+            "budget_evictions": 0
+        }
+
+    def start(self):
+        """
+        Starts sweeping periodically, so that idle files are evicted even while no files are being accessed.
+        """
+        self.sweep_task = asyncio.get_running_loop().create_task(self._sweep_periodically())
+
+    def stop(self):
+        if self.sweep_task:
+            self.sweep_task.cancel()
+            self.sweep_task = None
+
+    async def _sweep_periodically(self):
+        while True:
+            await asyncio.sleep(self.config["storage_sweep_interval"])
+            # noinspection PyBroadException
+            try:
+                self.sweep()
+            except Exception:
+                self.logger.exception("Exception encountered while sweeping storage files: ", exc_info=True)
+
+    def loaded(self, storage_file: PluginStorageFile):
+        self.stats["loads"] += 1
+        self.touch(storage_file)
+        self.enforce_budget()
+
+    def touch(self, storage_file: PluginStorageFile):
+        now = monotonic()
+        self.resident[storage_file] = now
+        self.resident.move_to_end(storage_file)
+        if now - self.last_sweep > self.config["storage_sweep_interval"]:
+            self.sweep()
+
+    def evict(self, storage_file: PluginStorageFile):
+        self.resident.pop(storage_file, None)
+        if storage_file.unload():
+            self.stats["flushes"] += 1
+
+    def discard(self, storage_file: PluginStorageFile):
+        self.resident.pop(storage_file, None)
+        storage_file.unload(flush=False)
+
+    def sweep(self):
+        """
+        Evicts all files which haven't been accessed within the idle TTL.
+        """
+        now = self.last_sweep = monotonic()
+        cutoff = now - self.config["storage_idle_ttl"]
+        while self.resident:
+            storage_file, last_access = next(iter(self.resident.items()))
+            if last_access > cutoff:
+                break
+            self.logger.debug(f"Evicting idle storage file {storage_file.path}.")
+            self.evict(storage_file)
+            self.stats["idle_evictions"] += 1
+
+    def enforce_budget(self):
+        """
+        Evicts the least recently used files until the resident size fits in the memory budget. The most recently
+        used file is never evicted, even if it alone exceeds the budget.
+        """
+        budget = self.config["storage_memory_budget"]
+        resident_size = self.resident_size
+        while resident_size > budget and len(self.resident) > 1:
+            storage_file = next(iter(self.resident))
+            self.logger.debug(f"Evicting storage file {storage_file.path} to stay within memory budget.")
+            resident_size -= storage_file.size
+            self.evict(storage_file)
+            self.stats["budget_evictions"] += 1
+
+    @property
+    def resident_size(self) -> int:
+        return sum(storage_file.size for storage_file in self.resident)
+
+    def get_stats(self) -> dict[str, int]:
+        return self.stats | {"resident_files": len(self.resident), "resident_size": self.resident_size}
@@ -0,0 +1,142 @@
+from __future__ import annotations
+import asyncio
+import ctypes
+import ctypes.util
+import json
+import logging
+import os
+import struct
+import sys
+
+from typing import TYPE_CHECKING
+if TYPE_CHECKING:
+    from typing import Optional
+    from red_star.config_manager import ConfigManager, JsonValues
+
+# From <sys/inotify.h>
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+inotify_event = struct.Struct("iIII")  # wd, mask, cookie, len; followed by len bytes of file name
+
+
+class ConfigWatcher:
+    """
+    Watches the config file for changes made by hand and applies them to the live configuration without a restart.
+    Uses inotify on Linux, and falls back to polling the file's modification time elsewhere.
+    """
+    debounce_delay = 0.5
+
+    def __init__(self, config_manager: ConfigManager):
+        self.config_manager = config_manager
+        self.config = config_manager.get_global_config("config_manager")
+        self.path = config_manager.config_file_path
+        self.logger = logging.getLogger("red_star.config_watcher")
+        self.inotify_fd: Optional[int] = None
+        self.poll_task: Optional[asyncio.Task] = None
+        self.pending_reload: Optional[asyncio.TimerHandle] = None
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def start(self):
+        if not self.config["config_hot_reload"]:
+            return
+        self.loop = asyncio.get_running_loop()
+        if self._start_inotify():
+            self.logger.debug(f"Watching {self.path} with inotify.")
+        else:
+            self.logger.debug(f"inotify unavailable, polling {self.path} for changes.")
+            self.poll_task = self.loop.create_task(self._poll())
+
+    def stop(self):
+        if self.inotify_fd is not None:
+            self.loop.remove_reader(self.inotify_fd)
+            os.close(self.inotify_fd)
+            self.inotify_fd = None
+        if self.poll_task:
+            self.poll_task.cancel()
+            self.poll_task = None
+        if self.pending_reload:
+            self.pending_reload.cancel()
+            self.pending_reload = None
+
+    def _start_inotify(self) -> bool:
+        if not sys.platform.startswith("linux"):
+            return False
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+            fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        except (OSError, AttributeError):
+            return False
+        if fd < 0:
+            return False
+        # Watch the directory rather than the file, since both we and most editors replace the file when saving.
+        if libc.inotify_add_watch(fd, bytes(self.path.parent), IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE) < 0:
+            os.close(fd)
+            return False
+        self.inotify_fd = fd
+        self.loop.add_reader(fd, self._read_inotify_events)
+        return True
+
+    def _read_inotify_events(self):
+        try:
+            data = os.read(self.inotify_fd, 4096)
+        except BlockingIOError:
+            return
+        offset = 0
+        while offset < len(data):
+            _, _, _, name_len = inotify_event.unpack_from(data, offset)
+            offset += inotify_event.size
+            name = data[offset:offset + name_len].rstrip(b"\0")
+            offset += name_len
+            if name == self.path.name.encode():
+                self._schedule_reload()
+
+    def _schedule_reload(self):
+        # Editors often write in several steps, so wait for things to settle down before reading the file.
+        if self.pending_reload:
+            self.pending_reload.cancel()
+        self.pending_reload = self.loop.call_later(self.debounce_delay,
+                                                   lambda: self.loop.create_task(self.reload()))
+
+    async def _poll(self):
+        last_signature = self._file_signature()
+        while True:
+            await asyncio.sleep(self.config["config_poll_interval"])
+            signature = self._file_signature()
+            if signature is not None and signature != last_signature:
+                last_signature = signature
+                await self.reload()
+
+    def _file_signature(self) -> Optional[tuple[int, int]]:
+        try:
+            stat = self.path.stat()
+        except FileNotFoundError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def _read_config(self) -> tuple[str, JsonValues]:
+        text = self.path.read_text(encoding="utf-8")
+        return text, json.loads(text)
+
+    async def reload(self):
+        """
+        Reads the config file in a worker thread and applies whatever changed to the live config.
+        """
+        self.pending_reload = None
+        try:
+            text, new_config = await self.loop.run_in_executor(None, self._read_config)
+        except FileNotFoundError:
+            return  # Caught in the middle of the file being replaced; there'll be another event once it's back.
+        except json.decoder.JSONDecodeError as e:
+            self.logger.warning(f"Ignoring changes to {self.path}, as it is not valid JSON: {e}")
+            return
+        if hash(text) == self.config_manager.last_saved_hash:
+            return  # Our own save.
+        if not isinstance(new_config, dict) or not isinstance(new_config.get("global"), dict) \
+                or not isinstance(new_config.get("default"), dict):
+            self.logger.warning(f"Ignoring changes to {self.path}, as it is missing the global or default sections.")
+            return
+        self.config_manager.last_saved_hash = hash(text)
+        changes = self.config_manager.apply_config(new_config)
+        if changes:
+            self.logger.info(f"Applied {len(changes)} changed config value(s) from {self.path}.")
@@ -8,13 +8,16 @@ from sys import exc_info, modules
 from types import ModuleType
 from red_star.channel_manager import ChannelManager
 from red_star.command_dispatcher import CommandDispatcher
+from red_star.storage_migrations import run_storage_migrations
 
 from typing import TYPE_CHECKING
 if TYPE_CHECKING:
     from pathlib import Path
     from typing import Type
     from red_star.client import RedStar
-    from red_star.config_manager import ConfigManager, PluginStorageFile, JsonValues
+    from typing import Callable
+    from red_star.config_manager import ConfigManager, ConfigChange, ConfigSubscription, PluginStorageFile, \
+        JsonValues
 
 
 class PluginManager:
@@ -133,6 +136,8 @@ class PluginManager:
         Runs the on_all_plugins_loaded hook after loading all plugins.
         :return:
         """
+        run_storage_migrations(self.config_manager, {str(guild.id) for guild in self.client.guilds},
+                               {name: cls.storage_save_args() for name, cls in self.plugin_classes.items()})
         self.logger.info("Activating plugins.")
         for guild in self.client.guilds:
             await self.activate_server_plugins(guild)
@@ -158,6 +163,7 @@ class PluginManager:
             plugin = self.plugin_classes[name]
             if name not in guild_plugins:
                 self.logger.info(f"Activating plugin {name}.")
+                plugin_inst = None
                 # noinspection PyBroadException
                 try:
                     plugin_inst = plugin(guild,
@@ -168,6 +174,8 @@ class PluginManager:
                     self.command_dispatchers[guild].register_plugin(plugin_inst)
                     guild_plugins[name] = plugin_inst
                 except Exception:
+                    if plugin_inst is not None:
+                        plugin_inst.unsubscribe_all_config()
                     self.logger.exception(
                         f"Error occurred while activating plugin {plugin.name} for server {guild.id}: ",
                         exc_info=True)
@@ -204,6 +212,7 @@ class PluginManager:
                     await plugin.deactivate()
                 except Exception:
                     self.logger.exception(f"Error occurred while deactivating plugin {name}: ", exc_info=True)
+                plugin.unsubscribe_all_config()
                 self.command_dispatchers[guild].deregister_plugin(plugin)
                 del guild_plugins[name]
                 await self.hook_event("on_plugin_deactivated", name)
@@ -292,6 +301,7 @@ class BasePlugin:
         self.plugins = plugins
         self.logger = logging.getLogger(f"red_star.plugin.{self.name}.{guild.id}")
         self.storage_file: PluginStorageFile
+        self.config_subscriptions: list[ConfigSubscription] = []
 
     @property
     def storage(self) -> JsonValues:
@@ -304,7 +314,29 @@ class BasePlugin:
     def storage_load_args(self):
         return {}
 
-    def storage_save_args(self):
+    def subscribe_config(self, callback: Callable[[ConfigChange], None], *path: str,
+                         global_config: bool = False) -> ConfigSubscription:
+        """
+        Calls the callback whenever this plugin's config at the given path changes, for example to rebuild values
+        derived from the config. Subscriptions are removed automatically when the plugin is deactivated.
+
+        :param callback: The function to call with the ConfigChange.
+        :param path: The keys leading to the value. If empty, any change to this plugin's config will be reported.
+        :param global_config: Whether to subscribe to the plugin's global config instead of the server config.
+        :return: The subscription.
+        """
+        scope = "global" if global_config else str(self.guild.id)
+        subscription = self.config_manager.subscribe(callback, scope, (self.name, *path))
+        self.config_subscriptions.append(subscription)
+        return subscription
+
+    def unsubscribe_all_config(self):
+        for subscription in self.config_subscriptions:
+            self.config_manager.unsubscribe(subscription)
+        self.config_subscriptions.clear()
+
+    @classmethod
+    def storage_save_args(cls):
         return {}
 
     async def activate(self):
@@ -5,7 +5,9 @@ import re
 import shlex
 import urllib.request
 import urllib.error
+from collections.abc import MutableMapping, MutableSequence
 from io import BytesIO
+from red_star.config_manager import ConfigDict, ConfigList
 from red_star.plugin_manager import BasePlugin
 from red_star.rs_errors import CommandSyntaxError, UserPermissionError
 from red_star.rs_utils import respond, is_positive, RSArgumentParser, split_message, prompt_for_confirmation
@@ -212,14 +214,14 @@ class BotManagement(BasePlugin):
         elif args.default_config:
             if not self.config_manager.is_maintainer(msg.author):
                 raise UserPermissionError
-            conf_dict = self.config_manager.config["default"].copy()
+            conf_dict = self.config_manager.default_view.resolve()
         elif args.global_config:
             if not self.config_manager.is_maintainer(msg.author):
                 raise UserPermissionError
-            conf_dict = self.config_manager.config["global"].copy()
+            conf_dict = self.config_manager.global_view.resolve()
             conf_dict.pop("token", None)  # Don't want to leak that by accident!
         else:
-            conf_dict = self.config_manager.config[str(msg.guild.id)].copy()
+            conf_dict = self.config_manager.get_server_view(str(msg.guild.id)).resolve()
 
         if args.path.startswith("/"):
             args.path = args.path[1:]
@@ -293,13 +295,13 @@ class BotManagement(BasePlugin):
         elif args.default_config:
             if not self.config_manager.is_maintainer(msg.author):
                 raise UserPermissionError
-            conf_dict = self.config_manager.config["default"]
+            conf_dict = self.config_manager.default_view
         elif args.global_config:
             if not self.config_manager.is_maintainer(msg.author):
                 raise UserPermissionError
-            conf_dict = self.config_manager.config["global"]
+            conf_dict = self.config_manager.global_view
         else:
-            conf_dict = self.config_manager.config[str(msg.guild.id)]
+            conf_dict = self.config_manager.get_server_view(str(msg.guild.id))
 
         try:
             path = args.path
@@ -337,25 +339,30 @@ class BotManagement(BasePlugin):
             raise CommandSyntaxError(f"{final_key} is not a valid integer index.")
         except TypeError:
             raise CommandSyntaxError(f"{args.path} is not a valid path!")
+        if isinstance(orig, (ConfigDict, ConfigList)):
+            orig = orig.resolve()
 
         if args.remove:
-            if isinstance(conf_dict, dict):
-                del conf_dict[final_key]
-            elif isinstance(conf_dict, list):
+            if isinstance(conf_dict, MutableMapping):
+                try:
+                    del conf_dict[final_key]
+                except KeyError:
+                    raise CommandSyntaxError(f"/{path} is a default value and can't be deleted.")
+            elif isinstance(conf_dict, MutableSequence):
                 conf_dict.pop(int(final_key))
             else:
                 raise CommandSyntaxError("Path does not lead to a collection!")
             await respond(msg, f"**ANALYSIS: Config value /{path} deleted successfully.**")
 
         elif args.append:
-            if isinstance(conf_dict[final_key], list):
+            if isinstance(conf_dict[final_key], MutableSequence):
                 conf_dict[final_key].append(value)
                 await respond(msg, f"**ANALYSIS: {value} appended to /{path} successfully.**")
             else:
                 raise CommandSyntaxError("Path does not lead to a list!")
 
         elif args.addkey:
-            if isinstance(conf_dict[final_key], dict):
+            if isinstance(conf_dict[final_key], MutableMapping):
                 conf_dict[final_key][args.addkey] = value
                 await respond(msg, f"**ANALYSIS: Key {args.addkey} with value {value} added to /{path} "
                                    f"successfully.**")
@@ -400,6 +407,24 @@ class BotManagement(BasePlugin):
         else:
             await respond(msg, f"**ANALYSIS: No error in context {args}.**")
 
+    @Command("StorageStats",
+             doc="Shows how much plugin storage is currently held in memory, and how often it has been loaded, "
+                 "flushed and evicted.",
+             category="debug",
+             bot_maintainers_only=True,
+             dm_command=True)
+    async def _storage_stats(self, msg: discord.Message):
+        cache = self.config_manager.storage_cache
+        stats = cache.get_stats()
+        await respond(msg, "**ANALYSIS: Plugin storage statistics:**```\n"
+                           f"Resident files   : {stats['resident_files']}\n"
+                           f"Resident size    : {stats['resident_size']} / "
+                           f"{cache.config['storage_memory_budget']} bytes\n"
+                           f"Loads            : {stats['loads']}\n"
+                           f"Flushes          : {stats['flushes']}\n"
+                           f"Idle evictions   : {stats['idle_evictions']}\n"
+                           f"Budget evictions : {stats['budget_evictions']}```")
+
     @Command("PurgeServerConfig",
              doc="Removes the configuration data for a server that the bot is no longer on.",
              syntax="(server ID, or all)",
@@ -443,10 +468,10 @@ class BotManagement(BasePlugin):
                 self.config_manager.config.pop(target_guild_id)
                 self.config_manager.save_config()
             if guild_in_storage:
+                self.config_manager.forget_guild_storage(target_guild_id)
                 for file in guild_storage_dir.iterdir():
                     file.unlink()
                 guild_storage_dir.rmdir()
-                self.config_manager.storage_files[target_guild_id] = {}
 
             await respond(msg, f"**ANALYSIS: The configuration for server ID {target_guild_id} has been purged.**")
         else:  # Purge all unused data.
@@ -465,11 +490,11 @@ class BotManagement(BasePlugin):
                     self.config_manager.config.pop(server_id)
             self.config_manager.save_config()
             for server_folder in self.config_manager.storage_path.iterdir():
-                if server_folder.name not in guilds_to_ignore:
+                if server_folder.is_dir() and server_folder.name not in guilds_to_ignore:
+                    self.config_manager.forget_guild_storage(server_folder.name)
                     for file in server_folder.iterdir():
                         file.unlink()
                     server_folder.rmdir()
-                    self.config_manager.storage_files[server_folder.name] = {}
 
             await respond(msg, "**ANALYSIS: The configuration data for all servers the bot is not a member of has "
                                "been purged.**")
@@ -514,9 +539,9 @@ class BotManagement(BasePlugin):
         :param key: The index to retrieve.
         :return: The object at the index.
         """
-        if isinstance(obj, dict):
+        if isinstance(obj, MutableMapping):
             return obj[key]
-        elif isinstance(obj, list):
+        elif isinstance(obj, MutableSequence):
             return obj[int(key)]
         else:
             raise TypeError
@@ -82,29 +82,10 @@ class ChannelPrint(BasePlugin):
     log_events = {"print_event"}
 
     async def activate(self):
-        self._port_old_storage()
         self.storage.setdefault("documents", {})
 
-    def _port_old_storage(self):
-        old_storage_path = self.config_manager.config_path / "walls.json"
-        if old_storage_path.exists():
-            with old_storage_path.open(encoding="utf-8") as fp:
-                old_storage = json.load(fp)
-            for guild_id, walls in old_storage.items():
-                try:
-                    new_storage = self.config_manager.storage_files[guild_id][self.name]
-                except KeyError:
-                    self.logger.warn(f"Server with ID {guild_id} not found! Is the bot still in this server?\n"
-                                     f"Skipping conversion of this server's channel print document storage...")
-                    continue
-                new_storage.contents["documents"] = walls
-                new_storage.save()
-                new_storage.load()
-            old_storage_path = old_storage_path.replace(old_storage_path.with_suffix(".json.old"))
-            self.logger.info(f"Old channel print document storage converted to new format. "
-                             f"Old data now located at {old_storage_path} - you may delete this file.")
-
-    def storage_save_args(self):
+    @classmethod
+    def storage_save_args(cls):
         return {'indent': 2, 'ensure_ascii': False}
 
     @Command("Print", "PrintForce",
@@ -263,5 +244,5 @@ class ChannelPrint(BasePlugin):
              bot_maintainers_only=True,
              category="channel_print")
     async def _print_reload(self, msg: discord.Message):
-        self.storage.load()
+        self.storage_file.load()
         await respond(msg, "**AFFIRMATIVE. Printout documents reloaded.**")
@@ -1,15 +1,18 @@
 import datetime
 import json
+import math
 import re
 import discord
-from asyncio import sleep, create_task
+from asyncio import sleep, create_task, Semaphore
 from io import BytesIO
 from os import path
 from red_star.plugin_manager import BasePlugin
 from red_star.command_dispatcher import Command
 from red_star.rs_errors import CommandSyntaxError, UserPermissionError, CustomCommandSyntaxError
-from red_star.rs_utils import respond, find_user, group_items
-from .rs_lisp import lisp_eval, parse, reprint, standard_env, get_args
+from red_star.rs_utils import respond, find_user, group_items, split_message
+from .rs_lisp import parse, reprint, optimize, is_deterministic, dependencies, ProgramCache, ResultCache
+from .rs_lisp_pool import ExecutionPool, CooperativeRun, Sessions, UsageWindow
+from .rs_lisp_store import DataStore
 from subprocess import Popen, PIPE, TimeoutExpired
 from sys import executable
 
@@ -30,16 +33,39 @@ class CustomCommands(BasePlugin):
                   "custom RSLisp language dialect."
     default_config = {
         "cc_prefix": "!!",
-        "cc_limit": 25
+        "cc_limit": 25,
+        "cc_fuel_budget": 1000000,
+        # The fuel each user, and the whole server, may burn running custom commands within the quota window.
+        "cc_user_fuel_quota": 20000000,
+        "cc_guild_fuel_quota": 100000000,
+        "cc_quota_window": 3600
     }
     default_global_config = {
         "rslisp_max_runtime": 5,
+        "rslisp_max_value_size": 1024 * 1024 * 4,  # four megabytes
+        "rslisp_max_allocation": 1024 * 1024 * 64,  # sixty-four megabytes
+        "rslisp_max_depth": 1000,
+        "rslisp_max_output": 10000,
         "rslisp_minify": True,
-        "cc_file_quota": 1024 * 1024,  # one megabyte
+        "rslisp_optimize": True,
+        "cc_file_quota": 1024 * 1024,  # one megabyte, for the data each custom command keeps
+        "cc_cache_size": 1024 * 1024 * 8,  # eight megabytes
+        "cc_result_cache_size": 32,
+        "rslisp_pool_size": 2,
+        "rslisp_yield_interval": 1000,
+        "rslisp_max_sessions": 16,
+        "rslisp_session_ttl": 900,
+        "rslisp_session_size": 1024 * 1024 * 4,  # four megabytes
+        "cc_max_concurrent_runs": 4
     }
     channel_categories = {"no_cc"}
     log_events = {"cc_event"}
     rpn_path = None
+    # Shared between all servers, so that the memory bound is global.
+    program_cache: ProgramCache = None
+    result_cache: ResultCache = None
+    execution_pool: ExecutionPool = None
+    sessions: Sessions = None
 
     async def activate(self):
         # save_args = {'default': lambda o: astuple(o), 'ensure_ascii': False}
@@ -54,39 +80,48 @@ class CustomCommands(BasePlugin):
                 self.rpn_path = rpn_exec
                 break
 
-        self._port_old_storage()
+        if CustomCommands.program_cache is None:
+            CustomCommands.program_cache = ProgramCache(self.global_plugin_config["cc_cache_size"])
+        if CustomCommands.result_cache is None:
+            CustomCommands.result_cache = ResultCache(self.global_plugin_config["cc_result_cache_size"])
+        if CustomCommands.execution_pool is None and self.global_plugin_config["rslisp_pool_size"] > 0:
+            CustomCommands.execution_pool = ExecutionPool(self.global_plugin_config["rslisp_pool_size"],
+                                                          self.global_plugin_config["cc_cache_size"],
+                                                          self.global_plugin_config["rslisp_max_sessions"],
+                                                          self.global_plugin_config["rslisp_session_ttl"],
+                                                          self.global_plugin_config["rslisp_session_size"])
+            await CustomCommands.execution_pool.start()
+        # With a pool, sessions live in its workers instead.
+        if CustomCommands.execution_pool is None and CustomCommands.sessions is None:
+            CustomCommands.sessions = Sessions(self.global_plugin_config["rslisp_max_sessions"],
+                                               self.global_plugin_config["rslisp_session_ttl"],
+                                               self.global_plugin_config["rslisp_session_size"])
 
-        self.bans = self.storage.setdefault("bans", {"cc_create_ban": [], "cc_use_ban": []})
-        self.ccs = self.storage.setdefault("ccs", {})
+        self.running_ccs = Semaphore(self.global_plugin_config["cc_max_concurrent_runs"])
+        self.fuel_usage = UsageWindow(self.config["cc_quota_window"])
+        self.subscribe_config(self._resize_quota_window, "cc_quota_window")
+        self.data_store = DataStore(self.config_manager.storage_path / str(self.guild.id) / "cc_data.sqlite3",
+                                    self.config_manager.storage_cache.config["storage_idle_ttl"])
 
-    def _port_old_storage(self):
-        old_storage_path = self.config_manager.config_path / "ccs.json"
-        if old_storage_path.exists():
-            with old_storage_path.open(encoding="utf-8") as fp:
-                old_storage = json.load(fp)
-            for guild_id, bans in old_storage.pop("bans", {}).items():
-                try:
-                    new_storage = self.config_manager.storage_files[guild_id][self.name]
-                except KeyError:
-                    self.logger.warn(f"Server with ID {guild_id} not found! Is the bot still in this server?\n"
-                                     f"Skipping conversion of this server's CC ban storage...")
-                    continue
-                bans.update(new_storage.contents.get("bans", {}))
-                new_storage.contents["bans"] = bans
-            for guild_id, cc_data in old_storage.items():
-                try:
-                    new_storage = self.config_manager.storage_files[guild_id][self.name]
-                except KeyError:
-                    self.logger.warn(f"Server with ID {guild_id} not found! Is the bot still in this server?\n"
-                                     f"Skipping conversion of this server's CC storage...")
-                    continue
-                cc_data.update(new_storage.contents.get("ccs", {}))
-                new_storage.contents["ccs"] = cc_data
-                new_storage.save()
-                new_storage.load()
-            old_storage_path = old_storage_path.replace(old_storage_path.with_suffix(".json.old"))
-            self.logger.info(f"Old CC storage converted to new format. "
-                             f"Old data now located at {old_storage_path} - you may delete this file.")
+        self.storage.setdefault("bans", {"cc_create_ban": [], "cc_use_ban": []})
+        self.storage.setdefault("ccs", {})
+
+    async def deactivate(self):
+        self.data_store.close()
+
+    # Storage may be evicted from memory and reloaded, so always go through it rather than holding on to references.
+
+    @property
+    def ccs(self) -> dict:
+        return self.storage["ccs"]
+
+    @property
+    def bans(self) -> dict:
+        return self.storage["bans"]
+
+    @bans.setter
+    def bans(self, value: dict):
+        self.storage["bans"] = value
 
     # Event hooks
 
@@ -126,6 +161,8 @@ class CustomCommands(BasePlugin):
                                                                  f"{msg.author}.**",
                                                                  log_type="cc_event")
                             return
+                    if await self._over_fuel_quota(msg):
+                        return
                     await self.run_cc(cmd, msg)
 
     # Commands
@@ -136,12 +173,16 @@ class CustomCommands(BasePlugin):
              bot_maintainers_only=True)
     async def _reloadccs(self, msg: discord.Message):
         self.storage_file.load()
-        self.ccs = self.storage["ccs"]
-        self.bans = self.storage["bans"]
+        self.program_cache.invalidate(str(self.guild.id))
+        self.result_cache.invalidate(str(self.guild.id))
         await respond(msg, "**AFFIRMATIVE. CCS reloaded.**")
 
     @Command("CreateCC", "NewCC",
              doc="Creates a custom command.\n"
+                 "Other custom commands can use its definitions with (import \"name\"), or call it with "
+                 "(runcc \"name\" args).\n"
+                 "It can keep data between runs with (kv-get key default), (kv-set key value) and (kv-incr key "
+                 "amount).\n"
                  "RSLisp Documentation: https://github.com/medeor413/Red_Star/wiki/Custom-Commands",
              syntax="(name) (content, in plain text or in an attached file)",
              category="custom_commands",
@@ -180,13 +221,16 @@ class CustomCommands(BasePlugin):
                 if not re.match(r"^\s*\(.*\)\s*$", content, re.DOTALL):
                     content = content.replace('"', '\\"')
                     content = f'"{content}"'
-                parse(content)
+                ast = parse(content)
             except Exception as err:
                 await respond(msg, f"**WARNING: Custom command is invalid. Error: {err}**")
                 return
             newcc = {
                 "name": name,
-                "content": reprint(parse(content)) if self.global_plugin_config['rslisp_minify'] else content,
+                "content": reprint(ast) if self.global_plugin_config['rslisp_minify'] else content,
+                "optimized": self._optimize(ast),
+                "deterministic": is_deterministic(ast),
+                "dependencies": sorted(dependencies(ast)),
                 "author": msg.author.id,
                 "date_created": datetime.datetime.now().strftime("%Y-%m-%d @ %H:%M:%S"),
                 "last_edited": None,
@@ -218,6 +262,35 @@ class CustomCommands(BasePlugin):
         else:
             raise CommandSyntaxError(f"No such custom command {name}.")
 
+    @Command("ProfileCC",
+             doc="Runs a custom command while recording where it spends its time, and uploads a report of the "
+                 "expressions in it that took the longest as a text file.",
+             syntax="(name) [args]",
+             category="custom_commands",
+             perms={"manage_messages"})
+    async def _profilecc(self, msg: discord.Message):
+        try:
+            _, name, *args = msg.clean_content.split(" ", 2)
+        except ValueError:
+            raise CommandSyntaxError("No name provided.")
+        name = name.lower()
+        if name not in self.ccs:
+            raise CommandSyntaxError(f"No such custom command {name}.")
+        if await self._over_fuel_quota(msg):
+            return
+        # Profiled from its source, so that the positions in the report match what DumpCC gives.
+        request = self._request(msg, self.ccs[name]["content"], name, args[0] if args else "")
+        request["profile"] = True
+        async with msg.channel.typing():
+            response = await self._execute_charged(msg, request)
+            if "profile" not in response:
+                await respond(msg, f"**WARNING: Could not profile custom command {name}: {response['error']}**")
+                return
+            failure = f" The command failed: {response['error']}" if "error" in response else ""
+            await respond(msg, f"**AFFIRMATIVE. Completed profiling of custom command {name}.{failure}**",
+                          file=discord.File(BytesIO(bytes(response["profile"], encoding="utf-8")),
+                                            filename=name + "_profile.txt"))
+
     @Command("EditCC",
              doc="Edits a custom command you created.",
              syntax="(name) (content, in plain text or in an attached file)",
@@ -245,15 +318,19 @@ class CustomCommands(BasePlugin):
             if cc_data["author"] == msg.author.id or \
                     self._editcc.perms.check_optional_permissions("edit_others", msg.author, msg.channel):
                 try:
-                    parse(content)
+                    ast = parse(content)
                 except Exception as err:
                     await respond(msg, f"**WARNING: Custom command is invalid. Error: {err}**")
                     return
-                cc_data["content"] = reprint(parse(content)) if \
-                    self.global_plugin_config['rslisp_minify'] else content
+                cc_data["content"] = reprint(ast) if self.global_plugin_config['rslisp_minify'] else content
+                cc_data["optimized"] = self._optimize(ast)
+                cc_data["deterministic"] = is_deterministic(ast)
+                cc_data["dependencies"] = sorted(dependencies(ast))
                 cc_data["last_edited"] = datetime.datetime.now().strftime("%Y-%m-%d @ %H:%M:%S")
                 self.ccs[name] = cc_data
                 self.storage_file.save()
+                self.program_cache.invalidate(str(self.guild.id), name)
+                self.result_cache.invalidate(str(self.guild.id), name)
                 await respond(msg, f"**ANALYSIS: Custom command {name} edited successfully.**")
             else:
                 raise UserPermissionError(f"You don't own custom command {name}.")
@@ -278,6 +355,9 @@ class CustomCommands(BasePlugin):
                     self._editcc.perms.check_optional_permissions("delete_others", msg.author, msg.channel):
                 del self.ccs[name]
                 self.storage_file.save()
+                self.data_store.delete(name)
+                self.program_cache.invalidate(str(self.guild.id), name)
+                self.result_cache.invalidate(str(self.guild.id), name)
                 await respond(msg, f"**ANALYSIS: Custom command {name} deleted successfully.**")
             else:
                 raise UserPermissionError(f"You don't own custom command {name}.")
@@ -302,9 +382,11 @@ class CustomCommands(BasePlugin):
                 author = str(author)
             else:
                 author = "<Unknown user>"
+            fuel_used = f"\nFuel Used: {cc_data['fuel_used']} / {self.config['cc_fuel_budget']} (last run)" \
+                if "fuel_used" in cc_data else ""
             datastr = f"**ANALYSIS: Information for custom command {name}:**```\nName: {name}\nAuthor: {author}\n" \
                       f"Date Created: {cc_data['date_created']}\n{last_edited}Locked: {cc_locked}\n" \
-                      f"Times Run: {cc_data['times_run']}```"
+                      f"Times Run: {cc_data['times_run']}{fuel_used}```"
             await respond(msg, datastr)
         else:
             await respond(msg, f"**WARNING: No such custom command {name}.**")
@@ -477,29 +559,97 @@ class CustomCommands(BasePlugin):
 
         await respond(msg, f"**Result : [ {' | '.join([str(x) for x in result])} ]**")
 
+    @Command("CCCacheStats",
+             doc="Shows how many parsed custom commands and results of deterministic custom commands are cached, "
+                 "and how often the caches are hit.",
+             category="debug",
+             bot_maintainers_only=True)
+    async def _cccachestats(self, msg: discord.Message):
+        stats = self.program_cache.get_stats()
+        lookups = stats["hits"] + stats["misses"]
+        hit_rate = f"{stats['hits'] / lookups:.1%}" if lookups else "n/a"
+        result_stats = self.result_cache.get_stats()
+        result_lookups = result_stats["hits"] + result_stats["misses"]
+        result_hit_rate = f"{result_stats['hits'] / result_lookups:.1%}" if result_lookups else "n/a"
+        await respond(msg, "**ANALYSIS: Custom command cache statistics:**```\n"
+                           f"Cached programs : {stats['programs']}\n"
+                           f"Cache size      : {stats['size']} / {self.program_cache.max_size} bytes\n"
+                           f"Hits            : {stats['hits']}\n"
+                           f"Misses          : {stats['misses']}\n"
+                           f"Hit rate        : {hit_rate}\n"
+                           f"Evictions       : {stats['evictions']}\n\n"
+                           f"Cached results  : {result_stats['responses']} "
+                           f"(of {result_stats['programs']} commands)\n"
+                           f"Result hits     : {result_stats['hits']}\n"
+                           f"Result misses   : {result_stats['misses']}\n"
+                           f"Result hit rate : {result_hit_rate}```")
+
+    @Command("CCUsage",
+             doc="Shows the fuel the server, and its heaviest users, have burnt running custom commands within the "
+                 "quota window, or that a given user has.",
+             syntax="[user]",
+             category="custom_commands",
+             perms={"manage_messages"})
+    async def _ccusage(self, msg: discord.Message):
+        user_quota = self.config["cc_user_fuel_quota"] or "unlimited"
+        guild_quota = self.config["cc_guild_fuel_quota"] or "unlimited"
+        window = self._duration(self.fuel_usage.window)
+        try:
+            search = msg.content.split(None, 1)[1]
+        except IndexError:
+            result_list = [f"{'Server':<32} | {self.fuel_usage.used()} / {guild_quota}"]
+            for uid, used in self.fuel_usage.top(10):
+                member = msg.guild.get_member(uid)
+                name = member.display_name if member else "<Unknown user>"
+                result_list.append(f"{name:<32} | {used} / {user_quota}")
+            for split_msg in group_items(result_list, f"**ANALYSIS: Custom command fuel burnt in the last {window}:**"):
+                await respond(msg, split_msg)
+            return
+        user = find_user(msg.guild, search)
+        if not user:
+            raise CommandSyntaxError("Not a user, or user not found.")
+        wait = self.fuel_usage.wait(user.id, self.config["cc_user_fuel_quota"])
+        blocked = f"\nOut of fuel for {self._duration(wait)}" if wait else ""
+        await respond(msg, f"**ANALYSIS: Custom command fuel burnt by {user} in the last {window}:**```\n"
+                           f"Fuel used: {self.fuel_usage.used(user.id)} / {user_quota}{blocked}```")
+
     # Custom command machinery
 
     @Command("EvalCC",
-             doc="Evaluates the given string through RSLisp cc parser.",
+             doc="Evaluates the given string through RSLisp cc parser.\n"
+                 "Whatever it defines is kept for your next evaluation, until you reset your session or leave it "
+                 "unused for a while.",
              syntax="(custom command)",
              category="custom_commands",
              perms={"manage_messages"})
     async def _evalcc(self, msg: discord.Message):
         program = msg.content.split(None, 1)[1]
         try:
-            program = parse(program)
+            parse(program)
         except Exception as e:
             await respond(msg, f"**WARNING: Syntax error in custom command:** {e}")
+            return
         try:
-            env = self._env(msg)
-            result = lisp_eval(program, env)
+            response = await self._run_program(msg, program, session=(self.guild.id, msg.author.id))
         except Exception as e:
             await respond(msg, f"**WARNING: Runtime error in custom command:** {e}")
         else:
-            if env['_rsoutput']:
-                await respond(msg, str(env['_rsoutput']))
-            elif result:
-                await respond(msg, str(result))
+            await self._respond_with_output(msg, response)
+
+    @Command("ResetEvalCC", "ResetSession",
+             doc="Forgets everything your EvalCC session has defined, starting you afresh.",
+             category="custom_commands",
+             perms={"manage_messages"})
+    async def _resetevalcc(self, msg: discord.Message):
+        key = (self.guild.id, msg.author.id)
+        if self.execution_pool is None:
+            dropped = self.sessions.drop(key)
+        else:
+            dropped = (await self.execution_pool.run({"drop_session": key}))["dropped"]
+        if dropped:
+            await respond(msg, "**AFFIRMATIVE. Your session has been reset.**")
+        else:
+            await respond(msg, "**ANALYSIS: You have no session to reset.**")
 
     # @Command("UploadCCData",
     #          doc="Uploads a cc-accessible data file in a json format.\n"
@@ -654,11 +804,10 @@ class CustomCommands(BasePlugin):
                 self._createcc.perms.check_optional_permissions("bypass_cc_lock", msg.author, msg.channel):
             await respond(msg, f"**WARNING: Custom command {cmd} is locked.**")
         else:
-            env = self._env(msg)
-
-            cc_data = self.ccs[cmd]["content"]
+            # Commands saved before they were optimized only have their source.
+            cc_data = self.ccs[cmd].get("optimized") or self.ccs[cmd]["content"]
             try:
-                res = lisp_eval(parse(cc_data), env)
+                response = await self._run_program(msg, cc_data, cmd)
             except CustomCommandSyntaxError as e:
                 err = e if e else "Syntax error."
                 await respond(msg, f"**WARNING: Author made syntax error: {err}**")
@@ -670,47 +819,232 @@ class CustomCommands(BasePlugin):
                 self.logger.exception("Exception occurred in custom command: ", exc_info=True)
                 await respond(msg, f"**WARNING: An error occurred while running the custom command: {err}**")
             else:
-                if env['_rsoutput']:
-                    await respond(msg, env['_rsoutput'])
-                elif res:
-                    await respond(msg, str(res))
+                await self._respond_with_output(msg, response)
                 self.ccs[cmd]["times_run"] += 1
+                self.ccs[cmd]["fuel_used"] = response["fuel_used"]
                 self.storage_file.save()
 
-    #  tag functions that *require* the discord machinery
+    async def _run_program(self, msg: discord.Message, source: str, name: str = None, session: tuple = None) -> dict:
+        """
+        Runs a program, then carries out the side effects it asked for.
+        :param msg: The message that ran the program.
+        :param source: The program's source.
+        :param name: The name of the custom command being run, or None for a program that isn't one.
+        :param session: The key of the REPL session to run the program in, if any.
+        :return: The response from running the program, as described in run_program.
+        """
+        # Deterministic custom commands have nothing to do but give the same response to the same arguments.
+        cache_response = name is not None and self._deterministic(name)
+        if cache_response:
+            _, separator, argstring = msg.clean_content.partition(" ")
+            arguments = argstring if separator else None
+            limits = self._limits()
+            response = self.result_cache.get(str(self.guild.id), name, source, limits, arguments)
+            if response is not None:
+                return response
+        request = self._request(msg, source, name)
+        response = await self._execute_charged(msg, request, session)
+        if response.get("session_reset"):
+            await respond(msg, f"**WARNING: Your session went over the limit of "
+                               f"{self.global_plugin_config['rslisp_session_size']} bytes, and has been reset.**")
+
+        for command, *args in response["commands"]:
+            if command == "delcall":
+                self._delcall(msg)
+            elif command == "embed":
+                self._embed(msg, None, *args)
+            elif command == "kv":
+                self.data_store.write(name, *args, self.global_plugin_config["cc_file_quota"])
+
+        if "error" in response:
+            if response["error_type"] == "custom":
+                raise CustomCommandSyntaxError(response["error"])
+            elif response["error_type"] == "command":
+                raise CommandSyntaxError(response["error"])
+            raise RuntimeError(response["error"])
+        if cache_response:
+            self.result_cache.put(str(self.guild.id), name, source, limits, arguments, response)
+        return response
+
+    @staticmethod
+    async def _respond_with_output(msg: discord.Message, response: dict):
+        """
+        Responds with what a program printed, or with its result if it didn't print anything, split across as many
+        messages as it takes.
+        """
+        text = response["output"] or response["result"]
+        if text:
+            for split_msg in split_message(text):
+                await respond(msg, split_msg)
+
+    @staticmethod
+    def _duration(seconds: float) -> str:
+        return str(datetime.timedelta(seconds=math.ceil(seconds)))
+
+    def _deterministic(self, name: str) -> bool:
+        cc_data = self.ccs[name]
+        if "deterministic" not in cc_data:
+            # Commands saved before they were classified are classified the first time they're run.
+            cc_data["deterministic"] = is_deterministic(parse(cc_data["content"]))
+        return cc_data["deterministic"]
+
+    def _dependencies(self, name: str) -> list[str]:
+        cc_data = self.ccs[name]
+        if "dependencies" not in cc_data:
+            # Commands saved before they could import or call others have theirs found the first time they're run.
+            cc_data["dependencies"] = sorted(dependencies(parse(cc_data["content"])))
+        return cc_data["dependencies"]
 
-    def _env(self, msg: discord.Message):
-        cmd = msg.content[len(self.config["cc_prefix"]):].split()[0].lower()
-        env = standard_env(max_runtime=self.global_plugin_config.get('rslisp_max_runtime', 0))
+    def _modules(self, names) -> dict[str, str]:
+        """
+        Gathers the sources of the custom commands a program imports from or calls, along with those they in turn
+        import from or call, to be sent along with it. Locked custom commands are left out.
+        :param names: The names of the custom commands the program imports from or calls.
+        :return: The sources to run them from, by name.
+        """
+        modules = {}
+        pending = list(names)
+        while pending:
+            name = pending.pop()
+            if name in modules or name not in self.ccs or self.ccs[name]["locked"]:
+                continue
+            modules[name] = self.ccs[name].get("optimized") or self.ccs[name]["content"]
+            pending.extend(self._dependencies(name))
+        return modules
 
-        env['username'] = msg.author.name
-        env['usernick'] = msg.author.display_name
-        env['usermention'] = msg.author.mention
+    def _limits(self) -> dict:
+        return {
+            "max_runtime": self.global_plugin_config.get('rslisp_max_runtime', 0),
+            "fuel": self.config["cc_fuel_budget"],
+            "max_value_size": self.global_plugin_config["rslisp_max_value_size"],
+            "max_allocation": self.global_plugin_config["rslisp_max_allocation"],
+            "max_depth": self.global_plugin_config["rslisp_max_depth"],
+            "max_output": self.global_plugin_config["rslisp_max_output"]
+        }
+
+    def _request(self, msg: discord.Message, source: str, name: str = None, argstring: str = None) -> dict:
+        """
+        Builds the request to run a program, as described in run_program.
+        :param msg: The message that ran the program.
+        :param source: The program's source.
+        :param name: The name of the custom command being run, or None for a program that isn't one.
+        :param argstring: The arguments to run the program with, if not those in the message.
+        :return: The request.
+        """
+        return {
+            "source": source,
+            "scope": str(self.guild.id),
+            "name": name,
+            "variables": self._variables(msg, name, argstring),
+            "roles": [role.name.lower() for role in msg.author.roles],
+            "limits": self._limits(),
+            "modules": self._modules(self._dependencies(name) if name is not None else dependencies(parse(source))),
+            "store": None if name is None else {
+                "path": str(self.data_store.path),
+                "cc": name,
+                "used": self.data_store.size(name),
+                "quota": self.global_plugin_config["cc_file_quota"]
+            }
+        }
+
+    async def _execute_charged(self, msg: discord.Message, request: dict, session: tuple = None) -> dict:
+        """
+        Runs a program as _execute does, counting the fuel it burns towards the fuel quotas of whoever ran it.
+        """
+        try:
+            response = await self._execute(request, session)
+        except Exception:
+            # A run that never came back, like one whose worker was killed, counts as having burnt all its fuel.
+            self.fuel_usage.add(msg.author.id, request["limits"]["fuel"])
+            raise
+        self.fuel_usage.add(msg.author.id, response["fuel_used"])
+        return response
+
+    async def _over_fuel_quota(self, msg: discord.Message) -> bool:
+        """
+        Checks whether whoever sent a message, or the server, has used up their custom command fuel for now, telling
+        them how long until they can run custom commands again if so.
+        """
+        if wait := self.fuel_usage.wait(msg.author.id, self.config["cc_user_fuel_quota"]):
+            await respond(msg, f"**WARNING: You have used up your custom command fuel for now. Try again "
+                               f"in {self._duration(wait)}.**")
+            return True
+        if wait := self.fuel_usage.wait(None, self.config["cc_guild_fuel_quota"]):
+            await respond(msg, f"**WARNING: This server has used up its custom command fuel for now. Try "
+                               f"again in {self._duration(wait)}.**")
+            return True
+        return False
+
+    def _resize_quota_window(self, *_):
+        self.fuel_usage.resize(self.config["cc_quota_window"])
+
+    async def _execute(self, request: dict, session: tuple = None) -> dict:
+        """
+        Runs a program in the execution pool, or in the bot's own process a step at a time if there's no pool.
+        Only so many programs run at once on a server; the rest wait.
+        :param request: The program to run, as described in run_program.
+        :param session: The key of the REPL session to run the program in, if any.
+        :return: The response from running the program, as described in run_program, with "session_reset" set if the
+        session was reset for holding on to too much memory.
+        """
+        limits = request["limits"]
+        # Give the program's own deadline a moment to end it cleanly before it's abandoned or its worker is killed.
+        timeout = limits["max_runtime"] + 1 if limits["max_runtime"] else None
+        async with self.running_ccs:
+            if self.execution_pool is not None:
+                if session is not None:
+                    request["session"] = session
+                return await self.execution_pool.run(request, timeout)
+            repl_session = None if session is None else self.sessions.get(session)
+            run = CooperativeRun(request, self.program_cache, self.global_plugin_config["rslisp_yield_interval"],
+                                 repl_session)
+            if repl_session is None:
+                return await run.run(timeout)
+            async with repl_session.lock:
+                response = await run.run(timeout)
+                if repl_session.oversized():
+                    self.sessions.drop(session)
+                    response["session_reset"] = True
+            return response
+
+    def _optimize(self, ast) -> str | None:
+        """
+        Optimizes a custom command into the form it's run in, kept alongside the source it was written in.
+        :param ast: The custom command's parsed source. It's left unmodified.
+        :return: The optimized form of the custom command, or None if optimization is turned off.
+        """
+        if not self.global_plugin_config['rslisp_optimize']:
+            return None
+        return reprint(optimize(ast))
+
+    def _variables(self, msg: discord.Message, cmd: str = None, argstring: str = None) -> dict:
+        if cmd is None:
+            cmd = msg.content[len(self.config["cc_prefix"]):].split()[0].lower()
+        variables = {
+            'username': msg.author.name,
+            'usernick': msg.author.display_name,
+            'usermention': msg.author.mention
+        }
         try:
             author = discord.utils.get(msg.guild.members, id=self.ccs[cmd]['author'])
-            env['authorname'] = author.name
-            env['authornick'] = author.display_name
+            variables['authorname'] = author.name
+            variables['authornick'] = author.display_name
         except (AttributeError, KeyError):
-            env['authorname'] = env['authornick'] = '<Unknown user>'
-        args = msg.clean_content.split(" ", 1)
-        env['argstring'] = args[1] if len(args) > 1 else ''
-        env['args'] = args[1].split(" ") if len(args) > 1 else []
-
-        env['hasrole'] = lambda *x: self._hasrole(msg, *x)
-        env['delcall'] = lambda: self._delcall(msg)
-        env['embed'] = lambda *x: self._embed(msg, *get_args(x))
-        # env['file'] = lambda x: self._file(x)
+            variables['authorname'] = variables['authornick'] = '<Unknown user>'
+        if argstring is None:
+            args = msg.clean_content.split(" ", 1)
+            variables['argstring'] = args[1] if len(args) > 1 else ''
+            variables['args'] = args[1].split(" ") if len(args) > 1 else []
+        else:
+            variables['argstring'] = argstring
+            variables['args'] = argstring.split(" ") if argstring else []
+        return variables
 
-        return env
+    #  tag functions that *require* the discord machinery
 
     def _delcall(self, msg: discord.Message):
         create_task(self._rm_msg(msg))
 
-    @staticmethod
-    def _hasrole(msg: discord.Message, *args: [str]) -> bool:
-        _args = map(str.lower, args)
-        return any([x.name.lower() in _args for x in msg.author.roles])
-
     @staticmethod
     def _embed(msg: discord.Message, _, kwargs: dict[str, str | int | list]):
         embed = discord.Embed(type="rich", colour=16711680)
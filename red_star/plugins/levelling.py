@@ -4,7 +4,6 @@ from red_star.rs_utils import respond, find_user, is_positive, group_items, prom
 from red_star.command_dispatcher import Command
 from red_star.rs_errors import CommandSyntaxError
 import discord
-import json
 
 
 class Levelling(BasePlugin):
@@ -21,27 +20,13 @@ class Levelling(BasePlugin):
     channel_categories = {"no_xp"}
 
     async def activate(self):
-        self._port_old_storage()
         self.storage.setdefault("xp", {})
+        self._compile_xp_settings()
+        self.subscribe_config(self._compile_xp_settings)
 
-    def _port_old_storage(self):
-        old_storage_path = self.config_manager.config_path / "xp.json"
-        if old_storage_path.exists():
-            with old_storage_path.open(encoding="utf-8") as fp:
-                old_storage = json.load(fp)
-            for guild_id, xp_storage in old_storage.items():
-                try:
-                    new_storage = self.config_manager.storage_files[guild_id][self.name]
-                except KeyError:
-                    self.logger.warn(f"Server with ID {guild_id} not found! Is the bot still in this server?\n"
-                                     f"Skipping conversion of this server's XP storage...")
-                    continue
-                new_storage.contents["xp"] = xp_storage
-                new_storage.save()
-                new_storage.load()
-            old_storage_path = old_storage_path.replace(old_storage_path.with_suffix(".json.old"))
-            self.logger.info(f"Old XP storage converted to new format. "
-                             f"Old data now located at {old_storage_path} - you may delete this file.")
+    def _compile_xp_settings(self, *_):
+        cfg = self.config
+        self.xp_settings = (cfg["low_cutoff"], cfg["xp_min"], cfg["xp_max"])
 
     async def on_message(self, msg: discord.Message):
         if not self.channel_manager.channel_in_category("no_xp", msg.channel):
@@ -237,13 +222,13 @@ class Levelling(BasePlugin):
         :param txt:message to calculate the xp for
         :return:
         """
-        spc = self.config
+        low_cutoff, xp_min, xp_max = self.xp_settings
 
-        if len(txt) < spc["low_cutoff"]:
+        if len(txt) < low_cutoff:
             return 0
 
-        t_percent = (len(txt)-spc["low_cutoff"])/(2000-spc["low_cutoff"])
+        t_percent = (len(txt)-low_cutoff)/(2000-low_cutoff)
 
-        t_xp = spc["xp_min"] + (spc["xp_max"]-spc["xp_min"])*t_percent
+        t_xp = xp_min + (xp_max-xp_min)*t_percent
 
         return int(t_xp)
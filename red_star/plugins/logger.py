@@ -25,7 +25,10 @@ class DiscordLogger(BasePlugin):
 
     async def activate(self):
         self.log_message_queue = []
-        self.print_log_messages.change_interval(seconds=self.config["log_output_interval"])
+        self._compile_blacklist()
+        self._update_interval()
+        self.subscribe_config(self._compile_blacklist, "log_event_blacklist")
+        self.subscribe_config(self._update_interval, "log_output_interval")
         self.print_log_messages.start()
 
     async def deactivate(self):
@@ -41,6 +44,12 @@ class DiscordLogger(BasePlugin):
                 self.log_events |= plg_log_events
                 self.logger.debug(f"Registered log events {', '.join(plg_log_events)} from {plg.name}.")
 
+    def _compile_blacklist(self, *_):
+        self.log_event_blacklist = frozenset(self.config["log_event_blacklist"])
+
+    def _update_interval(self, *_):
+        self.print_log_messages.change_interval(seconds=self.config["log_output_interval"])
+
     @tasks.loop(seconds=15)  # Note that this value is loaded from config and altered at runtime.
     async def print_log_messages(self):
         if self.log_message_queue:
@@ -56,7 +65,7 @@ class DiscordLogger(BasePlugin):
             self.log_message_queue.clear()
 
     async def on_message_delete(self, msg: discord.Message):
-        blacklist = self.config["log_event_blacklist"]
+        blacklist = self.log_event_blacklist
         if "message_delete" not in blacklist and msg.author != self.client.user:
             contents, _ = close_markdown(msg.clean_content if msg.clean_content else msg.system_content)
             msg_time = msg.created_at.strftime("%Y-%m-%d @ %H:%M:%S")
@@ -71,7 +80,7 @@ class DiscordLogger(BasePlugin):
                              f"Contents:\n{contents}{attaches.replace('**','')}")
 
     async def on_message_edit(self, before: discord.Message, after: discord.Message):
-        blacklist = self.config["log_event_blacklist"]
+        blacklist = self.log_event_blacklist
         if "message_edit" not in blacklist and after.author != self.client.user:
             old_contents, _ = close_markdown(before.clean_content)
             contents, _ = close_markdown(after.clean_content)
@@ -87,7 +96,7 @@ class DiscordLogger(BasePlugin):
                              f"Old contents:\n{old_contents}\nNew contents:\n{contents}")
 
     async def on_member_update(self, before: discord.Member, after: discord.Member):
-        blacklist = self.config["log_event_blacklist"]
+        blacklist = self.log_event_blacklist
         if "member_update" not in blacklist:
             diff_str = log_str = ""
             if before.name != after.name or before.discriminator != after.discriminator:
@@ -110,7 +119,7 @@ class DiscordLogger(BasePlugin):
             self.logger.info(f"User {after} was modified:\n{log_str}")
 
     async def on_guild_channel_pins_update(self, channel: discord.TextChannel, last_pin: datetime.datetime):
-        blacklist = self.config["log_event_blacklist"]
+        blacklist = self.log_event_blacklist
         if "pin_update" not in blacklist:
             cnt = None
             try:
@@ -126,25 +135,25 @@ class DiscordLogger(BasePlugin):
                              f"{f'Message: {cnt[0]}: {cnt[1]}' if new_pin else ''}")
 
     async def on_member_ban(self, guild: discord.Guild, member: discord.Member):
-        blacklist = self.config["log_event_blacklist"]
+        blacklist = self.log_event_blacklist
         if "member_ban" not in blacklist:
             self.emit_log(f"**ANALYSIS: User {member} was banned.**")
             self.logger.info(f"User {member} was banned in {guild}.")
 
     async def on_member_unban(self, guild: discord.Guild, member: discord.Member):
-        blacklist = self.config["log_event_blacklist"]
+        blacklist = self.log_event_blacklist
         if "member_unban" not in blacklist:
             self.emit_log(f"**ANALYSIS: Ban was lifted from user {member}.**")
             self.logger.info(f"Ban was lifted from user {member} in {guild}")
 
     async def on_member_join(self, member: discord.Member):
-        blacklist = self.config["log_event_blacklist"]
+        blacklist = self.log_event_blacklist
         if "member_join" not in blacklist:
             self.emit_log(f"**ANALYSIS: User {member} has joined the server. User id: `{member.id}`**")
             self.logger.info(f"User {member} has joined {member.guild}. User id: {member.id}.")
 
     async def on_member_remove(self, member: discord.Member):
-        blacklist = self.config["log_event_blacklist"]
+        blacklist = self.log_event_blacklist
         if "member_leave" not in blacklist:
             try:
                 # find audit log entries for kicking of member with our ID, created in last five seconds.
@@ -165,7 +174,7 @@ class DiscordLogger(BasePlugin):
                 self.logger.info(f"User {member} has left {member.guild}. User id: {member.id}.")
 
     async def on_guild_role_update(self, before: discord.Role, after: discord.Role):
-        blacklist = self.config["log_event_blacklist"]
+        blacklist = self.log_event_blacklist
         if "role_update" not in blacklist:
             diff = []
             try:
@@ -223,7 +232,7 @@ class DiscordLogger(BasePlugin):
                              f"{diff}")
 
     async def on_log_event(self, string: str, *, log_type="log_event"):
-        blacklist = self.config["log_event_blacklist"]
+        blacklist = self.log_event_blacklist
         if log_type not in blacklist:
             self.emit_log(string)
             self.logger.info(string)
@@ -1,6 +1,5 @@
 from __future__ import annotations
 import datetime
-import json
 import discord.utils
 from discord.ext import tasks
 from random import choice
@@ -31,24 +30,8 @@ class MOTD(BasePlugin):
     valid_dates = set(valid_months) | valid_month_weeks | valid_weekdays | valid_days
 
     async def activate(self):
-        self._port_old_storage()
         self._display_motd.start()
 
-    def _port_old_storage(self):
-        motds_folder = self.client.storage_dir / "motds"
-        if "motd_file" not in self.config:
-            return
-        old_motd_file = motds_folder / self.config["motd_file"]
-        if old_motd_file.exists():
-            with old_motd_file.open() as fp:
-                old_motds = json.load(fp)
-            self.storage["motds"] = old_motds
-            del self.config["motd_file"]
-            self.config_manager.save_config()
-            self.storage_file.save()
-            self.storage_file.load()
-            self.logger.info("Ported MotD file to new storage system.")
-
     @tasks.loop(time=discord.utils.utcnow().replace(hour=0, minute=0, second=0).timetz())
     async def _display_motd(self):
         date = datetime.date.today()
@@ -5,7 +5,6 @@ import logging
 import re
 import shlex
 import asyncio
-import json
 from datetime import timedelta
 from discord.ext import tasks
 from math import floor, ceil
@@ -72,7 +71,6 @@ class MusicPlayer(BasePlugin):
         self.ydl_options["outtmpl"] = str(self.downloaded_songs_folder /
                                           self.ydl_options.get("outtmpl", "%(id)s-%(extractor)s.%(ext)s"))
 
-        self._port_old_storage()
         self.storage.setdefault("banned_users", [])
 
         if not self.cache_reaper:
@@ -80,26 +78,6 @@ class MusicPlayer(BasePlugin):
             self.cache_reaper.change_interval(seconds=self.global_plugin_config["cache_clear_interval"])
             self.cache_reaper.start()
 
-    def _port_old_storage(self):
-        old_storage_path = self.config_manager.config_path / "music_player.json"
-        if old_storage_path.exists():
-            with old_storage_path.open(encoding="utf-8") as fp:
-                old_storage = json.load(fp)
-            for guild_id, bans in old_storage.get("banned_users", {}).items():
-                try:
-                    new_storage = self.config_manager.storage_files[guild_id][self.name]
-                except KeyError:
-                    self.logger.warn(f"Server with ID {guild_id} not found! Is the bot still in this server?\n"
-                                     f"Skipping conversion of this server's music ban storage...")
-                    continue
-                bans.update(new_storage.contents.get("banned_users", {}))
-                new_storage.contents["banned_users"] = bans
-                new_storage.save()
-                new_storage.load()
-            old_storage_path = old_storage_path.replace(old_storage_path.with_suffix(".json.old"))
-            self.logger.info(f"Old music ban storage converted to new format. "
-                             f"Old data now located at {old_storage_path} - you may delete this file.")
-
     async def deactivate(self):
         if self.player:
             self.player.stop()
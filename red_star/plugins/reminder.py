@@ -3,7 +3,6 @@ from red_star.command_dispatcher import Command
 from red_star.rs_utils import respond, RSArgumentParser, group_items
 from red_star.rs_errors import CommandSyntaxError, ChannelNotFoundError
 import datetime
-import json
 import shlex
 import re
 import discord
@@ -85,10 +84,10 @@ class ReminderPlugin(BasePlugin):
                 return False
 
     async def activate(self):
-        self._port_old_storage()
         self.storage.setdefault("reminders", [])
 
-    def storage_save_args(self):
+    @classmethod
+    def storage_save_args(cls):
         return {'default': lambda obj: obj.as_dict()}
 
     def storage_load_args(self):
@@ -100,25 +99,6 @@ class ReminderPlugin(BasePlugin):
 
         return {'object_hook': lambda obj: _load(obj)}
 
-    def _port_old_storage(self):
-        old_storage_path = self.config_manager.config_path / "reminders.json"
-        if old_storage_path.exists():
-            with old_storage_path.open(encoding="utf-8") as fp:
-                old_storage = json.load(fp)
-            for guild_id, reminders in old_storage.items():
-                try:
-                    new_storage = self.config_manager.storage_files[guild_id][self.name]
-                except KeyError:
-                    self.logger.warn(f"Server with ID {guild_id} not found! Is the bot still in this server?\n"
-                                     f"Skipping conversion of this server's reminder storage...")
-                    continue
-                new_storage.contents["reminders"] = reminders
-                new_storage.save()
-                new_storage.load()
-            old_storage_path = old_storage_path.replace(old_storage_path.with_suffix(".json.old"))
-            self.logger.info(f"Old reminder storage converted to new format. "
-                             f"Old data now located at {old_storage_path} - you may delete this file.")
-
     @Command("Remind",
              syntax="(message) [-d/--delay DD//@HH:MM:SS] [-t/--time DD/MM/YYYY@HH:MM:SS] [-p/--private] ["
                     "-r/--recurring y/m/d###]",
@@ -5,7 +5,6 @@ from red_star.rs_errors import CommandSyntaxError
 import asyncio
 import discord
 import shlex
-import json
 
 
 class MESSAGE_TYPE:
@@ -23,41 +22,19 @@ class RoleRequest(BasePlugin):
         "default_roles": []
     }
 
-    reacts = None
-    passwords = None
-
     async def activate(self):
-        self._port_old_storage()
-        self.reacts = self.storage.setdefault("role_request_reaction_messages", {})
-        self.passwords = self.storage.setdefault("role_password", {})
-        self._port_old_reacts()
-
-    def _port_old_reacts(self):
-        for messageId, config in self.reacts.items():
-            if type(config) == list:
-                self.reacts[messageId] = {
-                    "reacts": config,
-                    "type": MESSAGE_TYPE.NORMAL
-                }
-            elif "required" not in config:
-                config["required"] = []
-
-    def _port_old_storage(self):
-        old_storage_path = self.config_manager.config_path / "role_request_reaction_messages.json"
-        if old_storage_path.exists():
-            with old_storage_path.open(encoding="utf-8") as fp:
-                old_storage = json.load(fp)
-            for msg_id, message_data in old_storage.items():
-                # We have no way to check which guild a message belongs to, so we have no choice but to put all
-                # message IDs in all guilds.
-                for new_storage in self.config_manager.storage_files.values():
-                    plugin_storage = new_storage[self.name]
-                    plugin_storage.contents.setdefault("role_request_reaction_messages", {})[msg_id] = message_data
-                    plugin_storage.save()
-                    plugin_storage.load()
-            old_storage_path = old_storage_path.replace(old_storage_path.with_suffix(".json.old"))
-            self.logger.info(f"Old role request reaction message storage converted to new format. "
-                             f"Old data now located at {old_storage_path} - you may delete this file.")
+        self.storage.setdefault("role_request_reaction_messages", {})
+        self.storage.setdefault("role_password", {})
+
+    # Storage may be evicted from memory and reloaded, so always go through it rather than holding on to references.
+
+    @property
+    def reacts(self) -> dict:
+        return self.storage["role_request_reaction_messages"]
+
+    @property
+    def passwords(self) -> dict:
+        return self.storage["role_password"]
 
     async def on_member_join(self, member: discord.Member):
         """
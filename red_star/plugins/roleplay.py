@@ -125,7 +125,8 @@ class Roleplay(BasePlugin):
     def storage_load_args(self):
         return {"object_hook": self._load_bio}
 
-    def storage_save_args(self):
+    @classmethod
+    def storage_save_args(cls):
         return {"default": lambda obj: obj.as_dict(), "indent": 2, "ensure_ascii": False}
 
     def _load_bio(self, obj: dict) -> Roleplay.Bio | dict:
@@ -139,29 +140,13 @@ class Roleplay(BasePlugin):
                 return obj
 
     async def activate(self):
-        self._port_old_storage()
-        self.bios = self.storage.setdefault("bios", {})
-
-    def _port_old_storage(self):
-        old_storage_path = self.config_manager.config_path / "bios.json"
-        if old_storage_path.exists():
-            with old_storage_path.open(encoding="utf-8") as fp:
-                old_storage = json.load(fp, **self.storage_load_args())
-            for guild_id, data in old_storage.items():
-                old_storage_guild = old_storage.get(guild_id, {})
-                try:
-                    guild_current_storage = self.config_manager.storage_files[guild_id][self.name]
-                except KeyError:
-                    self.logger.warn(f"Server with ID {guild_id} not found! Is the bot still in this server?\n"
-                                     f"Skipping conversion of this server's bio storage...")
-                    continue
-                old_storage_guild.update(guild_current_storage.contents)
-                guild_current_storage.contents = old_storage_guild
-                guild_current_storage.save()
-                guild_current_storage.load()
-            old_storage_path = old_storage_path.replace(old_storage_path.with_suffix(".json.old"))
-            self.logger.info(f"Old bio storage converted to new format. "
-                             f"Old data now located at {old_storage_path} - you may delete this file.")
+        self.storage.setdefault("bios", {})
+
+    # Storage may be evicted from memory and reloaded, so always go through it rather than holding on to references.
+
+    @property
+    def bios(self) -> dict:
+        return self.storage["bios"]
 
     @Command("RaceRole",
              doc="-a/--add   : Adds specified roles to the list of allowed race roles.\n"
@@ -458,7 +443,6 @@ class Roleplay(BasePlugin):
              bot_maintainers_only=True)
     async def _reload_bio(self, msg: discord.Message):
         self.storage_file.load()
-        self.bios = self.storage["bios"]
         await respond(msg, "**AFFIRMATIVE. Bios reloaded from file.**")
 
     @Command("PinBio",
@@ -1,15 +1,27 @@
 # Python Lisp parser
 
+from __future__ import annotations
 import math
 import operator as op
 import re
 import random
+import threading
 import datetime
 import discord.utils
-from time import time
-from collections import OrderedDict
+from sys import getsizeof, maxsize, getrecursionlimit
+from time import time, thread_time
+from contextvars import ContextVar
+from copy import deepcopy
+from collections import Counter, OrderedDict
 from red_star.rs_errors import CustomCommandSyntaxError
-from functools import reduce
+from functools import partial, reduce
+from itertools import accumulate, islice, repeat, takewhile
+from array import array
+from statistics import fmean
+
+from typing import TYPE_CHECKING
+if TYPE_CHECKING:
+    from typing import Callable, Iterable, Iterator
 
 Symbol = str
 Number = (int, float)
@@ -30,44 +42,95 @@ _print = 'print'
 _try = 'try'
 _raise = 'raise'
 
-# temporarily swap a bunch of escaped character into some temporarily values and into un-escaped versions
+# escape sequences, the placeholders they leave in symbols and the characters they stand for in strings
 escapes = (("\\\\", "\uff00", "\\"), ("\\\"", "\uff01", "\""), ("\\n", "\uff02", "\n"), ("\\;", "\uff03", ";"))
-# search for lisp instances -
-# > comments - ;.*?(?:\n|$) - start with ;, end at line end/end of file, whichever is shorter.
-# > strings  - \".*?\"      - start and end with quotes, gets the shortest option.
-# > brackets - \(|\)        - get closing and opening bracket symbols as separate tokens.
-# > tokens   - [^()\";\S]   - get everything that isn't a special char or whitespace.
-tokenizer = re.compile(r";.*?(?:\n|$)|\".*?\"|\(|\)|[^()\";\s]+", re.DOTALL)
+symbol_escapes = {p: r for p, r, _ in escapes}
+string_escapes = {p: c for p, _, c in escapes}
+escape_seq = re.compile(r"\\[\\\"n;]")
+# search for lisp instances, in a single pass -
+# > whitespace - \s+                         - skipped.
+# > comments   - ;[^\n]*\n?                  - start with ;, end at line end/end of file, whichever is shorter.
+# > strings    - "(?:[^"\\]|\\.)*"           - start and end with unescaped quotes.
+# > brackets   - \(|\)                       - get closing and opening bracket symbols as separate tokens.
+# > atoms      - (?:[^()";\s\\]|\\[\\"n;]?)+ - get everything that isn't a special char or whitespace.
+# > stray      - "                           - an unterminated string's opening quote, skipped.
+tokenizer = re.compile(r"""(?P<space>\s+)
+                         |(?P<comment>;[^\n]*\n?)
+                         |"(?P<string>(?:[^"\\]|\\.)*)"
+                         |(?P<open>\()
+                         |(?P<close>\))
+                         |(?P<atom>(?:[^()";\s\\]|\\[\\"n;]?)+)
+                         |(?P<stray>")""", re.DOTALL | re.VERBOSE)
 
 
 class Empty:
     pass
 
 
-def l_escape(string: str) -> str:
-    for p, r, _ in escapes:
-        string = string.replace(p, r)
-    return string
-
-
-def l_restore(string: str) -> str:
-    for _, p, r in escapes:
-        string = string.replace(p, r)
-    return string
-
-
 def l_revert(string: str) -> str:
     for r, _, p in escapes:
         string = string.replace(p, r)
     return string
 
 
-def tokenize(string: str) -> list:
-    return tokenizer.findall(l_escape(string))
+def tokenize(program: str):
+    """
+    Splits a program into tokens. Whitespace and unterminated string quotes are skipped.
+    :param program:
+    :return: An iterator of regex matches, with the token type in lastgroup.
+    """
+    return (m for m in tokenizer.finditer(program) if m.lastgroup not in ("space", "stray"))
+
+
+def position(program: str, index: int) -> str:
+    line = program.count("\n", 0, index) + 1
+    column = index - program.rfind("\n", 0, index)
+    return f"line {line}, column {column}"
 
 
-def parse(program: str):
-    return read_from_tokens(tokenize(program))
+def parse(program: str, spans: dict = None):
+    """
+    Parses the first expression in a program into an RSLisp Abstract Syntax Tree.
+    Works in a single pass over the source without recursion, so there are no limits on nesting.
+    :param program:
+    :param spans: If given, filled with the (start, end) span in the source of each list in the tree, keyed by its id.
+    :return:
+    """
+    stack = []  # lists still being read, with the position of their opening bracket
+    for match in tokenize(program):
+        kind = match.lastgroup
+        if kind == "open":
+            stack.append(([], match.start()))
+            continue
+        elif kind == "close":
+            if not stack:
+                raise CustomCommandSyntaxError(f"unexpected ) at {position(program, match.start())}")
+            value, start = stack.pop()
+            if spans is not None:
+                spans[id(value)] = (start, match.end())
+        elif kind == "comment":
+            if stack:
+                continue
+            value = Empty()
+        elif kind == "string":
+            value = match.group("string")
+            if "\\" in value:
+                value = escape_seq.sub(lambda m: string_escapes[m.group()], value)
+            value = ['quote', value]
+            if spans is not None:
+                spans[id(value)] = match.span()
+        else:
+            value = match.group("atom")
+            if "\\" in value:
+                value = escape_seq.sub(lambda m: symbol_escapes[m.group()], value)
+            value = atom(value)
+        if not stack:
+            return value
+        stack[-1][0].append(value)
+    if stack:
+        raise CustomCommandSyntaxError(f"unexpected EOF while reading: ( at {position(program, stack[-1][1])} "
+                                       f"is never closed")
+    raise CustomCommandSyntaxError('unexpected EOF while reading')
 
 
 def joiner(iterable):
@@ -102,31 +165,233 @@ def minify(program: [str, list]):
     return reprint(program if isinstance(program, list) else parse(program))
 
 
-def read_from_tokens(tokens):
-    if len(tokens) == 0:
-        raise CustomCommandSyntaxError('unexpected EOF while reading')
-    token = tokens.pop(0)
+def ast_size(ast) -> int:
+    """
+    Roughly estimates the memory used by an RSLisp Abstract Syntax Tree.
+    :param ast:
+    :return:
+    """
+    if isinstance(ast, list):
+        return getsizeof(ast) + sum(ast_size(x) for x in ast)
+    return getsizeof(ast)
 
-    if token[0] == token[-1] == '"':
-        return ['quote', l_restore(token[1:-1])]
 
-    elif '(' == token:
-        token_list = []
-        while tokens[0] != ')':
-            t = read_from_tokens(tokens)
-            if not isinstance(t, Empty) and t != '':
-                token_list.append(t)
-        tokens.pop(0)
-        return token_list
+class ProgramCache:
+    """
+    An LRU cache of compiled programs, so that frequently run custom commands aren't parsed and compiled on every run.
+    Programs are keyed by scope and name, and recompiled whenever their source changes.
+    The cache is bounded by the estimated size of the syntax trees it holds.
+    Programs run on threads of their own in the bot's process get their imports from it while the bot changes it, so
+    it's only ever used under its lock.
+    """
 
-    elif token.startswith(';'):
-        return Empty()
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self.programs = OrderedDict()  # (scope, name): (source hash, program, size)
+        self.size = 0
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0}
+        self.lock = threading.RLock()
+
+    def get(self, scope: str, name: str, source: str):
+        """
+        Gets the compiled program for the given source, compiling it if it isn't cached.
+        :param scope: The scope the program belongs to, such as a guild ID.
+        :param name: The name of the program.
+        :param source: The source of the program.
+        :return: The compiled program, to be called with the environment to run it in.
+        """
+        key = (scope, name)
+        source_hash = hash(source)
+        with self.lock:
+            try:
+                cached_hash, program, _ = self.programs[key]
+            except KeyError:
+                pass
+            else:
+                if cached_hash == source_hash:
+                    self.programs.move_to_end(key)
+                    self.stats["hits"] += 1
+                    return program
+            self.stats["misses"] += 1
+        ast = parse(source)
+        program = compile_ast(ast)
+        size = ast_size(ast)
+        with self.lock:
+            self.invalidate(scope, name)
+            if size <= self.max_size:
+                self.programs[key] = (source_hash, program, size)
+                self.size += size
+                while self.size > self.max_size:
+                    _, (_, _, evicted_size) = self.programs.popitem(last=False)
+                    self.size -= evicted_size
+                    self.stats["evictions"] += 1
+        return program
+
+    def invalidate(self, scope: str, name: str = None):
+        """
+        Drops a program, or all programs in a scope if no name is given, from the cache.
+        """
+        with self.lock:
+            if name is not None:
+                keys = [(scope, name)] if (scope, name) in self.programs else []
+            else:
+                keys = [key for key in self.programs if key[0] == scope]
+            for key in keys:
+                self.size -= self.programs.pop(key)[2]
 
-    elif ')' == token:
-        raise CustomCommandSyntaxError('unexpected )')
-    else:
-        # regexp strips leading/trailing whitespace
-        return atom(re.sub(r"^\s+|\s+$", "", token))
+    def get_stats(self) -> dict[str, int]:
+        with self.lock:
+            return self.stats | {"programs": len(self.programs), "size": self.size}
+
+
+class ResultCache:
+    """
+    An LRU cache of the responses of deterministic programs to the arguments they're run with, so that running them
+    again with the same arguments doesn't have to evaluate them at all.
+    Each program keeps up to max_entries responses, and loses them all whenever its source or the limits it's run
+    under change, since a run that ran out of fuel or output under the old limits might not under the new ones.
+    """
+    # Responses with more output than this aren't worth the memory.
+    max_response_length = 1 << 16
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self.programs = {}  # (scope, name): (hash of source and limits, OrderedDict of arguments: response)
+        self.stats = {"hits": 0, "misses": 0}
+
+    @staticmethod
+    def _hash(source: str, limits: dict) -> int:
+        return hash((source, tuple(sorted(limits.items()))))
+
+    def get(self, scope: str, name: str, source: str, limits: dict, arguments) -> dict | None:
+        """
+        Gets the response the given source gave the last time it was run with the given arguments.
+        :param scope: The scope the program belongs to, such as a guild ID.
+        :param name: The name of the program.
+        :param source: The source of the program.
+        :param limits: The limits the program is being run under, as in a request.
+        :param arguments: The arguments the program is being run with.
+        :return: The response, or None if there isn't one cached.
+        """
+        try:
+            source_hash, responses = self.programs[(scope, name)]
+            if source_hash == self._hash(source, limits):
+                response = responses[arguments]
+                responses.move_to_end(arguments)
+                self.stats["hits"] += 1
+                return response
+        except KeyError:
+            pass
+        self.stats["misses"] += 1
+        return None
+
+    def put(self, scope: str, name: str, source: str, limits: dict, arguments, response: dict):
+        """
+        Caches the response a program gave to the given arguments. See get for the parameters.
+        """
+        if len(response["result"]) + len(response["output"]) > self.max_response_length:
+            return
+        source_hash = self._hash(source, limits)
+        cached = self.programs.get((scope, name))
+        if cached is None or cached[0] != source_hash:
+            cached = self.programs[(scope, name)] = (source_hash, OrderedDict())
+        responses = cached[1]
+        responses[arguments] = response
+        responses.move_to_end(arguments)
+        while len(responses) > self.max_entries:
+            responses.popitem(last=False)
+
+    def invalidate(self, scope: str, name: str = None):
+        """
+        Drops the responses of a program, or of all programs in a scope if no name is given.
+        """
+        if name is not None:
+            self.programs.pop((scope, name), None)
+        else:
+            for key in [key for key in self.programs if key[0] == scope]:
+                del self.programs[key]
+
+    def get_stats(self) -> dict[str, int]:
+        return self.stats | {"programs": len(self.programs),
+                             "responses": sum(len(responses) for _, responses in self.programs.values())}
+
+
+class Modules:
+    """
+    The other custom commands a run can import the definitions of, with (import "name" "definition"...), or call like
+    procedures, with (runcc "name" args...). Each runs in a global environment of its own, starting out like the run's,
+    but burns the run's fuel and prints to the run's output.
+    A library only runs once per run however many times it's imported, and its definitions whose names start with an
+    underscore stay private to it. A custom command that ends up depending on itself is refused.
+    """
+
+    def __init__(self, sources: dict[str, str], scope: str, cache: ProgramCache, env: GlobalEnv, name: str = None):
+        """
+        Adds import and runcc to the run's global environment.
+        :param sources: The sources of the custom commands that can be imported or called, by name.
+        :param scope: The scope the custom commands are cached under.
+        :param cache: The cache to get their compiled programs from.
+        :param env: The run's global environment, with everything the run starts with.
+        :param name: The name of the custom command being run, or None for a program that isn't one.
+        """
+        self.sources = sources
+        self.scope = scope
+        self.cache = cache
+        self.meter = env.meter
+        self.install(env)
+        self.variables = dict(env)
+        self.running = [] if name is None else [name]
+        self.exports = {}  # name: {definition name: value}
+
+    def install(self, env: GlobalEnv):
+        env['import'] = lambda name, *names: self.import_(env, name, names)
+        env['runcc'] = self.run
+
+    def _env(self, **variables) -> GlobalEnv:
+        env = GlobalEnv(base_env, self.meter)
+        env.update(self.variables, **variables)
+        self.install(env)
+        return env
+
+    def _run(self, name: str, env: GlobalEnv):
+        if name in self.running:
+            raise CustomCommandSyntaxError(f"custom command {name} depends on itself: "
+                                           f"{' -> '.join([*self.running, name])}")
+        try:
+            source = self.sources[name]
+        except KeyError:
+            raise CustomCommandSyntaxError(f"no custom command {name}") from None
+        program = self.cache.get(self.scope, name, source)
+        self.running.append(name)
+        try:
+            return program(env)
+        finally:
+            self.running.pop()
+
+    def import_(self, env: GlobalEnv, name: str, names: tuple):
+        """
+        Defines the given definitions of a library in an environment, or all of them if none are given.
+        """
+        name = str(name).lower()
+        if name not in self.exports:
+            library = self._env()
+            self._run(name, library)
+            self.exports[name] = {var: value for var, value in library.items()
+                                  if var not in self.variables and not str(var).startswith('_')}
+        exports = self.exports[name]
+        for var in names or exports:
+            try:
+                env[var] = exports[var]
+            except KeyError:
+                raise CustomCommandSyntaxError(f"custom command {name} doesn't define {var}") from None
+
+    def run(self, name: str, *args):
+        """
+        Runs a custom command with the given arguments, returning its result.
+        """
+        argstring = " ".join(map(str, args))
+        env = self._env(argstring=argstring, args=argstring.split(" ") if argstring else [])
+        return self._run(str(name).lower(), env)
 
 
 def atom(token: str):
@@ -150,30 +415,452 @@ def atom(token: str):
 
 # A user-defined Scheme procedure.
 class Procedure(object):
-    def __init__(self, params, body, env):
-        self.parms, self.body, self.env = params, body, env
+    def __init__(self, params, code, steps: Steps, env, scope=None):
+        self.parms, self.code, self.steps, self.env, self.scope = params, code, steps, env, scope
 
     def __call__(self, *args):
-        return lisp_eval(self.body, Env(self.parms, args, self.env))
+        return self.call(args)
+
+    def call(self, args):
+        """
+        Calls the procedure, then every procedure it tail calls in turn, without going any deeper for them.
+        Compiled code calls this directly, rather than calling the procedure, so that recursion stays within Python.
+        Once calls are nested too deep for Python, they carry on on an explicit stack instead, through run_on_stack.
+        """
+        meter = self.env.meter
+        if meter.depth >= meter.max_depth:
+            raise _depth_error(meter)
+        if meter.depth >= meter.native_depth:
+            return run_on_stack(self, args)
+        meter.depth += 1
+        proc = self
+        try:
+            while True:
+                meter.fuel -= 1
+                if meter.fuel < meter.checkpoint:
+                    meter.check()
+                if proc.scope is None:
+                    result = proc.code(Env(proc.parms, args, proc.env))
+                else:
+                    result = proc.code(Frame(proc.scope, args, proc.env))
+                if type(result) is not TailCall:
+                    return result
+                proc, args = result.proc, result.args
+        finally:
+            meter.depth -= 1
+
+    def start(self, args):
+        """
+        Starts a call of the procedure on an explicit stack.
+        :return: The generator running its body, as compiled by compile_steps.
+        """
+        meter = self.env.meter
+        meter.fuel -= 1
+        if meter.fuel < meter.checkpoint:
+            meter.check()
+        if self.scope is None:
+            return self.steps(Env(self.parms, args, self.env))
+        return self.steps(Frame(self.scope, args, self.env))
+
+
+def _depth_error(meter: Meter) -> CustomCommandSyntaxError:
+    return CustomCommandSyntaxError(f"The command went over the limit of {meter.max_depth} nested calls.")
+
+
+class Steps:
+    """
+    The body of a procedure compiled by compile_steps, for when it's called on an explicit stack. Only compiled the
+    first time that happens, since most procedures are never called that deep.
+    """
+    __slots__ = ("body", "scope", "profiler", "code")
+
+    def __init__(self, body, scope: Scope | None, profiler: Profiler | None):
+        self.body = body
+        self.scope = scope
+        self.profiler = profiler
+        self.code = None
+
+    def __call__(self, env):
+        if self.code is None:
+            token = profiling.set(self.profiler)
+            try:
+                self.code = compile_steps(self.body, self.scope, tail=True)
+            finally:
+                profiling.reset(token)
+        return self.code(env)
+
+
+def run_on_stack(proc: Procedure, args):
+    """
+    Calls a procedure, making the calls nested in it on an explicit stack rather than in Python, so that they can
+    nest as deep as the run's limit allows. Procedure bodies run as generators, which yield the calls they make as
+    (procedure, arguments), and are sent back their results, or have their errors thrown into them.
+    """
+    meter = proc.env.meter
+    depth = meter.depth
+    meter.depth += 1
+    stack = []  # The calls waiting on the calls they made, innermost last.
+    try:
+        code = proc.start(args)
+        value = error = None
+        while True:
+            try:
+                request = code.send(value) if error is None else code.throw(error)
+                value = error = None
+            except StopIteration as returned:
+                value, error = returned.value, None
+                if type(value) is TailCall:
+                    try:
+                        code, value = value.proc.start(value.args), None
+                        continue
+                    except Exception as e:
+                        value, error = None, e
+                if not stack:
+                    if error is not None:
+                        raise error
+                    return value
+                code = stack.pop()
+                meter.depth -= 1
+                continue
+            except Exception as e:
+                if not stack:
+                    raise
+                code, value, error = stack.pop(), None, e
+                meter.depth -= 1
+                continue
+            callee, callee_args = request
+            try:
+                if meter.depth >= meter.max_depth:
+                    raise _depth_error(meter)
+                callee_code = callee.start(callee_args)
+            except Exception as e:
+                error = e
+                continue
+            stack.append(code)
+            meter.depth += 1
+            code = callee_code
+    finally:
+        meter.depth = depth
+
+
+class TailCall:
+    """
+    Returned by a procedure call in tail position in place of making the call, for the procedure it returns from to
+    make instead, so that tail calls don't nest.
+    """
+    __slots__ = ("proc", "args")
+
+    def __init__(self, proc: Procedure, args: list):
+        self.proc = proc
+        self.args = args
 
 
 class Env(dict):
-    def __init__(self, params=(), args=(), outer=None, max_runtime=0):
+    def __init__(self, params=(), args=(), outer=None, meter: Meter = None):
         super().__init__()
         self.update(zip(params, args))
         self.outer = outer
-        self.timestamp = time()
-        self.max_runtime = max_runtime
+        if outer is None:
+            self.globals = self
+            self.base = {}
+            self.meter = meter or Meter()
+        else:
+            self.globals = outer.globals
+            self.meter = outer.meter
 
     # Find the innermost Env where var appears.
     def find(self, var):
-        if var in self:
-            return self
-        elif self.outer:
-            return self.outer.find(var)
-        else:
+        env = self
+        while True:
+            if var in env:
+                return env
+            if env.outer is None:
+                break
+            env = env.outer
+        # Variables of the base environment are found in the global environment laid over it, so that assigning
+        # them doesn't modify the base.
+        if var in env.base:
+            return env
+        raise CustomCommandSyntaxError(f'undefined var {var}')
+
+
+class GlobalEnv(Env):
+    """
+    The global environment of a single run: the run's own variables, laid over a shared base environment.
+    The base environment is never modified; defining or assigning one of its variables shadows it for this run.
+    """
+
+    def __init__(self, base: dict, meter: Meter = None):
+        super().__init__(meter=meter)
+        self.base = base
+
+    def __missing__(self, var):
+        return self.base[var]
+
+
+# Marks a slot whose variable hasn't been bound yet, either because the procedure was called with too few arguments
+# or because it hasn't reached the define yet. Lookups of unbound variables carry on into the enclosing environment.
+UNBOUND = Empty()
+
+
+class Scope:
+    """
+    The variables of a procedure, as known at compile time: its parameters followed by everything it defines.
+    A dynamic scope is one whose variables can't be known in advance, because it evaluates code built at runtime.
+    """
+
+    def __init__(self, params: tuple, defines: tuple, parent: Scope = None, dynamic: bool = False):
+        self.names = params + tuple(name for name in defines if name not in params)
+        self.index = {name: i for i, name in enumerate(self.names)}
+        self.param_count = len(params)
+        self.unbound = [UNBOUND] * len(self.names)
+        self.parent = parent
+        self.dynamic = dynamic
+
+
+class Frame:
+    """
+    The variables of a procedure call, held in slots laid out by its Scope.
+    Compiled code addresses them by slot, but they can also be looked up by name like an Env.
+    """
+    __slots__ = ("slots", "scope", "outer", "globals", "meter")
+
+    def __init__(self, scope: Scope, args: tuple, outer: Env | Frame):
+        self.slots = [*args[:scope.param_count], *scope.unbound[min(len(args), scope.param_count):]]
+        self.scope = scope
+        self.outer = outer
+        self.globals = outer.globals
+        self.meter = outer.meter
+
+    def __contains__(self, var):
+        i = self.scope.index.get(var)
+        return i is not None and self.slots[i] is not UNBOUND
+
+    def __getitem__(self, var):
+        if var not in self:
+            raise KeyError(var)
+        return self.slots[self.scope.index[var]]
+
+    def __setitem__(self, var, value):
+        try:
+            self.slots[self.scope.index[var]] = value
+        except KeyError:
             raise CustomCommandSyntaxError(f'undefined var {var}')
 
+    find = Env.find
+
+
+# Fuel is charged per unit of work, so that a program's limits don't depend on how busy the host is.
+# A unit is about what a call to a procedure costs; builtins that go through whole lists or strings charge one unit
+# for every ITEMS_PER_FUEL items they handle.
+ITEMS_PER_FUEL = 64
+# Procedure calls nest in Python while they fit in the process's recursion limit, allowing this many frames for each.
+FRAMES_PER_CALL = 16
+# Frames left over for whatever the run was started from.
+BASE_FRAMES = 200
+
+
+def max_nesting() -> int:
+    """
+    :return: The number of procedure calls a run can nest in Python within the process's recursion limit, before
+    carrying on with the calls it nests on an explicit stack.
+    """
+    return max(0, (getrecursionlimit() - BASE_FRAMES) // FRAMES_PER_CALL)
+
+
+class Meter:
+    """
+    Keeps count of the fuel a run burns and the memory it allocates, ending the run once it goes over its limits.
+    The wall clock is only looked at every check_interval units, as a backstop for the work fuel doesn't account for.
+    """
+    __slots__ = ("budget", "fuel", "checkpoint", "check_interval", "deadline", "max_value_size", "max_allocation",
+                 "allocated", "max_depth", "native_depth", "depth", "pause")
+
+    def __init__(self, fuel: int = 0, max_runtime: float = 0, max_value_size: int = 0, max_allocation: int = 0,
+                 max_depth: int = 1000, check_interval: int = 256, pause: Callable[[], None] = None):
+        """
+        :param fuel: The fuel the run may use, or 0 for no limit.
+        :param max_runtime: The seconds the run may take, or 0 for no limit.
+        :param max_value_size: The bytes any one value the run builds may take up, or 0 for no limit.
+        :param max_allocation: The bytes the run may allocate in total, or 0 for no limit.
+        :param max_depth: The number of procedure calls the run may nest, not counting tail calls.
+        :param check_interval: The fuel the run burns between checks of the wall clock.
+        :param pause: A function to call at every check, which may pause the run before returning.
+        """
+        self.check_interval = check_interval
+        self.pause = pause
+        self.budget = fuel or maxsize
+        self.fuel = self.budget
+        self.deadline = time() + max_runtime if max_runtime else None
+        self.checkpoint = self.fuel - self.check_interval
+        self.max_value_size = max_value_size or maxsize
+        self.max_allocation = max_allocation or maxsize
+        self.allocated = 0
+        self.max_depth = max_depth
+        # Calls deeper than this are made on an explicit stack, so that they don't run into the recursion limit.
+        self.native_depth = max_nesting()
+        self.depth = 0
+
+    @property
+    def used(self) -> int:
+        return self.budget - self.fuel
+
+    def restart(self, meter: Meter):
+        """
+        Starts metering a new run with another meter's limits, for a run carrying on with values from an earlier one,
+        which keep hold of the meter they were made with.
+        """
+        for name in self.__slots__:
+            setattr(self, name, getattr(meter, name))
+
+    def charge(self, amount: int):
+        self.fuel -= amount
+        if self.fuel < self.checkpoint:
+            self.check()
+
+    def check(self):
+        if self.fuel < 0:
+            raise CustomCommandSyntaxError("The command ran out of fuel.")
+        if self.deadline is not None and time() > self.deadline:
+            raise CustomCommandSyntaxError("The command ran too long.")
+        if self.pause is not None:
+            self.pause()
+        self.checkpoint = max(self.fuel - self.check_interval, 0)
+
+    def check_size(self, size: int):
+        """
+        Checks a value that's about to be built isn't too big, so that it's refused before taking up any memory.
+        """
+        if size > self.max_value_size:
+            raise CustomCommandSyntaxError(f"The command tried to build a value of {size} bytes, over the limit of "
+                                           f"{self.max_value_size} bytes.")
+
+    def allocate(self, size: int):
+        self.check_size(size)
+        self.allocated += size
+        if self.allocated > self.max_allocation:
+            raise CustomCommandSyntaxError("The command ran out of memory.")
+
+
+class Output:
+    """
+    What a program prints, gathered up piece by piece rather than by building an ever longer string, up to a limit.
+    Works as a string as far as programs reading their own output are concerned.
+    """
+    __slots__ = ("pieces", "length", "max_length")
+
+    def __init__(self, max_length: int = 0):
+        """
+        :param max_length: The most characters the program may print, or 0 for no limit.
+        """
+        self.pieces = []
+        self.length = 0
+        self.max_length = max_length or maxsize
+
+    def write(self, text: str):
+        if self.length + len(text) > self.max_length:
+            raise CustomCommandSyntaxError(f"The command printed more than the limit of {self.max_length} "
+                                           f"characters.")
+        self.length += len(text)
+        self.pieces.append(text)
+
+    def __str__(self):
+        return "".join(self.pieces)
+
+    def __repr__(self):
+        return repr(str(self))
+
+    def __len__(self):
+        return self.length
+
+    def __eq__(self, other):
+        return str(self) == other
+
+    def __add__(self, other):
+        return str(self) + other
+
+    def __radd__(self, other):
+        return other + str(self)
+
+
+# Sequences are built into lists this many items at a time, checking the list isn't getting too big between each.
+SEQ_CHUNK_SIZE = 4096
+
+
+class Seq:
+    """
+    A sequence whose items are only worked out once they're needed, built by lmap, lfilter and the other lazy builtins.
+    Each stage of a pipeline wraps the one before it, so items are pulled through the whole pipeline one at a time
+    without building a list between stages, and only as many as the end of the pipeline asks for.
+    Going through a sequence streams it again each time, or carries on where it left off for a source that can only
+    be gone through once, like imap's. Printing it, taking its len or indexing it builds its items into a list, which
+    is kept. Items pulled from the source of a pipeline are charged to the meter of the run that built it, as is the
+    list.
+    """
+    __slots__ = ("stage", "sources", "meter", "items")
+
+    def __init__(self, stage: Callable[..., Iterator], *sources: Iterable):
+        """
+        :param stage: A function that takes an iterator over each of the sources and returns one over the items.
+        :param sources: What the items are worked out from, other sequences or anything else that can be iterated.
+        """
+        self.stage = stage
+        self.sources = sources
+        self.meter = next((source.meter for source in sources if type(source) is Seq), None)
+        self.items = None
+
+    def _pull(self, source: Iterable) -> Iterator:
+        if type(source) is Seq or self.meter is None:
+            return iter(source)  # Another sequence charges for its own source.
+        return _charged(source, self.meter)
+
+    def __iter__(self):
+        if self.items is not None:
+            return iter(self.items)
+        return self.stage(*map(self._pull, self.sources))
+
+    def force(self) -> list:
+        """
+        Builds the items into a list, if they haven't been already.
+        """
+        if self.items is None:
+            items = []
+            meter = self.meter
+            it = iter(self)
+            while True:
+                count = len(items)
+                items.extend(islice(it, SEQ_CHUNK_SIZE))
+                if len(items) == count:
+                    break
+                if meter is not None:
+                    meter.check_size(getsizeof(items))
+                    meter.allocate((len(items) - count) * 8)
+            self.items = items
+        return self.items
+
+    def __len__(self):
+        return len(self.force())
+
+    def __getitem__(self, index):
+        return self.force()[index]
+
+    def __eq__(self, other):
+        return self.force() == (other.force() if type(other) is Seq else other)
+
+    def __str__(self):
+        return str(self.force())
+
+    def __repr__(self):
+        return repr(self.force())
+
+
+def _charged(items: Iterable, meter: Meter) -> Iterator:
+    # Charges a unit of fuel for every ITEMS_PER_FUEL items pulled from the source of a sequence.
+    for i, item in enumerate(items, 1):
+        if not i % ITEMS_PER_FUEL:
+            meter.charge(1)
+        yield item
+
 
 def get_args(args: list) -> (list, dict):
     t_list = [*args]
@@ -248,9 +935,108 @@ def _sorted(iterable, *args):  # (sort iterable key reversed)
             kwargs['key'] = args[0]
         if len(args) > 1:
             kwargs['reverse'] = bool(args[1])
+    if type(iterable) is array:
+        return array(iterable.typecode, sorted(iterable, **kwargs))
     return sorted(iterable, **kwargs)
 
 
+def _lmap(proc, *sources) -> Seq:
+    return Seq(partial(map, proc), *sources)
+
+
+def _lfilter(proc, source) -> Seq:
+    return Seq(partial(filter, proc), source)
+
+
+def _take(n: int, source) -> Seq:
+    return Seq(lambda items: islice(items, n), source)
+
+
+def _drop(n: int, source) -> Seq:
+    return Seq(lambda items: islice(items, n, None), source)
+
+
+def _take_while(proc, source) -> Seq:
+    return Seq(partial(takewhile, proc), source)
+
+
+def _chunk(n: int, source) -> Seq:  # (chunk size sequence), the last chunk holding whatever's left over
+    return Seq(lambda items: iter(lambda: list(islice(items, n)), []), source)
+
+
+def _fold(proc, initial, source):  # (fold proc initial sequence), calling (proc total item) for each item
+    return reduce(proc, source, initial)
+
+
+def _to_array(values) -> array:
+    """
+    Builds a numeric array, of 64 bit integers if all the values are whole numbers that fit, or of floats if not.
+    """
+    if not isinstance(values, (list, array, range)):
+        values = list(values)
+    try:
+        return array('q', values)
+    except (TypeError, OverflowError):
+        return array('d', values)
+
+
+def _elementwise(f: Callable):
+    """
+    Makes an element-wise version of an operator, which applies it to each pair of items of two arrays of the same
+    length, or to each item of an array and a number.
+    """
+    def elementwise(x, y):
+        if isinstance(x, Number):
+            x = repeat(x)
+        elif isinstance(y, Number):
+            y = repeat(y)
+        elif len(x) != len(y):
+            raise CustomCommandSyntaxError(f"can't combine arrays of {len(x)} and {len(y)} items")
+        return _to_array(map(f, x, y))
+    return elementwise
+
+
+def _histogram(values, bins: int, low=None, high=None) -> array:  # (histogram values bins low high)
+    """
+    Counts how many of the values fall into each of a number of equally wide bins between low and high, which are the
+    lowest and highest of the values unless given. Values outside of them aren't counted.
+    """
+    if type(bins) is not int or bins < 1:
+        raise CustomCommandSyntaxError("histogram needs a whole number of bins, at least 1")
+    values = values if type(values) is array else _to_array(values)
+    if not values:
+        return array('q', [0] * bins)
+    low = min(values) if low is None else low
+    high = max(values) if high is None else high
+    counts = array('q', [0] * bins)
+    if high <= low:
+        counts[0] = values.count(low)
+        return counts
+    scale = bins / (high - low)
+    found = Counter(map(math.floor, map(op.mul, map(op.sub, values, repeat(low)), repeat(scale))))
+    found[bins - 1] += found.pop(bins, 0)  # The highest value goes into the last bin, not one of its own.
+    for i, count in found.items():
+        if 0 <= i < bins:
+            counts[i] = count
+    return counts
+
+
+def _randints(n: int, low: int, high: int) -> array:  # (randints n low high), both ends included like randint
+    return array('q', random.choices(range(low, high + 1), k=n))
+
+
+def _randoms(n: int) -> array:  # (randoms n), between 0 and 1 like random
+    return array('d', islice(iter(random.random, None), n))
+
+
+# Element-wise versions of the arithmetic and comparison operators, for numeric arrays.
+elementwise_operators = {
+    'v+': op.add, 'v-': op.sub, 'v*': op.mul, 'v/': op.truediv, 'v//': op.floordiv, 'v%': op.mod,
+    'v**': math.pow,  # Always a float, so that raising big numbers to big powers overflows instead of hanging.
+    'v==': op.eq, 'v!=': op.ne, 'v<': op.lt, 'v>': op.gt, 'v<=': op.le, 'v>=': op.ge
+}
+
+
 def transcode(string: str, *args):
     if len(args) == 0:
         return string
@@ -304,80 +1090,270 @@ def transcode(string: str, *args):
     return string.translate(str.maketrans(def_code, alt_code))
 
 
-def standard_env(*_, **kwargs):
-    env = Env(**kwargs)
-    env.update(vars(math))
-    env.update({
-        '+': op.add,
-        '-': lambda *x: op.sub(*x) if len(x) > 1 else -x[0],
-        '*': op.mul, '/': op.truediv, '//': op.floordiv, '%': op.mod, '**': op.pow,
-        '>': op.gt, '<': op.lt, '>=': op.ge, '<=': op.le, '==': op.eq, '<>': op.xor,
-        '!=': op.ne,
-        '#': lambda x, y: y[x],
-        'abs': abs,
-        'append': lambda x, y: x.append(y) if type(x) == list else x + y,
-        'apply': lambda proc, args: proc(*args),
-        'do': lambda *x: x[-1],
-        'car': lambda x: x[0],
-        'cdr': lambda x: x[1:],
-        'cons': lambda x, y: [x] + y,
-        'is': op.is_,
-        'in': op.contains,
-        'len': len,
-        'list': lambda *x: list(x),
-        'l': lambda *x: list(x),
-        'tolist': list,
-        '2l': list,
-        'slice': slice,
-        'range': range,
-        'list?': lambda x: isinstance(x, list),
-        'map': lambda *x: list(map(*x)),
-        'imap': map,
-        'sum': sum,
-        'max': max,
-        'min': min,
-        'all': all,
-        'any': any,
-        'filter': filter,
-        'reduce': reduce,
-        'sort': _sorted,
-        'reverse': lambda x: x[::-1],
-        'ireverse': reversed,
-        'pass': lambda *x: None,
-        'not': op.not_,
-        'and': op.and_,
-        'or': op.or_,
-        'null?': lambda x: x == [],
-        'number?': lambda x: isinstance(x, Number),
-        'procedure?': callable,
-        'round': round,
-        'symbol?': lambda x: isinstance(x, Symbol),
-        'assert': _assert,
-        'f': lambda *x: "".join(map(str, x)),
-
-        'chr': chr,
-        'ord': ord,
-
-        'int': int,
-        'float': float,
-        'dict': dict,
-        'zip': zip,
-
-        'resub': re.sub,
-        'rematch': re.match,
-        'refindall': re.findall,
-
-        'str': _str,
-        'transcode': transcode,
-
-        'random': random.random,
-        'randint': random.randint,
-        'choice': lambda *x: random.choices(*x).pop(),
-
-        'eztime': eztime,
-        'time': time,
-        'ezchoice': lambda *x: random.choice(x),
+# The builtins every program starts with. Built once and shared by all runs, so it must never be modified.
+base_env = dict(vars(math))
+base_env.update({
+    '+': op.add,
+    '-': lambda *x: op.sub(*x) if len(x) > 1 else -x[0],
+    '*': op.mul, '/': op.truediv, '//': op.floordiv, '%': op.mod, '**': op.pow,
+    '>': op.gt, '<': op.lt, '>=': op.ge, '<=': op.le, '==': op.eq, '<>': op.xor,
+    '!=': op.ne,
+    '#': lambda x, y: y[x],
+    'abs': abs,
+    'append': lambda x, y: x.append(y) if type(x) == list else x + y,
+    'apply': lambda proc, args: proc(*args),
+    'do': lambda *x: x[-1],
+    'car': lambda x: x[0],
+    'cdr': lambda x: x[1:],
+    'cons': lambda x, y: [x] + y,
+    'is': op.is_,
+    'in': op.contains,
+    'len': len,
+    'list': lambda *x: list(x),
+    'l': lambda *x: list(x),
+    'tolist': list,
+    '2l': list,
+    'slice': slice,
+    'range': range,
+    'list?': lambda x: isinstance(x, list),
+    'map': lambda *x: list(map(*x)),
+    'imap': map,
+    'sum': sum,
+    'max': max,
+    'min': min,
+    'all': all,
+    'any': any,
+    'filter': filter,
+    'reduce': reduce,
+    'sort': _sorted,
+    'reverse': lambda x: x[::-1],
+    'ireverse': reversed,
+    'lmap': _lmap,
+    'lfilter': _lfilter,
+    'take': _take,
+    'drop': _drop,
+    'take-while': _take_while,
+    'chunk': _chunk,
+    'fold': _fold,
+    'array': _to_array,
+    'mean': fmean,
+    'cumsum': lambda x: _to_array(accumulate(x)),
+    'histogram': _histogram,
+    'randints': _randints,
+    'randoms': _randoms,
+    'pass': lambda *x: None,
+    'not': op.not_,
+    'and': op.and_,
+    'or': op.or_,
+    'null?': lambda x: x == [],
+    'number?': lambda x: isinstance(x, Number),
+    'procedure?': callable,
+    'round': round,
+    'symbol?': lambda x: isinstance(x, Symbol),
+    'assert': _assert,
+    'f': lambda *x: "".join(map(str, x)),
+
+    'chr': chr,
+    'ord': ord,
+
+    'int': int,
+    'float': float,
+    'dict': dict,
+    'zip': zip,
+
+    'resub': re.sub,
+    'rematch': re.match,
+    'refindall': re.findall,
+
+    'str': _str,
+    'transcode': transcode,
+
+    'random': random.random,
+    'randint': random.randint,
+    'choice': lambda *x: random.choices(*x).pop(),
+
+    'eztime': eztime,
+    'time': time,
+    'ezchoice': lambda *x: random.choice(x),
+})
+base_env.update({name: _elementwise(f) for name, f in elementwise_operators.items()})
+
+
+def _size(x) -> int:
+    return len(x) if isinstance(x, (str, list, tuple, dict, set, range, array)) else 0
+
+
+def _item_bytes(x) -> int:
+    # How much each item of a string or list takes up.
+    try:
+        return (getsizeof(x) - getsizeof(x[:0])) // len(x)
+    except (TypeError, ZeroDivisionError):
+        return 0
+
+
+def _bigint_work(bits: int) -> int:
+    # Multiplying big numbers takes time growing with about the 1.6th power of their length in words.
+    return int(min(bits // 64, 1 << 48) ** 1.585) // 160
+
+
+def _size_work(*args) -> int:
+    # For builtins that go through every item of their arguments.
+    return sum(map(_size, args)) // ITEMS_PER_FUEL
+
+
+def _mul_work(x=None, y=None, *_) -> int:
+    if type(x) is int and type(y) is int:
+        return _bigint_work(x.bit_length() + y.bit_length())
+    if type(x) is int:
+        x, y = y, x
+    if type(y) is int and y > 0:  # Repeating a string or list.
+        return _size(x) * y // ITEMS_PER_FUEL
+    return 0
+
+
+def _pow_work(x=None, y=None, *_) -> int:
+    if type(x) is int and type(y) is int and y > 0:
+        return _bigint_work(x.bit_length() * y)
+    return 0
+
+
+def _factorial_work(x=None, *_) -> int:
+    if type(x) is int and x > 1:
+        return _bigint_work(x * x.bit_length()) * 2
+    return 0
+
+
+def _append_work(x=None, y=None, *_) -> int:
+    # Lists are appended to in place, while anything else is added together, going through both.
+    return 0 if type(x) is list else _size_work(x, y)
+
+
+def _lazy_work(*args) -> int:
+    # Lazy builtins only build a sequence, and its items are charged for as they're pulled.
+    return 0
+
+
+def _count_work(n=None, *_) -> int:
+    # For builtins that build as many items as their first argument says.
+    return n // ITEMS_PER_FUEL if type(n) is int else 0
+
+
+def _count_size(n=None, *_) -> int:
+    return n * 8 if type(n) is int else 0
+
 
+def _histogram_size(values=None, bins=None, *_) -> int:
+    return _count_size(bins)
+
+
+def _lists_size(*args) -> int:
+    # For builtins that build a list out of the items of their arguments.
+    return sum(map(_size, args)) * 8
+
+
+def _append_size(x=None, y=None, *_) -> int:
+    if type(x) is list:
+        return (len(x) + 1) * 8
+    return (_size(x) + _size(y)) * max(_item_bytes(x), _item_bytes(y), 1)
+
+
+def _mul_size(x=None, y=None, *_) -> int:
+    if type(x) is int and type(y) is int:
+        return (x.bit_length() + y.bit_length()) // 8
+    if type(x) is int:
+        x, y = y, x
+    if type(y) is int and y > 0:
+        return _size(x) * _item_bytes(x) * y
+    return 0
+
+
+def _pow_size(x=None, y=None, *_) -> int:
+    if type(x) is int and type(y) is int and y > 0:
+        return x.bit_length() * y // 8
+    return 0
+
+
+def _factorial_size(x=None, *_) -> int:
+    if type(x) is int and x > 1:
+        return x * x.bit_length() // 8
+    return 0
+
+
+def _method_size(name=None, obj=None, *args) -> int:
+    """
+    Estimates the size of what a method that pads or repeats its object would build, before it's called.
+    """
+    if not args or type(args[0]) is not int:
+        return 0
+    if name in ('ljust', 'rjust', 'center', 'zfill'):
+        return args[0] * max(_item_bytes(obj), 1)
+    elif name == 'expandtabs' and isinstance(obj, str):
+        return len(obj) + obj.count('\t') * args[0]
+    elif name in ('__mul__', '__rmul__', '__imul__'):
+        return _mul_size(obj, args[0])
+    elif name in ('__pow__', '__rpow__'):
+        return _pow_size(obj, args[0])
+    return 0
+
+
+def _str_size(*args) -> int:
+    return _method_size(*args) if len(args) > 1 else 0
+
+
+# Builtins that can take a while to run, or build big values out of small arguments, keyed by id since not all of
+# what a program can call is hashable. Before they're run, they're charged the work they'll do on top of their call,
+# and what they'll build is checked isn't too big, both worked out from their arguments.
+metered_builtins = {id(base_env[name]): (work, size) for names, work, size in (
+    (('tolist', '2l', 'map', 'sort'), _size_work, _lists_size),
+    (('in', 'imap', 'sum', 'max', 'min', 'all', 'any', 'filter', 'reduce', 'fold', 'ireverse', 'rematch', 'refindall',
+      'dict', 'zip', 'prod', 'fsum'), _size_work, None),
+    (('lmap', 'lfilter', 'take', 'drop', 'take-while', 'chunk'), _lazy_work, None),
+    (('array', 'cumsum', *elementwise_operators), _size_work, _lists_size),
+    (('mean',), _size_work, None),
+    (('histogram',), _size_work, _histogram_size),
+    (('randints', 'randoms'), _count_work, _count_size),
+    (('str',), _size_work, _str_size),
+    (('append',), _append_work, _append_size),
+    (('*',), _mul_work, _mul_size),
+    (('**', 'pow'), _pow_work, _pow_size),
+    (('factorial',), _factorial_work, _factorial_size)
+) for name in names}
+# Builtins whose work is about as big as what they build, which are charged for it once it's been built.
+building_builtins = {id(base_env[name]) for name in (
+    '+', 'cdr', 'cons', 'reverse', 'f', 'transcode', 'resub'
+)}
+# Builtins that grow the list they're given in place, whose new items are counted towards the run's allocations.
+growing_builtins = {id(base_env['append'])}
+# The types whose values are counted towards a run's allocations.
+allocated_types = {str, list, tuple, dict, set, bytes, array}
+
+
+def _run_metered(meter: Meter, f, args: tuple):
+    """
+    Runs a builtin that can take a while to run or build big values, charging and checking it as it goes.
+    """
+    work, size = metered_builtins[id(f)]
+    meter.charge(1 + work(*args))
+    if size is not None:
+        meter.check_size(size(*args))
+    result = f(*args)
+    if type(result) in allocated_types:
+        meter.allocate(getsizeof(result))
+    elif type(result) is Seq:
+        result.meter = meter
+    elif result is None and id(f) in growing_builtins:
+        meter.allocate(8)
+    return result
+
+
+def _charge_built(meter: Meter, result):
+    meter.charge(len(result) // ITEMS_PER_FUEL)
+    meter.allocate(getsizeof(result))
+
+
+def standard_env(*_, max_output: int = 0, **kwargs):
+    env = GlobalEnv(base_env, Meter(**kwargs))
+    env.update({
         # to be overriden by the cc function
         "username": "",
         "usernick": "",
@@ -387,7 +1363,7 @@ def standard_env(*_, **kwargs):
         "argstring": "",
         "args": [],
 
-        "_rsoutput": ""
+        "_rsoutput": Output(max_output)
     })
     return env
 
@@ -418,25 +1394,186 @@ def isnum(test):
         return False
 
 
-# Evaluate an expression in an environment.
-# noinspection PyDefaultArgument
-def lisp_eval(x, env=None):
-    if env is None:
-        env = standard_env()
-    if env.max_runtime != 0 and time() - env.timestamp > env.max_runtime:
-        raise CustomCommandSyntaxError("The command ran too long.")
+# =============================================================================================================
+# Compiler
+# Programs are compiled once into a tree of closures that each take an Env and return the value of their node.
+# Special forms are resolved at compile time, so running a program never has to look at the syntax tree again.
+# Variables are resolved at compile time too: those of enclosing procedures to a (depth, slot) address in their
+# frames, and the rest to the global environment. Only dynamic scopes look variables up by name.
+
+def wrap_error(head, e: Exception) -> CustomCommandSyntaxError:
+    """
+    Prefixes an error with the form it passed through, building up a trace of where in the program it happened.
+    """
+    e = str(e)
+    if len(e) > 1500:
+        inner = re.match(r".+(\(.+?\): .+?$)", e)
+        e = "..." + (inner.group(1) if inner else e[-1500:])
+    return CustomCommandSyntaxError(f"({head}): {e}")
+
+
+def _constant(value):
+    return lambda env: value
+
+
+def _failure(message: str):
+    # Malformed forms only raise an error once they're run, same as if they'd been interpreted.
+    def fail(env):
+        raise CustomCommandSyntaxError(message)
+    return fail
+
+
+def _resolve(name, scope: Scope | None):
+    """
+    Finds where a variable lives.
+    :return: The (depth, slot) address of a procedure variable, None for a global variable, or False if the variable
+    has to be looked up by name.
+    """
     try:
-        if isinstance(x, Empty):
-            return
-        elif isinstance(x, Symbol):  # variable reference
-            l, *ind = x.split(':')
-            ind = [int(x) if isnum(x) else lisp_eval(x, env) for x in ind]
-            return _lget(env.find(l)[l], *ind)
-        elif not isinstance(x, list):  # constant literal
-            return x
-        elif x[0] == _args:
-            argstring = env.find('argstring')['argstring']
-            arglist = env.find('args')['args']
+        hash(name)
+    except TypeError:
+        return False  # Can't be a variable, but that's only an error once it's run.
+    depth = 0
+    while scope is not None:
+        if scope.dynamic:
+            return False
+        if name in scope.index:
+            return depth, scope.index[name]
+        scope = scope.parent
+        depth += 1
+    return None
+
+
+def _compile_ref(name, scope: Scope | None):
+    address = _resolve(name, scope)
+    if address is False:
+        def dynamic_ref(env):
+            return env.find(name)[name]
+        return dynamic_ref
+    elif address is None:
+        if name in base_env:
+            def builtin_ref(env):
+                env = env.globals
+                if name in env:  # Shadowed by the program.
+                    return env[name]
+                try:
+                    return env.base[name]
+                except KeyError:
+                    raise CustomCommandSyntaxError(f'undefined var {name}') from None
+            return builtin_ref
+
+        def global_ref(env):
+            try:
+                return env.globals[name]
+            except KeyError:
+                raise CustomCommandSyntaxError(f'undefined var {name}') from None
+        return global_ref
+
+    depth, slot = address
+    if depth == 0:
+        def local_ref(env):
+            value = env.slots[slot]
+            if value is UNBOUND:
+                return env.outer.find(name)[name]
+            return value
+    elif depth == 1:
+        def local_ref(env):
+            env = env.outer
+            value = env.slots[slot]
+            if value is UNBOUND:
+                return env.outer.find(name)[name]
+            return value
+    else:
+        def local_ref(env):
+            for _ in range(depth):
+                env = env.outer
+            value = env.slots[slot]
+            if value is UNBOUND:
+                return env.outer.find(name)[name]
+            return value
+    return local_ref
+
+
+def _compile_assign(name, scope: Scope | None):
+    address = _resolve(name, scope)
+    if address is False:
+        def dynamic_assign(env, value):
+            env.find(name)[name] = value
+        return dynamic_assign
+    elif address is None:
+        def global_assign(env, value):
+            env = env.globals
+            if name not in env and name not in env.base:
+                raise CustomCommandSyntaxError(f'undefined var {name}')
+            env[name] = value
+        return global_assign
+
+    depth, slot = address
+
+    def local_assign(env, value):
+        for _ in range(depth):
+            env = env.outer
+        if env.slots[slot] is UNBOUND:
+            env.outer.find(name)[name] = value
+        else:
+            env.slots[slot] = value
+    return local_assign
+
+
+def _compile_indexes(ind: list, scope: Scope | None):
+    return [_constant(int(i)) if isnum(i) else _compile_symbol(i, scope) for i in ind]
+
+
+def _compile_symbol(x: str, scope: Scope | None):
+    if ':' not in x:
+        return _compile_ref(x, scope)
+
+    l, *ind = x.split(':')
+    ind = _compile_indexes(ind, scope)
+    ref = _compile_ref(l, scope)
+
+    def indexed_symbol(env):
+        indexes = [i(env) for i in ind]
+        return _lget(ref(env), *indexes)
+    return indexed_symbol
+
+
+def _scan_body(x, defines: list) -> bool:
+    """
+    Collects the variables a procedure body defines for itself, leaving out those of procedures nested in it.
+    :return: Whether the body evaluates code built at runtime, making its scope dynamic.
+    """
+    if not isinstance(x, list) or not x:
+        return False
+    head = x[0]
+    if isinstance(head, Symbol):
+        if head in (_quote, _args):
+            return False
+        elif head == _unquote:
+            return True
+        elif head == _lambda:
+            return False
+        elif head in (_define, _def) and len(x) == 3:
+            try:
+                hash(x[1])
+            except TypeError:
+                pass
+            else:
+                defines.append(x[1])
+    dynamic = False
+    for i in x:
+        dynamic = _scan_body(i, defines) or dynamic
+    return dynamic
+
+
+def _compile_args(x: list, scope: Scope | None):
+    argstring_ref = _compile_ref('argstring', scope)
+    args_ref = _compile_ref('args', scope)
+
+    def args(env):
+        try:
+            argstring = argstring_ref(env)
+            arglist = args_ref(env)
             if len(x) == 1:
                 return argstring
             if len(x) == 2:
@@ -457,63 +1594,1213 @@ def lisp_eval(x, env=None):
                         return arglist[x[1]:x[2]]
                 except IndexError:
                     return []
-        elif x[0] == _quote:  # quotation
-            (_, exp) = x
-            return exp
-        elif x[0] == _access:  # attempt using an object method
-            a = list(map(lambda i: lisp_eval(i, env), x[1:]))
+        except Exception as e:
+            raise wrap_error(_args, e)
+    return args
+
+
+def _compile_quote(x: list, scope: Scope | None):
+    (_, exp) = x
+    if isinstance(exp, list):
+        # Programs are cached between runs, so quoted lists must not be modified in place.
+        return lambda env: deepcopy(exp)
+    return _constant(exp)
+
+
+def _call_method(meter: Meter, a: list):
+    # (>> name object args), with the name and object evaluated along with the arguments.
+    try:
+        ar, kw = get_args(a[2:])
+        method = getattr(a[1], a[0])
+        meter.check_size(_method_size(a[0], a[1], *ar))
+        size = getsizeof(a[1])
+        result = method(*ar, **kw)
+        # Methods that grow their object in place allocate as much as ones that build new values.
+        meter.allocate(max(getsizeof(a[1]) - size, 0))
+        if type(result) in allocated_types:
+            meter.allocate(getsizeof(result))
+        return result
+    except AttributeError:
+        raise CustomCommandSyntaxError(f'{type(a[1])} has no method {a[0]}')
+
+
+def _compile_access(x: list, scope: Scope | None):
+    parts = [compile_ast(i, scope) for i in x[1:]]
+
+    def access(env):
+        try:
+            return _call_method(env.meter, [part(env) for part in parts])
+        except Exception as e:
+            raise wrap_error(_access, e)
+    return access
+
+
+def _compile_if(x: list, scope: Scope | None, tail: bool = False):
+    (_, test, conseq, alt) = x
+    test, conseq, alt = compile_ast(test, scope), compile_ast(conseq, scope, tail), compile_ast(alt, scope, tail)
+
+    def if_(env):
+        try:
+            return conseq(env) if test(env) else alt(env)
+        except Exception as e:
+            raise wrap_error(_if, e)
+    return if_
+
+
+def _compile_define(x: list, scope: Scope | None):
+    (head, var, exp) = x
+    exp = compile_ast(exp, scope)
+    if scope is not None and not scope.dynamic:
+        slot = scope.index[var]
+
+        def define_local(env):
             try:
-                ar, kw = get_args(a[2:])
-                return getattr(a[1], a[0])(*ar, **kw)
-            except AttributeError:
-                raise CustomCommandSyntaxError(f'{type(a[1])} has no method {a[0]}')
-        elif x[0] == _if:  # conditional (if bool then else)
-            (_, test, conseq, alt) = x
-            exp = (conseq if lisp_eval(test, env) else alt)
-            return lisp_eval(exp, env)
-        elif x[0] in [_define, _def]:  # definition
-            (_, var, exp) = x
-            env[var] = lisp_eval(exp, env)
-        elif x[0] == _set:  # assignment
-            (_, var, exp) = x
-            if ':' in var:
-                l, *ind = var.split(':')
-                ind = [int(x) if isnum(x) else lisp_eval(x, env) for x in ind]
-                _lset(env.find(l)[l], lisp_eval(exp, env), *ind)
-            else:
-                env.find(var)[var] = lisp_eval(exp, env)
-        elif x[0] == _lambda:  # procedure
-            (_, params, body) = x
-            return Procedure(params, body, env)
-        elif x[0] == _while:  # while loop
-            while lisp_eval(x[1], env):
-                lisp_eval(x[2], env)
-        elif x[0] == _print:  # prints into "_rsoutput" variable
+                env.slots[slot] = exp(env)
+            except Exception as e:
+                raise wrap_error(head, e)
+        return define_local
+
+    def define(env):
+        try:
+            env[var] = exp(env)
+        except Exception as e:
+            raise wrap_error(head, e)
+    return define
+
+
+def _compile_set(x: list, scope: Scope | None):
+    (_, var, exp) = x
+    exp = compile_ast(exp, scope)
+    if isinstance(var, str) and ':' in var:
+        l, *ind = var.split(':')
+        ind = _compile_indexes(ind, scope)
+        ref = _compile_ref(l, scope)
+
+        def set_indexed(env):
             try:
-                env.find('_rsoutput')['_rsoutput'] += f'{" ".join(map(lambda y: str(lisp_eval(y,env)), x[1:]))}\n'
-            except IndexError:
-                env.find('_rsoutput')['_rsoutput'] += '\n'
-        elif x[0] == _try:  # (try (body) (except)) - returns result of body if successful or evaluates except if not
-            expr, *args = x[1:]
+                indexes = [i(env) for i in ind]
+                _lset(ref(env), exp(env), *indexes)
+            except Exception as e:
+                raise wrap_error(_set, e)
+        return set_indexed
+
+    assign = _compile_assign(var, scope)
+
+    def set_(env):
+        try:
+            assign(env, exp(env))
+        except Exception as e:
+            raise wrap_error(_set, e)
+    return set_
+
+
+def _compile_lambda(x: list, scope: Scope | None):
+    (_, params, body) = x
+    params = tuple(params)
+    defines = []
+    dynamic = _scan_body(body, defines)
+    try:
+        dynamic = dynamic or len(set(params)) != len(params)
+    except TypeError:
+        dynamic = True
+    if dynamic:
+        # Procedures with scopes we can't lay out in advance get an Env instead of a Frame.
+        dynamic_scope = Scope((), (), scope, dynamic=True)
+        code = compile_ast(body, dynamic_scope, tail=True)
+        steps = Steps(body, dynamic_scope, profiling.get())
+        return lambda env: Procedure(params, code, steps, env)
+    inner = Scope(params, tuple(dict.fromkeys(defines)), scope)
+    code = compile_ast(body, inner, tail=True)
+    steps = Steps(body, inner, profiling.get())
+    return lambda env: Procedure(params, code, steps, env, inner)
+
+
+def _compile_while(x: list, scope: Scope | None):
+    test, body = compile_ast(x[1], scope), compile_ast(x[2], scope)
+
+    def while_(env):
+        try:
+            meter = env.meter
+            while test(env):
+                meter.charge(1)
+                body(env)
+        except Exception as e:
+            raise wrap_error(_while, e)
+    return while_
+
+
+def _compile_print(x: list, scope: Scope | None):
+    parts = [compile_ast(y, scope) for y in x[1:]]
+    output_ref = _compile_ref('_rsoutput', scope)
+    output_assign = _compile_assign('_rsoutput', scope)
+
+    def print_(env):
+        try:
+            output = output_ref(env)
+            _write_line(env, output, output_assign, [str(part(env)) for part in parts])
+        except Exception as e:
+            raise wrap_error(_print, e)
+    return print_
+
+
+def _write_line(env, output, output_assign, words: list):
+    line = f'{" ".join(words)}\n'
+    meter = env.meter
+    meter.allocate(getsizeof(line))
+    if type(output) is Output:
+        meter.charge(len(line) // ITEMS_PER_FUEL)
+        output.write(line)
+    else:
+        # The program replaced its output with a string of its own, which can only be built on.
+        meter.charge((len(output) + len(line)) // ITEMS_PER_FUEL)
+        output_assign(env, output + line)
+
+
+def _compile_try(x: list, scope: Scope | None):
+    expr, *args = x[1:]
+    expr = compile_ast(expr, scope)
+    handler = compile_ast(args[0], scope) if args else None
+
+    def try_(env):
+        try:
+            try:
+                return expr(env)
+            except Exception as e:
+                if handler is None:
+                    return e
+            return handler(env)
+        except Exception as e:
+            raise wrap_error(_try, e)
+    return try_
+
+
+def _compile_unquote(x: list, scope: Scope | None):
+    exp = compile_ast(x[1], scope)
+
+    def unquote(env):
+        try:
+            return compile_ast(exp(env), scope)(env)
+        except Exception as e:
+            raise wrap_error(_unquote, e)
+    return unquote
+
+
+def _compile_raise(x: list, scope: Scope | None):
+    exp = compile_ast(x[1], scope)
+
+    def raise_(env):
+        try:
+            raise CustomCommandSyntaxError(exp(env))
+        except Exception as e:
+            raise wrap_error(_raise, e)
+    return raise_
+
+
+def _compile_call(x: list, scope: Scope | None, tail: bool = False):
+    head = x[0]
+    if tail:
+        if head == _begin and len(x) > 1:
+            return _compile_tail_do(x, scope)
+        return _compile_tail_call(x, scope)
+    proc = compile_ast(head, scope)
+    args = [compile_ast(arg, scope) for arg in x[1:]]
+    # Unrolled for the most common numbers of arguments, to save building an argument list on every call.
+    if len(args) == 0:
+        def call(env):
+            try:
+                f = proc(env)
+                if type(f) is Procedure:
+                    return f.call(())
+                meter = env.meter
+                if id(f) in metered_builtins:
+                    return _run_metered(meter, f, ())
+                meter.fuel -= 1
+                if meter.fuel < meter.checkpoint:
+                    meter.check()
+                result = f()
+                if type(result) in allocated_types and id(f) in building_builtins:
+                    _charge_built(meter, result)
+                return result
+            except Exception as e:
+                raise wrap_error(head, e)
+    elif len(args) == 1:
+        arg0, = args
+
+        def call(env):
+            try:
+                f, a = proc(env), arg0(env)
+                if type(f) is Procedure:
+                    return f.call((a,))
+                meter = env.meter
+                if id(f) in metered_builtins:
+                    return _run_metered(meter, f, (a,))
+                meter.fuel -= 1
+                if meter.fuel < meter.checkpoint:
+                    meter.check()
+                result = f(a)
+                if type(result) in allocated_types and id(f) in building_builtins:
+                    _charge_built(meter, result)
+                return result
+            except Exception as e:
+                raise wrap_error(head, e)
+    elif len(args) == 2:
+        arg0, arg1 = args
+
+        def call(env):
+            try:
+                f, a, b = proc(env), arg0(env), arg1(env)
+                if type(f) is Procedure:
+                    return f.call((a, b))
+                meter = env.meter
+                if id(f) in metered_builtins:
+                    return _run_metered(meter, f, (a, b))
+                meter.fuel -= 1
+                if meter.fuel < meter.checkpoint:
+                    meter.check()
+                result = f(a, b)
+                if type(result) in allocated_types and id(f) in building_builtins:
+                    _charge_built(meter, result)
+                return result
+            except Exception as e:
+                raise wrap_error(head, e)
+    else:
+        def call(env):
+            try:
+                f, a = proc(env), [arg(env) for arg in args]
+                if type(f) is Procedure:
+                    return f.call(a)
+                meter = env.meter
+                if id(f) in metered_builtins:
+                    return _run_metered(meter, f, a)
+                meter.fuel -= 1
+                if meter.fuel < meter.checkpoint:
+                    meter.check()
+                result = f(*a)
+                if type(result) in allocated_types and id(f) in building_builtins:
+                    _charge_built(meter, result)
+                return result
+            except Exception as e:
+                raise wrap_error(head, e)
+    return call
+
+
+def _compile_tail_call(x: list, scope: Scope | None):
+    head = x[0]
+    call = _compile_call(x, scope)
+    proc = compile_ast(head, scope)
+    args = [compile_ast(arg, scope) for arg in x[1:]]
+
+    def tail_call(env):
+        try:
+            f = proc(env)
+            if type(f) is Procedure:
+                return TailCall(f, [arg(env) for arg in args])
+        except Exception as e:
+            raise wrap_error(head, e)
+        return call(env)
+    return tail_call
+
+
+def _compile_tail_do(x: list, scope: Scope | None):
+    # Does what the do builtin does, but leaves its last expression in tail position, unless do has been redefined.
+    do_ref = _compile_ref(_begin, scope)
+    body = [compile_ast(y, scope) for y in x[1:-1]]
+    last = compile_ast(x[-1], scope, tail=True)
+    call = _compile_call(x, scope)
+    builtin_do = base_env[_begin]
+
+    def do(env):
+        if do_ref(env) is not builtin_do:
+            return call(env)
+        try:
+            env.meter.charge(1)
+            for exp in body:
+                exp(env)
+            return last(env)
+        except Exception as e:
+            raise wrap_error(_begin, e)
+    return do
+
+
+special_forms = {
+    _args: _compile_args,
+    _quote: _compile_quote,
+    _access: _compile_access,
+    _if: _compile_if,
+    _define: _compile_define,
+    _def: _compile_define,
+    _set: _compile_set,
+    _lambda: _compile_lambda,
+    _while: _compile_while,
+    _print: _compile_print,
+    _try: _compile_try,
+    _unquote: _compile_unquote,
+    _raise: _compile_raise
+}
+
+
+# The forms that can make tail calls.
+tail_compilers = {_compile_if, _compile_call}
+# The profiler instrumenting the code being compiled, if any.
+profiling: ContextVar[Profiler | None] = ContextVar("profiling", default=None)
+
+
+def compile_ast(x, scope: Scope = None, tail: bool = False):
+    """
+    Compiles an RSLisp Abstract Syntax Tree into a closure that evaluates it in a given environment.
+    :param x:
+    :param scope: The scope of the procedure the code is in, or None for the top level of a program.
+    :param tail: Whether the code is in tail position, its value being what the procedure it's in returns.
+    :return:
+    """
+    if isinstance(x, Empty):
+        return _constant(None)
+    elif isinstance(x, Symbol):  # variable reference
+        return _compile_symbol(x, scope)
+    elif not isinstance(x, list):  # constant literal
+        return _constant(x)
+    elif not x:
+        return _failure("list index out of range")
+    head = x[0]
+    compiler = special_forms.get(head, _compile_call) if isinstance(head, Symbol) else _compile_call
+    try:
+        if tail and compiler in tail_compilers:
+            code = compiler(x, scope, tail=True)
+        else:
+            code = compiler(x, scope)
+    except Exception as e:
+        return _failure(str(wrap_error(head, e)))
+    profiler = profiling.get()
+    if profiler is None or head == _quote:
+        return code
+    return profiler.instrument(x, code)
+
+
+# Evaluate an expression in an environment.
+def lisp_eval(x, env=None):
+    if env is None:
+        env = standard_env()
+    # Code run somewhere other than the top level can't know the layout of where it's run, so looks everything up.
+    scope = None if env is env.globals else Scope((), (), dynamic=True)
+    return compile_ast(x, scope)(env)
+
+
+# =============================================================================================================
+# Explicit stack
+# Procedures called too deep to nest in Python run their bodies compiled a second time, by compile_steps, into
+# generators run by run_on_stack. Expressions that call procedures yield each call for run_on_stack to make, and the
+# rest are compiled by compile_ast as usual, since they can't go any deeper.
+
+def _makes_calls(x) -> bool:
+    """
+    Checks whether evaluating an expression can call a procedure, other than from code built at runtime.
+    """
+    if not isinstance(x, list) or not x:
+        return False
+    head = x[0]
+    if not isinstance(head, Symbol):
+        return True
+    elif head in (_quote, _args, _lambda, _unquote):
+        return False
+    elif head in step_forms:
+        return any(_makes_calls(i) for i in x[1:])
+    return True
+
+
+def _as_steps(code):
+    def steps(env):
+        return code(env)
+        yield  # Makes this a generator.
+    return steps
+
+
+def _compile_part(x, scope: Scope | None, tail: bool = False) -> tuple:
+    """
+    :return: The code for an expression within one compiled by compile_steps, and whether it's a generator.
+    """
+    if _makes_calls(x):
+        return compile_steps(x, scope, tail), True
+    return compile_ast(x, scope, tail), False
+
+
+def _apply_builtin(meter: Meter, f, args: list):
+    if id(f) in metered_builtins:
+        return _run_metered(meter, f, args)
+    meter.fuel -= 1
+    if meter.fuel < meter.checkpoint:
+        meter.check()
+    result = f(*args)
+    if type(result) in allocated_types and id(f) in building_builtins:
+        _charge_built(meter, result)
+    return result
+
+
+def _steps_access(x: list, scope: Scope | None):
+    parts = [_compile_part(i, scope) for i in x[1:]]
+
+    def access(env):
+        try:
+            a = []
+            for part, stepped in parts:
+                a.append((yield from part(env)) if stepped else part(env))
+            return _call_method(env.meter, a)
+        except Exception as e:
+            raise wrap_error(_access, e)
+    return access
+
+
+def _steps_if(x: list, scope: Scope | None, tail: bool = False):
+    (_, test, conseq, alt) = x
+    (test, test_stepped), conseq, alt = (_compile_part(test, scope), _compile_part(conseq, scope, tail),
+                                         _compile_part(alt, scope, tail))
+
+    def if_(env):
+        try:
+            branch, stepped = conseq if ((yield from test(env)) if test_stepped else test(env)) else alt
+            return (yield from branch(env)) if stepped else branch(env)
+        except Exception as e:
+            raise wrap_error(_if, e)
+    return if_
+
+
+def _steps_define(x: list, scope: Scope | None):
+    (head, var, exp) = x
+    exp = compile_steps(exp, scope)
+    if scope is not None and not scope.dynamic:
+        slot = scope.index[var]
+
+        def define_local(env):
+            try:
+                env.slots[slot] = yield from exp(env)
+            except Exception as e:
+                raise wrap_error(head, e)
+        return define_local
+
+    def define(env):
+        try:
+            env[var] = yield from exp(env)
+        except Exception as e:
+            raise wrap_error(head, e)
+    return define
+
+
+def _steps_set(x: list, scope: Scope | None):
+    (_, var, exp) = x
+    exp = compile_steps(exp, scope)
+    if isinstance(var, str) and ':' in var:
+        l, *ind = var.split(':')
+        ind = _compile_indexes(ind, scope)
+        ref = _compile_ref(l, scope)
+
+        def set_indexed(env):
             try:
-                return lisp_eval(expr, env)
+                indexes = [i(env) for i in ind]
+                _lset(ref(env), (yield from exp(env)), *indexes)
             except Exception as e:
-                if len(args) >= 1:
-                    return lisp_eval(args[0], env)
+                raise wrap_error(_set, e)
+        return set_indexed
+
+    assign = _compile_assign(var, scope)
+
+    def set_(env):
+        try:
+            assign(env, (yield from exp(env)))
+        except Exception as e:
+            raise wrap_error(_set, e)
+    return set_
+
+
+def _steps_while(x: list, scope: Scope | None):
+    (test, test_stepped), (body, body_stepped) = _compile_part(x[1], scope), _compile_part(x[2], scope)
+
+    def while_(env):
+        try:
+            meter = env.meter
+            while (yield from test(env)) if test_stepped else test(env):
+                meter.charge(1)
+                if body_stepped:
+                    yield from body(env)
                 else:
+                    body(env)
+        except Exception as e:
+            raise wrap_error(_while, e)
+    return while_
+
+
+def _steps_print(x: list, scope: Scope | None):
+    parts = [_compile_part(y, scope) for y in x[1:]]
+    output_ref = _compile_ref('_rsoutput', scope)
+    output_assign = _compile_assign('_rsoutput', scope)
+
+    def print_(env):
+        try:
+            output = output_ref(env)
+            words = []
+            for part, stepped in parts:
+                words.append(str((yield from part(env)) if stepped else part(env)))
+            _write_line(env, output, output_assign, words)
+        except Exception as e:
+            raise wrap_error(_print, e)
+    return print_
+
+
+def _steps_try(x: list, scope: Scope | None):
+    expr, *args = x[1:]
+    expr, expr_stepped = _compile_part(expr, scope)
+    handler, handler_stepped = _compile_part(args[0], scope) if args else (None, False)
+
+    def try_(env):
+        try:
+            try:
+                return (yield from expr(env)) if expr_stepped else expr(env)
+            except Exception as e:
+                if handler is None:
                     return e
-        elif x[0] == _unquote:
-            return lisp_eval(lisp_eval(x[1], env), env)
-        elif x[0] == _raise:
-            raise CustomCommandSyntaxError(lisp_eval(x[1], env))
-        else:  # procedure call
-            proc = lisp_eval(x[0], env)
-            args = [lisp_eval(arg, env) for arg in x[1:]]
-            return proc(*args)
+            return (yield from handler(env)) if handler_stepped else handler(env)
+        except Exception as e:
+            raise wrap_error(_try, e)
+    return try_
+
+
+def _steps_raise(x: list, scope: Scope | None):
+    exp = compile_steps(x[1], scope)
+
+    def raise_(env):
+        try:
+            raise CustomCommandSyntaxError((yield from exp(env)))
+        except Exception as e:
+            raise wrap_error(_raise, e)
+    return raise_
+
+
+def _steps_call(x: list, scope: Scope | None, tail: bool = False):
+    head = x[0]
+    if tail and head == _begin and len(x) > 1:
+        return _steps_tail_do(x, scope)
+    parts = [_compile_part(i, scope) for i in x]
+
+    def call(env):
+        try:
+            values = []
+            for part, stepped in parts:
+                values.append((yield from part(env)) if stepped else part(env))
+            f, *a = values
+            if type(f) is Procedure:
+                if tail:
+                    return TailCall(f, a)
+                return (yield f, a)
+            return _apply_builtin(env.meter, f, a)
+        except Exception as e:
+            raise wrap_error(head, e)
+    return call
+
+
+def _steps_tail_do(x: list, scope: Scope | None):
+    do_ref = _compile_ref(_begin, scope)
+    body = [_compile_part(y, scope) for y in x[1:-1]]
+    last, last_stepped = _compile_part(x[-1], scope, tail=True)
+    call = _steps_call(x, scope)
+    builtin_do = base_env[_begin]
+
+    def do(env):
+        if do_ref(env) is not builtin_do:
+            return (yield from call(env))
+        try:
+            env.meter.charge(1)
+            for exp, stepped in body:
+                if stepped:
+                    yield from exp(env)
+                else:
+                    exp(env)
+            return (yield from last(env)) if last_stepped else last(env)
+        except Exception as e:
+            raise wrap_error(_begin, e)
+    return do
+
+
+step_forms = {
+    _access: _steps_access,
+    _if: _steps_if,
+    _define: _steps_define,
+    _def: _steps_define,
+    _set: _steps_set,
+    _while: _steps_while,
+    _print: _steps_print,
+    _try: _steps_try,
+    _raise: _steps_raise
+}
+
+
+def compile_steps(x, scope: Scope = None, tail: bool = False):
+    """
+    Compiles an RSLisp Abstract Syntax Tree like compile_ast, but into a generator function, which yields the calls
+    to procedures it makes for run_on_stack to make.
+    :param x:
+    :param scope: The scope of the procedure the code is in.
+    :param tail: Whether the code is in tail position.
+    :return:
+    """
+    if not _makes_calls(x):
+        return _as_steps(compile_ast(x, scope, tail))
+    head = x[0]
+    compiler = step_forms.get(head, _steps_call) if isinstance(head, Symbol) else _steps_call
+    try:
+        if tail and compiler in (_steps_if, _steps_call):
+            code = compiler(x, scope, tail=True)
+        else:
+            code = compiler(x, scope)
     except Exception as e:
-        if len(str(e)) > 1500:
-            e = "..." + re.match(r".+(\(.+?\): .+?$)", str(e)).group(1)
+        return _as_steps(_failure(str(wrap_error(head, e))))
+    profiler = profiling.get()
+    if profiler is None:
+        return code
+    return profiler.instrument_steps(x, code)
+
+
+# =============================================================================================================
+# Profiler
+
+class Profiler:
+    """
+    Compiles a program so that it records how many times each of its expressions is evaluated and how much CPU time
+    they take, for finding out where a slow program spends its time. The same is recorded for each name called.
+    The total time of an expression only counts its outermost evaluations, so that recursion isn't counted over and
+    over, while its own time leaves out the time taken by the expressions evaluated within it, including the bodies of
+    the procedures it calls. A tail call is counted as part of the call that made the procedure it's in.
+    """
+    # Expressions taking less than this share of the run are left out of the report.
+    threshold = 0.01
+    snippet_length = 60
+
+    def __init__(self, source: str):
+        """
+        :param source: The source of the program to profile.
+        """
+        self.source = source
+        self.spans = {}
+        self.ast = parse(source, self.spans)
+        # [evaluations, total time, own time, evaluations in progress], by the id of the expression or by name
+        self.stats = {}
+        self.calls = {}
+        self.inner_time = 0.0  # The time taken by the expressions evaluated within the one being evaluated.
+        token = profiling.set(self)
+        try:
+            self.program = compile_ast(self.ast)
+        finally:
+            profiling.reset(token)
+
+    def _all_stats(self, x: list) -> tuple:
+        head = x[0]
+        if isinstance(head, Symbol) and head not in special_forms:
+            return self.stats.setdefault(id(x), [0, 0.0, 0.0, 0]), self.calls.setdefault(head, [0, 0.0, 0.0, 0])
+        return self.stats.setdefault(id(x), [0, 0.0, 0.0, 0]),
+
+    def _enter(self, all_stats: tuple) -> tuple[float, float]:
+        for stats in all_stats:
+            stats[0] += 1
+            stats[3] += 1
+        outer_time = self.inner_time
+        self.inner_time = 0.0
+        return outer_time, thread_time()
+
+    def _leave(self, all_stats: tuple, outer_time: float, start: float):
+        elapsed = thread_time() - start
+        for stats in all_stats:
+            stats[2] += elapsed - self.inner_time
+            stats[3] -= 1
+            if not stats[3]:
+                stats[1] += elapsed
+        self.inner_time = outer_time + elapsed
+
+    def instrument(self, x: list, code):
+        all_stats = self._all_stats(x)
+
+        def profiled(env):
+            outer_time, start = self._enter(all_stats)
+            try:
+                return code(env)
+            finally:
+                self._leave(all_stats, outer_time, start)
+        return profiled
+
+    def instrument_steps(self, x: list, code):
+        """
+        Instruments code compiled by compile_steps. Calls made on the explicit stack still nest within the ones that
+        made them, so they're timed the same way as ones made in Python.
+        """
+        all_stats = self._all_stats(x)
+
+        def profiled(env):
+            outer_time, start = self._enter(all_stats)
+            try:
+                return (yield from code(env))
+            finally:
+                self._leave(all_stats, outer_time, start)
+        return profiled
+
+    def _children(self, x: list, procedures: list) -> list:
+        # The expressions evaluated as part of one, leaving the bodies of procedures to be listed by themselves.
+        children = []
+        for i in x:
+            if not isinstance(i, list) or id(i) not in self.stats:
+                continue
+            if i[0] == _lambda and len(i) == 3:
+                name = x[1] if x[0] in (_define, _def) and isinstance(x[1], Symbol) else None
+                procedures.append((name, i[2]))
+            else:
+                children.append(i)
+        return children
+
+    def _position(self, x: list) -> str:
+        try:
+            return position(self.source, self.spans[id(x)][0])
+        except KeyError:
+            return "unknown position"
+
+    def _snippet(self, x: list) -> str:
+        snippet = reprint(x)
+        return snippet if len(snippet) <= self.snippet_length else snippet[:self.snippet_length - 3] + "..."
+
+    def _tree(self, x: list, depth: int, cutoff: float, lines: list, procedures: list):
+        count, total, own, _ = self.stats[id(x)]
+        if count and total >= cutoff:
+            lines.append(f"{total * 1000:10.2f} {own * 1000:10.2f} {count:10}  {'  ' * depth}{self._snippet(x)}"
+                         f"  ({self._position(x)})")
+        children = self._children(x, procedures)
+        for child in sorted(children, key=lambda i: self.stats[id(i)][1], reverse=True):
+            self._tree(child, depth + 1, cutoff, lines, procedures)
+
+    def report(self, fuel_used: int) -> str:
+        """
+        Writes up what was recorded while the program ran.
+        :param fuel_used: The fuel the run used.
+        :return: The report, as text.
+        """
+        if not isinstance(self.ast, list) or id(self.ast) not in self.stats:
+            return "Nothing was recorded while the program ran.\n"
+        run_time = self.stats[id(self.ast)][1]
+        cutoff = run_time * self.threshold
+        header = f"{'total ms':>10} {'own ms':>10} {'count':>10}  expression"
+        lines = [f"Profile of a run taking {run_time * 1000:.2f} ms of CPU time and {fuel_used} fuel.",
+                 f"Expressions are listed hottest first, with the time they took in all, the time they took "
+                 f"themselves, and how many times they were evaluated. Those taking under {self.threshold:.0%} of "
+                 f"the run are left out.", "", "Program:", header]
+        procedures = []
+        self._tree(self.ast, 0, cutoff, lines, procedures)
+        # Procedures defined in procedures are found while listing the procedures they're defined in.
+        for name, body in procedures:
+            if not isinstance(body, list) or id(body) not in self.stats or not self.stats[id(body)][0]:
+                continue
+            title = f"Procedure {name}:" if name is not None else f"Procedure at {self._position(body)}:"
+            lines += ["", title, header]
+            self._tree(body, 0, cutoff, lines, procedures)
+        lines += ["", "Calls by name:", f"{'total ms':>10} {'own ms':>10} {'count':>10}  name"]
+        for name, (count, total, own, _) in sorted(self.calls.items(), key=lambda i: i[1][2], reverse=True):
+            if count:
+                lines.append(f"{total * 1000:10.2f} {own * 1000:10.2f} {count:10}  {name}")
+        return "\n".join(lines) + "\n"
+
+
+# =============================================================================================================
+# Optimizer
+# Custom commands are optimized once, when they're saved, so that the work doesn't have to be done on every run.
+# The optimizer only relies on what it can see in the program, so it leaves alone any builtin the program binds a
+# variable of the same name to, and won't touch a program that builds code at runtime at all.
+
+# Builtins that only look at their arguments, always giving the same result for the same ones.
+pure_builtins = {name for name in (
+    '+', '-', '*', '/', '//', '%', '**', '>', '<', '>=', '<=', '==', '<>', '!=', '#', 'abs', 'car', 'cdr', 'reverse',
+    'do', 'len', 'pass', 'not', 'and', 'or', 'null?', 'number?', 'symbol?', 'list?', 'round', 'f', 'chr', 'ord', 'int',
+    'float', 'str', 'transcode', 'min', 'max',
+    'sqrt', 'isqrt', 'exp', 'log', 'log2', 'log10', 'sin', 'cos', 'tan', 'asin', 'acos', 'atan', 'atan2', 'sinh',
+    'cosh', 'tanh', 'degrees', 'radians', 'hypot', 'floor', 'ceil', 'trunc', 'fabs', 'fmod', 'copysign', 'gcd', 'lcm',
+    'factorial', 'pow', 'isclose', 'isfinite', 'isinf', 'isnan'
+) if name in base_env}
+# Builtin variables that always hold the same number.
+constant_builtins = {name for name, value in base_env.items() if type(value) is float and math.isfinite(value)}
+# The most fuel an expression folded into a constant may take, and how much longer than the expression its result
+# may be.
+FOLD_MAX_WORK = 64
+FOLD_MAX_LENGTH = 256
+# How long the body of a procedure inlined into its callers may be.
+INLINE_MAX_LENGTH = 64
+# The methods of str that can be folded, which build nothing bigger than what they're called on.
+fold_str_methods = {
+    'upper', 'lower', 'title', 'capitalize', 'casefold', 'swapcase', 'strip', 'lstrip', 'rstrip', 'startswith',
+    'endswith', 'find', 'rfind', 'count', 'isdigit', 'isalpha', 'isalnum', 'isspace', 'islower', 'isupper'
+}
+# Marks an expression that doesn't have a constant value.
+NOT_CONSTANT = Empty()
+
+
+def _constant_string(x) -> bool:
+    return isinstance(x, list) and len(x) == 2 and x[0] == _quote and isinstance(x[1], str)
+
+
+def _scan_bindings(x, bound: dict, symbols: set) -> bool:
+    """
+    Counts the variables a program binds, and collects every symbol it uses.
+    :return: Whether the program evaluates code built at runtime, or imports variables it doesn't name.
+    """
+    if isinstance(x, Symbol):
+        symbols.update(x.split(':'))
+        return False
+    if not isinstance(x, list) or not x:
+        return False
+    head = x[0]
+    if head in (_quote, _args):
+        return False
+    elif head == _unquote:
+        return True
+    elif head == 'import':
+        # Imports bind the definitions they name, or if they don't name them, whatever the library defines.
+        names = x[2:]
+        if not names or not all(_constant_string(name) for name in names):
+            return True
+        for _, name in names:
+            bound[name] = bound.get(name, 0) + 1
+    elif head in (_define, _def, _set) and len(x) == 3 and isinstance(x[1], Symbol):
+        name = x[1].split(':')[0]
+        bound[name] = bound.get(name, 0) + 1
+    elif head == _lambda and len(x) == 3 and isinstance(x[1], (list, Symbol)):
+        for param in x[1]:
+            if isinstance(param, Symbol):
+                bound[param] = bound.get(param, 0) + 1
+    dynamic = False
+    for i in x:
+        dynamic = _scan_bindings(i, bound, symbols) or dynamic
+    return dynamic
+
+
+def _foldable(name: str, args: list) -> bool:
+    """
+    Checks a call to a pure builtin that isn't metered won't take far longer, or build far more, than its arguments
+    suggest if it's folded.
+    """
+    if name == 'round':
+        return len(args) < 2 or type(args[1]) is int and abs(args[1]) <= FOLD_MAX_LENGTH
+    elif name == '%':
+        return not any(type(arg) is str for arg in args)
+    elif name == 'str':
+        return len(args) == 1 or args[0] in fold_str_methods
+    return True
+
+
+def _count_uses(x, name: Symbol) -> int:
+    if isinstance(x, list) and x and x[0] != _quote:
+        return sum(_count_uses(i, name) for i in x)
+    return x == name
+
+
+def _literal(value):
+    """
+    :return: The expression for a constant value, or NOT_CONSTANT if it doesn't have one short enough to write out.
+    """
+    if type(value) is str:
+        return [_quote, value]
+    elif type(value) is int and value.bit_length() > FOLD_MAX_LENGTH * 3:
+        return NOT_CONSTANT
+    elif type(value) is float and not math.isfinite(value):
+        return NOT_CONSTANT
+    elif type(value) in (bool, int, float):
+        return value
+    return NOT_CONSTANT
+
+
+class Optimizer:
+    """
+    Rewrites a program into one that does the same with less work:
+    Folds calls to pure builtins with constant arguments into their results.
+    Replaces ifs with constant tests by the branch they always take.
+    Inlines calls to trivial procedures, ones which only call pure builtins on their arguments, defined at the top
+    level of the program.
+    Hoists expressions that stay the same on every pass out of while loops, working them out once before the loop.
+    """
+
+    def __init__(self, bound: dict, symbols: set):
+        """
+        :param bound: How many times the program binds each variable it binds.
+        :param symbols: Every symbol used in the program.
+        """
+        self.bound = bound
+        self.symbols = symbols
+        self.inlinable = {}  # name: (params, body)
+
+    def optimize(self, x):
+        if isinstance(x, Symbol):
+            return self._fold_symbol(x)
+        elif not isinstance(x, list) or not x:
+            return x
+        head = x[0]
+        if head in (_quote, _args):
+            return x
+        elif head == _lambda:
+            return [head, x[1], self.optimize(x[2])] if len(x) == 3 else x
+        elif head in (_define, _def, _set):
+            return [head, x[1], self.optimize(x[2])] if len(x) == 3 else x
+        elif head == _if:
+            if len(x) != 4:
+                return x
+            test = self.optimize(x[1])
+            value = self._constant_value(test)
+            if value is not NOT_CONSTANT:
+                return self.optimize(x[2] if value else x[3])
+            return [head, test, self.optimize(x[2]), self.optimize(x[3])]
+        elif head == _while:
+            return self._hoist([head, *[self.optimize(i) for i in x[1:]]]) if len(x) == 3 else x
+        elif isinstance(head, Symbol) and head in special_forms:
+            return [head, *[self.optimize(i) for i in x[1:]]]
+        return self._optimize_call([self.optimize(i) for i in x])
+
+    def optimize_program(self, x):
+        """
+        Optimizes a whole program, allowing the procedures defined at its top level to be inlined after their
+        definitions.
+        """
+        if not (isinstance(x, list) and x and x[0] == _begin and self._builtin(_begin)):
+            return self.optimize(x)
+        statements = []
+        for statement in x[1:]:
+            statement = self.optimize(statement)
+            self._find_inlinable(statement)
+            statements.append(statement)
+        return [_begin, *statements]
+
+    def _builtin(self, name) -> bool:
+        # Whether a symbol is sure to refer to the builtin of the same name.
+        return name in base_env and name not in self.bound
+
+    def _pure(self, head) -> bool:
+        return isinstance(head, Symbol) and head in pure_builtins and head not in self.bound
+
+    def _fold_symbol(self, x: Symbol):
+        if x in constant_builtins and x not in self.bound:
+            return base_env[x]
+        return x
+
+    def _constant_value(self, x):
+        if type(x) in (bool, int, float):
+            return x
+        elif isinstance(x, list) and len(x) == 2 and x[0] == _quote and type(x[1]) in (str, bool, int, float):
+            return x[1]
+        return NOT_CONSTANT
+
+    def _optimize_call(self, x: list):
+        head = x[0]
+        if isinstance(head, Symbol) and head in self.inlinable:
+            x = self._inline(x)
+            if not isinstance(x, list) or x[0] != head:
+                return x
+        if not self._pure(head):
+            return x
+        args = [self._constant_value(arg) for arg in x[1:]]
+        if NOT_CONSTANT in args or not _foldable(head, args):
+            return x
+        f = base_env[head]
+        work, size = metered_builtins.get(id(f), (None, None))
         try:
-            raise CustomCommandSyntaxError(f"({x[0]}): {e}")
-        except IndexError:
-            raise CustomCommandSyntaxError(e)
+            if work is not None and work(*args) > FOLD_MAX_WORK or size is not None and size(*args) > FOLD_MAX_LENGTH:
+                return x
+            value = _literal(f(*args))
+        except Exception:  # Left for the error to happen when the program is run.
+            return x
+        if value is NOT_CONSTANT or isinstance(value, list) and len(value[1]) > FOLD_MAX_LENGTH + len(reprint(x)):
+            return x
+        return value
+
+    # Inlining
+
+    def _find_inlinable(self, x):
+        if not (isinstance(x, list) and len(x) == 3 and x[0] in (_define, _def)):
+            return
+        name, exp = x[1], x[2]
+        if not (isinstance(name, Symbol) and self.bound.get(name) == 1):
+            return
+        if not (isinstance(exp, list) and len(exp) == 3 and exp[0] == _lambda and isinstance(exp[1], list)):
+            return
+        params = exp[1]
+        if not all(isinstance(p, Symbol) and ':' not in p for p in params) or len(set(params)) != len(params):
+            return
+        if self._trivial(exp[2], params) and len(reprint(exp[2])) <= INLINE_MAX_LENGTH:
+            self.inlinable[name] = (params, exp[2])
+
+    def _trivial(self, x, params: list) -> bool:
+        if isinstance(x, Symbol):
+            return x in params
+        elif self._constant_value(x) is not NOT_CONSTANT:
+            return True
+        return isinstance(x, list) and bool(x) and self._pure(x[0]) and all(self._trivial(i, params) for i in x[1:])
+
+    def _inline(self, x: list):
+        params, body = self.inlinable[x[0]]
+        args = x[1:]
+        if len(args) != len(params):
+            return x
+        # Arguments can only be worked out where the procedure uses them if they don't have side effects, and only
+        # more than once if they're no work to speak of. Ones it doesn't use at all would never be worked out, losing
+        # the errors they raise, so only constants can be left out.
+        for param, arg in zip(params, args):
+            constant = self._constant_value(arg) is not NOT_CONSTANT
+            uses = _count_uses(body, param)
+            if not uses and not constant:
+                return x
+            if not (constant or isinstance(arg, Symbol) or self._invariant(arg, set()) and uses <= 1):
+                return x
+        return self._substitute(body, dict(zip(params, args)))
+
+    def _substitute(self, x, values: dict):
+        if isinstance(x, Symbol):
+            return values[x]
+        elif isinstance(x, list) and x[0] != _quote:
+            return self._optimize_call([x[0], *[self._substitute(i, values) for i in x[1:]]])
+        return x
+
+    # Hoisting
+
+    def _hoist(self, x: list):
+        (head, test, body) = x
+        assigned = set()
+        if not (self._builtin(_begin) and self._builtin('pass') and self._loop_safe(x, assigned)):
+            return x
+        # The test is worked out once more to guard the hoisted expressions, so it mustn't print or assign anything.
+        test_assigned = set()
+        self._loop_safe(test, test_assigned)
+        if test_assigned:
+            return x
+        hoisted = {}  # printed expression: variable
+        for exp in self._unconditional(test, assigned) + self._unconditional(body, assigned):
+            key = reprint(exp)
+            if key not in hoisted:
+                hoisted[key] = self._new_variable(), exp
+        if not hoisted:
+            return x
+        table = {key: name for key, (name, _) in hoisted.items()}
+        loop = [head, self._replace(test, table), self._replace(body, table)]
+        defines = [[_define, name, exp] for name, exp in hoisted.values()]
+        # The loop's test is checked once before the hoisted expressions are worked out, so they aren't if the loop
+        # never runs.
+        return [_if, test, [_begin, *defines, loop], ['pass']]
+
+    def _new_variable(self) -> Symbol:
+        i = 0
+        while f"_loop{i}" in self.symbols:
+            i += 1
+        self.symbols.add(f"_loop{i}")
+        return f"_loop{i}"
+
+    def _loop_safe(self, x, assigned: set) -> bool:
+        """
+        Checks that nothing in a loop can change a variable or value behind the optimizer's back, by only calling
+        pure builtins and not changing values in place, and collects the variables the loop assigns.
+        """
+        if not isinstance(x, list) or not x:
+            return True
+        head = x[0]
+        if head in (_quote, _args):
+            return True
+        elif head in (_lambda, _access, _unquote):
+            return False
+        elif head in (_define, _def, _set):
+            if len(x) != 3 or not isinstance(x[1], Symbol) or ':' in x[1]:
+                return False
+            assigned.add(x[1])
+            return self._loop_safe(x[2], assigned)
+        elif head == _print:
+            assigned.add('_rsoutput')
+        elif not (isinstance(head, Symbol) and head in special_forms or self._pure(head)):
+            return False
+        return all(self._loop_safe(i, assigned) for i in x[1:])
+
+    def _invariant(self, x, assigned: set) -> bool:
+        if isinstance(x, Symbol):
+            return not any(part in assigned for part in x.split(':'))
+        elif self._constant_value(x) is not NOT_CONSTANT:
+            return True
+        return isinstance(x, list) and bool(x) and self._pure(x[0]) and \
+            all(self._invariant(i, assigned) for i in x[1:])
+
+    def _unconditional(self, x, assigned: set) -> list:
+        """
+        Collects the largest invariant calls worked out whenever an expression is.
+        """
+        if not isinstance(x, list) or not x or x[0] in (_quote, _args, _try, _lambda):
+            return []
+        head = x[0]
+        if head in (_if, _while):
+            parts = x[1:2]
+        elif head in (_define, _def, _set):
+            parts = x[2:3]
+        elif self._invariant(x, assigned):
+            return [x]
+        else:
+            parts = x[1:]
+        return [exp for part in parts for exp in self._unconditional(part, assigned)]
+
+    def _replace(self, x, table: dict):
+        if not isinstance(x, list) or not x or x[0] in (_quote, _args):
+            return x
+        key = reprint(x)
+        if key in table:
+            return table[key]
+        return [self._replace(i, table) for i in x]
+
+
+# Builtins whose results don't only depend on their arguments, and the variables and procedures programs are given that
+# describe or act on whoever ran them.
+impure_names = {'random', 'randint', 'randints', 'randoms', 'choice', 'ezchoice', 'time', 'eztime', 'username',
+                'usernick', 'usermention', 'authorname', 'authornick', 'hasrole', 'delcall', 'embed', 'import',
+                'runcc', 'kv-get', 'kv-set', 'kv-incr'}
+
+
+def _plain_methods(x) -> bool:
+    # Whether every method a program calls with >> is named outright, and isn't one of Python's internals.
+    if not isinstance(x, list) or not x or x[0] == _quote:
+        return True
+    if x[0] == _access and len(x) > 1:
+        name = x[1]
+        if not (isinstance(name, list) and len(name) == 2 and name[0] == _quote and isinstance(name[1], str)
+                and not name[1].startswith('_')):
+            return False
+    return all(_plain_methods(i) for i in x)
+
+
+def is_deterministic(ast) -> bool:
+    """
+    Checks whether a program always gives the same result and output for the same arguments, without side effects.
+    That's the case when it uses none of impure_names, doesn't reach for Python's internals through names like
+    __loader__ or methods like __class__, and doesn't build code at runtime, where what it uses can't be seen.
+    :param ast:
+    :return:
+    """
+    symbols = set()
+    if _scan_bindings(ast, {}, symbols) or not _plain_methods(ast):
+        return False
+    return symbols.isdisjoint(impure_names) and not any(symbol.startswith('__') for symbol in symbols)
+
+
+def dependencies(ast) -> set[str]:
+    """
+    Finds the custom commands a program imports from or calls by name, which have to be sent along with it to run it.
+    :param ast:
+    :return: Their names.
+    """
+    found = set()
+    if isinstance(ast, list) and ast and ast[0] != _quote:
+        if ast[0] in ('import', 'runcc') and len(ast) > 1 and _constant_string(ast[1]):
+            found.add(ast[1][1].lower())
+        for x in ast:
+            found |= dependencies(x)
+    return found
+
+
+def optimize(ast):
+    """
+    Optimizes an RSLisp Abstract Syntax Tree, as described in Optimizer.
+    :param ast:
+    :return: The optimized tree. The original is left unmodified.
+    """
+    bound = {}
+    symbols = set()
+    if _scan_bindings(ast, bound, symbols):
+        return ast
+    return Optimizer(bound, symbols).optimize_program(ast)
@@ -0,0 +1,517 @@
+"""
+Runs RSLisp programs without holding up the rest of the bot, in one of two ways:
+In a pool of worker processes, so that a program stuck in a slow builtin only holds up its own worker, and can be
+killed without taking the rest of the bot with it. The bot and its workers only exchange plain data, one JSON object
+per line: the program's source and the values it runs with go in, and its result, output and the side effects it asked
+for, as a list of commands, come out. Run as a module to start a worker:
+python -m red_star.plugins.rs_lisp_pool (program cache size) (max sessions) (session TTL) (session size)
+Or in the bot's own process, a few steps at a time, on a thread the event loop waits on without blocking.
+Programs run in a REPL session are always run wherever the session lives, since its environment can't be sent
+elsewhere.
+"""
+from __future__ import annotations
+import asyncio
+import json
+import logging
+import sys
+import threading
+from collections import OrderedDict, deque
+from pathlib import Path
+from sys import getsizeof
+from time import monotonic
+from red_star.rs_errors import CommandSyntaxError, CustomCommandSyntaxError
+from .rs_lisp import Env, Frame, GlobalEnv, Meter, Modules, Output, Procedure, Profiler, ProgramCache, Seq, \
+    compile_ast, get_args, parse, standard_env
+from .rs_lisp_store import DataSession
+
+logger = logging.getLogger("red_star.plugins.rs_lisp_pool")
+
+# Workers are started as a module of the red_star package, from the directory the package is in.
+package_root = Path(__file__).resolve().parents[2]
+worker_module = "red_star.plugins.rs_lisp_pool"
+
+
+def run_program(request: dict, cache: ProgramCache, session: Session = None, **meter_options) -> dict:
+    """
+    Runs a program, catching whatever goes wrong with it.
+    :param request: The program's "source", the "scope" and "name" it's cached under (or a name of None to run it
+    without caching it), the "variables" it starts with, the lowercase names of the "roles" of whoever ran it, the
+    "limits" to meter it with, the sources of the other custom commands it can import from or call, as "modules", and
+    the "store" it keeps its data in, as described in DataSession.
+    If it has "profile" set, the program is run under a Profiler instead of being cached.
+    :param cache: The cache to get the compiled program from.
+    :param session: The REPL session to run the program in, or None to run it in an environment of its own.
+    :param meter_options: Options for the program's Meter, on top of its limits.
+    :return: The program's "result" and "output" as strings, the "commands" for the side effects it asked for, including
+    what it wrote to its store if it succeeded, and the "fuel_used", plus the "error" and its "error_type" if it
+    failed, and the "profile" report if it was profiled.
+    """
+    commands = []
+    roles = set(request["roles"])
+    if session is None:
+        env = standard_env(**request["limits"], **meter_options)
+    else:
+        env = session.start_run(request["limits"], meter_options)
+    env.update(request["variables"])
+    env['hasrole'] = lambda *x: any(role.lower() in roles for role in x)
+    env['delcall'] = lambda: commands.append(["delcall"])
+    env['embed'] = lambda *x: commands.append(["embed", get_args(x)[1]])
+    data = DataSession(request.get("store"), env.meter)
+    data.install(env)
+    Modules(request.get("modules", {}), request["scope"], cache, env, request["name"])
+
+    response = {"result": "", "output": "", "commands": commands}
+    profiler = None
+    try:
+        if request.get("profile"):
+            profiler = Profiler(request["source"])
+            program = profiler.program
+        elif request["name"] is None:
+            program = compile_ast(parse(request["source"]))
+        else:
+            program = cache.get(request["scope"], request["name"], request["source"])
+        result = program(env)
+        response["result"] = str(result) if result else ""
+        response["output"] = str(env['_rsoutput']) if env['_rsoutput'] else ""
+        if data.writes:
+            commands.append(["kv", data.writes])
+    except CustomCommandSyntaxError as e:
+        response.update(error=str(e), error_type="custom")
+    except CommandSyntaxError as e:
+        response.update(error=str(e), error_type="command")
+    except Exception as e:
+        logger.exception("Exception occurred in custom command: ", exc_info=True)
+        response.update(error=str(e), error_type="exception")
+    finally:
+        data.close()
+    response["fuel_used"] = env.meter.used
+    if profiler is not None:
+        response["profile"] = profiler.report(env.meter.used)
+    return response
+
+
+class ExecutionPool:
+    """
+    A pool of pre-started worker processes that run RSLisp programs, killing and replacing any that take too long.
+    Programs run in a REPL session always go to the same worker, which keeps the session between runs.
+    Workers quit by themselves once the bot closes their input, so the pool doesn't need stopping.
+    """
+
+    def __init__(self, size: int, cache_size: int, max_sessions: int = 0, session_ttl: float = 0,
+                 session_size: int = 0):
+        """
+        :param size: The number of workers to keep running.
+        :param cache_size: The size of each worker's program cache.
+        :param max_sessions: The most REPL sessions to keep at once, shared out between the workers.
+        :param session_ttl: The seconds a session is kept after it was last used.
+        :param session_size: The bytes each session's variables may hold on to.
+        """
+        self.size = size
+        self.worker_args = [str(cache_size), str(-(-max_sessions // size)), str(session_ttl), str(session_size)]
+        self.workers: list[asyncio.subprocess.Process] = []
+        self.busy: set[int] = set()
+        self.available = asyncio.Condition()
+
+    async def start(self):
+        for _ in range(self.size):
+            self.workers.append(await self._spawn())
+
+    async def _spawn(self) -> asyncio.subprocess.Process:
+        # Responses carry the program's whole output on one line, so the line length limit has to allow for that.
+        return await asyncio.create_subprocess_exec(sys.executable, "-m", worker_module, *self.worker_args,
+                                                    stdin=asyncio.subprocess.PIPE, stdout=asyncio.subprocess.PIPE,
+                                                    cwd=package_root, limit=1 << 28)
+
+    async def _replace(self, index: int):
+        process = self.workers[index]
+        if process.returncode is None:
+            process.kill()
+        await process.wait()
+        self.workers[index] = await self._spawn()
+
+    def worker_for(self, session) -> int:
+        """
+        :return: The worker a REPL session lives in.
+        """
+        return hash(session) % self.size
+
+    async def _acquire(self, index: int = None) -> int:
+        async with self.available:
+            while True:
+                if index is None:
+                    free = next((i for i in range(self.size) if i not in self.busy), None)
+                else:
+                    free = None if index in self.busy else index
+                if free is not None:
+                    self.busy.add(free)
+                    return free
+                await self.available.wait()
+
+    async def _release(self, index: int):
+        async with self.available:
+            self.busy.discard(index)
+            self.available.notify_all()
+
+    async def run(self, request: dict, timeout: float = None) -> dict:
+        """
+        Runs a program in the next free worker, or in the worker its "session" lives in. See run_program for the
+        request and response, and main for the rest of what workers can be asked.
+        :param request: The program to run.
+        :param timeout: The seconds to give the worker before killing it, or None to wait as long as it takes.
+        :return: The response from the worker.
+        """
+        session = request.get("session") or request.get("drop_session")
+        index = await self._acquire(None if session is None else self.worker_for(tuple(session)))
+        try:
+            process = self.workers[index]
+            process.stdin.write(json.dumps(request, default=str).encode() + b"\n")
+            await process.stdin.drain()
+            line = await asyncio.wait_for(process.stdout.readline(), timeout)
+            if not line:
+                raise ConnectionResetError("The worker running the custom command quit.")
+            return json.loads(line)
+        except asyncio.TimeoutError:
+            await self._replace(index)
+            raise CustomCommandSyntaxError("The command ran too long.") from None
+        except BaseException:
+            # Whatever the worker was doing, it's no longer in step with the pool.
+            await self._replace(index)
+            raise
+        finally:
+            await self._release(index)
+
+
+def retained_size(env: GlobalEnv, limit: int) -> int:
+    """
+    Roughly measures the memory the variables of an environment hold on to, including what procedures defined in it
+    hold on to, giving up once it's over limit.
+    """
+    seen = {id(env)}
+    values = list(env.values())
+    size = getsizeof(env)
+    while values and size <= limit:
+        x = values.pop()
+        if id(x) in seen:
+            continue
+        seen.add(id(x))
+        size += getsizeof(x)
+        if isinstance(x, dict):
+            values.extend(x.keys())
+            values.extend(x.values())
+            if type(x) is Env:
+                values.append(x.outer)
+        elif isinstance(x, (list, tuple, set)):
+            values.extend(x)
+        elif type(x) is Procedure:
+            values.append(x.env)
+        elif type(x) is Frame:
+            values.extend(x.slots)
+            values.append(x.outer)
+        elif type(x) is Seq:
+            values.extend(x.sources if x.items is None else [x.items])
+    return size
+
+
+class Session:
+    """
+    A REPL session, whose global environment carries on from one run to the next, so that what one run defines can be
+    used by the next without being defined again. Only one program runs in a session at a time.
+    """
+
+    def __init__(self, max_size: int):
+        """
+        :param max_size: The bytes the session's variables may hold on to between runs.
+        """
+        self.env = standard_env()
+        self.max_size = max_size
+        self.last_used = monotonic()
+        self.lock = asyncio.Lock()
+
+    def start_run(self, limits: dict, meter_options: dict) -> GlobalEnv:
+        """
+        Gets the session's environment ready for another run, with limits of its own and nothing printed yet.
+        """
+        limits = dict(limits)
+        max_output = limits.pop("max_output", 0)
+        # Restarted rather than replaced, since procedures from earlier runs keep hold of it.
+        self.env.meter.restart(Meter(**limits, **meter_options))
+        self.env['_rsoutput'] = Output(max_output)
+        return self.env
+
+    def oversized(self) -> bool:
+        return retained_size(self.env, self.max_size) > self.max_size
+
+
+class Sessions:
+    """
+    The REPL sessions in use, keyed by whoever's using them, each kept until it's gone unused for a while.
+    Only so many are kept at once, and starting another drops whichever has gone unused the longest.
+    """
+
+    def __init__(self, max_sessions: int, ttl: float, max_size: int):
+        """
+        :param max_sessions: The most sessions to keep at once.
+        :param ttl: The seconds a session is kept after it was last used.
+        :param max_size: The bytes each session's variables may hold on to.
+        """
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self.max_size = max_size
+        self.sessions: OrderedDict[object, Session] = OrderedDict()  # In the order they were last used.
+
+    def get(self, key) -> Session:
+        """
+        Gets a session, starting it if there isn't one.
+        """
+        now = monotonic()
+        while self.sessions and now - next(iter(self.sessions.values())).last_used > self.ttl:
+            self.sessions.popitem(last=False)
+        session = self.sessions.get(key)
+        if session is None:
+            session = self.sessions[key] = Session(self.max_size)
+            while len(self.sessions) > self.max_sessions:
+                self.sessions.popitem(last=False)
+        session.last_used = now
+        self.sessions.move_to_end(key)
+        return session
+
+    def drop(self, key) -> bool:
+        """
+        :return: Whether there was a session to drop.
+        """
+        return self.sessions.pop(key, None) is not None
+
+
+class UsageWindow:
+    """
+    The fuel burnt by each of a number of users over a rolling window of time, along with their total.
+    Fuel is counted in buckets of a tenth of the window, so the window rolls forward a bucket at a time, and only ten
+    counts are kept for each user however many runs they make.
+    """
+    buckets = 10
+
+    def __init__(self, window: float):
+        """
+        :param window: The seconds that fuel counts for after it's burnt.
+        """
+        self.window = window
+        self.bucket_size = window / self.buckets
+        self.usage: dict[object, deque[list]] = {}  # key: [[bucket, fuel], ...], oldest first; None for the total
+
+    def _counts(self, key) -> deque[list]:
+        counts = self.usage.get(key)
+        if counts is None:
+            counts = self.usage[key] = deque()
+        oldest = int(monotonic() // self.bucket_size) - self.buckets + 1
+        while counts and counts[0][0] < oldest:
+            counts.popleft()
+        return counts
+
+    def resize(self, window: float):
+        """
+        Changes how long the window is, keeping the fuel counted so far, each count moved to the bucket the time it
+        was counted at falls in.
+        """
+        old_bucket_size = self.bucket_size
+        self.window = window
+        self.bucket_size = window / self.buckets
+        for key, counts in self.usage.items():
+            resized = deque()
+            for bucket, fuel in counts:
+                bucket = int(bucket * old_bucket_size // self.bucket_size)
+                if resized and resized[-1][0] == bucket:
+                    resized[-1][1] += fuel
+                else:
+                    resized.append([bucket, fuel])
+            self.usage[key] = resized
+
+    def add(self, key, fuel: int):
+        """
+        Counts fuel burnt by a user, towards both theirs and the total.
+        """
+        bucket = int(monotonic() // self.bucket_size)
+        for counts in (self._counts(key), self._counts(None)):
+            if counts and counts[-1][0] == bucket:
+                counts[-1][1] += fuel
+            else:
+                counts.append([bucket, fuel])
+
+    def used(self, key=None) -> int:
+        """
+        :return: The fuel a user has burnt within the window, or everyone has if no user is given.
+        """
+        return sum(fuel for _, fuel in self._counts(key))
+
+    def wait(self, key, quota: int) -> float:
+        """
+        :param key: The user, or None for everyone.
+        :param quota: The fuel allowed within the window, or 0 for no limit.
+        :return: The seconds until enough fuel burnt by a user drops out of the window to bring them back under a
+        quota, or 0 if they're under it already.
+        """
+        counts = self._counts(key)
+        left = sum(fuel for _, fuel in counts)
+        if not quota or left < quota:
+            return 0
+        for bucket, fuel in counts:
+            left -= fuel
+            if left < quota:
+                return (bucket + self.buckets) * self.bucket_size - monotonic()
+        return 0
+
+    def top(self, count: int) -> list[tuple[object, int]]:
+        """
+        :return: The users who've burnt the most fuel within the window, and how much, most first.
+        """
+        for key in list(self.usage):
+            if not self._counts(key):
+                del self.usage[key]
+        return sorted(((key, self.used(key)) for key in self.usage if key is not None), key=lambda x: -x[1])[:count]
+
+
+class CooperativeRun:
+    """
+    Runs a program in the bot's own process a step at a time, like a generator, for when there's no pool to run it
+    in. Each step runs until the program has burnt another step_size units of fuel.
+    The program isn't a generator, though, since steps end wherever the fuel runs out, which may be in the middle of a
+    builtin, and builtins can't be suspended. Instead it runs on a thread of its own, handed back and forth with the
+    event loop: the thread wakes the loop up through call_soon_threadsafe whenever it finishes a step, and waits to be
+    resumed, so the loop carries on with everything else while a step runs, however long a single builtin in it takes.
+    If the program runs past its timeout it's stopped at its next step. One stuck in a builtin can't be stopped until
+    the builtin returns, so only max_abandoned of those are let run on at once; until they finish, no more programs
+    are run.
+    Builtins that hold the interpreter lock for the whole of a call, like arithmetic on huge numbers, still hold up
+    everything else in the process while they run, which only running programs in the pool can avoid.
+    """
+    # The threads of programs that were stopped but haven't finished yet, and how many of them there may be.
+    abandoned: set[threading.Thread] = set()
+    max_abandoned = 4
+    # The seconds to wait for a stopped program to finish before abandoning it.
+    stop_grace = 0.5
+
+    def __init__(self, request: dict, cache: ProgramCache, step_size: int, session: Session = None):
+        """
+        :param request: The program to run, as described in run_program.
+        :param cache: The cache to get the compiled program from.
+        :param step_size: The fuel the program burns in each step.
+        :param session: The REPL session to run the program in, if any.
+        """
+        self.request = request
+        self.cache = cache
+        self.step_size = step_size
+        self.session = session
+        self.response = None
+        self.finished = False
+        self.stopped = False
+        self.loop: asyncio.AbstractEventLoop = None
+        self.paused: asyncio.Event = None
+        self.resumed = threading.Semaphore(0)
+        self.thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        self.resumed.acquire()
+        try:
+            self.response = run_program(self.request, self.cache, self.session, check_interval=self.step_size,
+                                        pause=self._pause)
+        finally:
+            self.finished = True
+            self.loop.call_soon_threadsafe(self.paused.set)
+
+    def _pause(self):
+        if not self.stopped:
+            self.loop.call_soon_threadsafe(self.paused.set)
+            self.resumed.acquire()
+        if self.stopped:
+            raise CustomCommandSyntaxError("The command was stopped.")
+
+    async def step(self) -> bool:
+        """
+        Runs the program until it's burnt another step's worth of fuel.
+        :return: Whether the program has finished.
+        """
+        self.paused.clear()
+        self.resumed.release()
+        await self.paused.wait()
+        return self.finished
+
+    async def _steps(self):
+        while not await self.step():
+            pass
+
+    async def run(self, timeout: float = None) -> dict:
+        """
+        Runs the program to the end, one step at a time.
+        :param timeout: The seconds to give the program before abandoning it, or None to wait as long as it takes.
+        :return: The response from running the program, as described in run_program.
+        """
+        CooperativeRun.abandoned = {thread for thread in CooperativeRun.abandoned if thread.is_alive()}
+        if len(CooperativeRun.abandoned) >= self.max_abandoned:
+            raise CustomCommandSyntaxError("Too many stopped commands are still finishing. Try again later.")
+        self.loop = asyncio.get_running_loop()
+        self.paused = asyncio.Event()
+        self.thread.start()
+        try:
+            await asyncio.wait_for(self._steps(), timeout)
+        except asyncio.TimeoutError:
+            self._stop()
+            try:
+                await asyncio.wait_for(self.paused.wait(), self.stop_grace)
+            except asyncio.TimeoutError:
+                pass
+            self._abandon()
+            raise CustomCommandSyntaxError("The command ran too long.") from None
+        except BaseException:
+            self._stop()
+            self._abandon()
+            raise
+        return self.response
+
+    def _stop(self):
+        # Let the program run on by itself, failing at its next step.
+        self.stopped = True
+        self.paused.clear()
+        self.resumed.release()
+
+    def _abandon(self):
+        if self.thread.is_alive() and not self.finished:
+            CooperativeRun.abandoned.add(self.thread)
+
+
+def run_in_session(request: dict, cache: ProgramCache, sessions: Sessions, **meter_options) -> dict:
+    """
+    Runs a program in the REPL session named by its "session", starting the session if there isn't one, and resets
+    the session if the program leaves it holding on to too much memory.
+    :return: The response from run_program, with "session_reset" set if the session was reset.
+    """
+    key = tuple(request["session"])
+    session = sessions.get(key)
+    response = run_program(request, cache, session, **meter_options)
+    if session.oversized():
+        sessions.drop(key)
+        response["session_reset"] = True
+    return response
+
+
+def main():
+    """
+    Runs requests from the bot, one per line, each either a program to run as described in run_program, in its
+    "session" if it has one, or a session to drop, as "drop_session", answered with whether there was one to drop.
+    Started with the size of the program cache, then the most sessions to keep, how long to keep them and how much
+    memory each may hold on to, as described in Sessions.
+    """
+    cache = ProgramCache(int(sys.argv[1]))
+    sessions = Sessions(int(sys.argv[2]), float(sys.argv[3]), int(sys.argv[4]))
+    while line := sys.stdin.readline():
+        request = json.loads(line)
+        if "drop_session" in request:
+            response = {"dropped": sessions.drop(tuple(request["drop_session"]))}
+        elif "session" in request:
+            response = run_in_session(request, cache, sessions)
+        else:
+            response = run_program(request, cache)
+        sys.stdout.write(json.dumps(response, default=str) + "\n")
+        sys.stdout.flush()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,243 @@
+"""
+Lets custom commands keep data between runs, as keys and values in a store of their own, up to a quota.
+Each server keeps the stores of its custom commands in one SQLite database, which only the bot writes to. Runs read
+from it directly, wherever they run, and send what they wrote back with their response, to be written all at once.
+Values are kept as JSON, so a store can hold numbers, strings, and lists and dicts of them.
+"""
+from __future__ import annotations
+import asyncio
+import json
+import os
+import sqlite3
+from numbers import Number
+from pathlib import Path
+from time import monotonic
+from red_star.rs_errors import CustomCommandSyntaxError
+from .rs_lisp import ITEMS_PER_FUEL, GlobalEnv, Meter
+
+SCHEMA = """CREATE TABLE IF NOT EXISTS data (
+    cc TEXT NOT NULL,
+    key TEXT NOT NULL,
+    value TEXT NOT NULL,
+    PRIMARY KEY (cc, key)
+) WITHOUT ROWID"""
+
+
+def entry_size(key: str, value: str | None) -> int:
+    """
+    The bytes a key and its value, as JSON, count for towards a store's quota.
+    """
+    return 0 if value is None else len(key.encode()) + len(value.encode())
+
+
+def _quota_error(quota: int) -> CustomCommandSyntaxError:
+    return CustomCommandSyntaxError(f"The command went over its data quota of {quota} bytes.")
+
+
+class DataStore:
+    """
+    A server's database of custom command stores, as the bot sees it. Applies the writes runs send back, and keeps
+    track of how big each store is.
+    The database is only created once something is stored in it, and only kept open while it's in use, so that
+    servers that don't keep data don't cost a file or a connection.
+    """
+
+    def __init__(self, path: Path, idle_ttl: float = 60 * 60):
+        """
+        :param path: Where the database is, or is to be created.
+        :param idle_ttl: The seconds the database is kept open after it was last used.
+        """
+        # Runs may not have the same working directory as the bot.
+        self.path = path.resolve()
+        self.idle_ttl = idle_ttl
+        self.sizes = {}  # cc: bytes
+        self._connection = None
+        self.last_used = 0.0
+        self.close_timer = None
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        """
+        The connection to the database, opened, and the database created, the first time it's needed. While the event
+        loop is running, it's closed again once it's been idle for idle_ttl seconds.
+        """
+        self.last_used = monotonic()
+        if self._connection is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._connection = sqlite3.connect(self.path)
+            # Lets runs read the database while the bot is writing to it.
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute(SCHEMA)
+            self._schedule_close(self.idle_ttl)
+        return self._connection
+
+    def _schedule_close(self, delay: float):
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:  # Left open for whoever opened it outside the loop to close.
+            return
+        self.close_timer = loop.call_later(delay, self._close_if_idle)
+
+    def _close_if_idle(self):
+        self.close_timer = None
+        idle = monotonic() - self.last_used
+        if idle < self.idle_ttl:
+            self._schedule_close(self.idle_ttl - idle)
+        else:
+            self.close()
+
+    def _exists(self) -> bool:
+        return self._connection is not None or self.path.exists()
+
+    def size(self, cc: str) -> int:
+        """
+        :return: The bytes a custom command's store counts for towards its quota.
+        """
+        if cc not in self.sizes:
+            if not self._exists():
+                return 0
+            row = self.connection.execute("SELECT TOTAL(LENGTH(CAST(key AS BLOB)) + LENGTH(CAST(value AS BLOB))) "
+                                          "FROM data WHERE cc = ?", (cc,)).fetchone()
+            self.sizes[cc] = int(row[0])
+        return self.sizes[cc]
+
+    def write(self, cc: str, writes: dict[str, list], quota: int):
+        """
+        Applies what a run of a custom command wrote to its store, all of it or, if it fails, none of it.
+        :param cc: The name of the custom command.
+        :param writes: For each key written, ["set", value as JSON], or ["incr", amount] to add to the number in it.
+        :param quota: The most bytes the store may hold.
+        """
+        size = self.size(cc)
+        connection = self.connection
+        with connection:
+            for key, (action, value) in writes.items():
+                row = connection.execute("SELECT value FROM data WHERE cc = ? AND key = ?", (cc, key)).fetchone()
+                old = row[0] if row else None
+                if action == "incr":
+                    # Added to whatever's there now, so that runs going at once don't lose each other's counts.
+                    total = 0 if old is None else json.loads(old)
+                    if not isinstance(total, Number) or isinstance(total, bool):
+                        raise CustomCommandSyntaxError(f"can't add to {key}, which doesn't hold a number")
+                    value = json.dumps(total + value)
+                size += entry_size(key, value) - entry_size(key, old)
+                connection.execute("INSERT OR REPLACE INTO data VALUES (?, ?, ?)", (cc, key, value))
+            if size > quota:
+                raise _quota_error(quota)
+        self.sizes[cc] = size
+
+    def delete(self, cc: str):
+        """
+        Empties a custom command's store.
+        """
+        if self._exists():
+            with self.connection:
+                self.connection.execute("DELETE FROM data WHERE cc = ?", (cc,))
+        self.sizes.pop(cc, None)
+
+    def close(self):
+        if self.close_timer is not None:
+            self.close_timer.cancel()
+            self.close_timer = None
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+
+class DataSession:
+    """
+    A run's view of its custom command's store. Values read are cached for the rest of the run, and values written are
+    held back, to be sent back with the response and written all at once if the run succeeds.
+    """
+
+    def __init__(self, store: dict | None, meter: Meter):
+        """
+        :param store: The "path" of the database, the name of the "cc" whose store it is, the bytes it "used" when the
+        run started and its "quota", or None if the program being run isn't a custom command, and has no store.
+        :param meter: The run's meter, charged for the data read and written.
+        """
+        self.store = store
+        self.meter = meter
+        self.connection = None
+        self.values = {}  # key: value as JSON, or None if there isn't one, as far as the run is concerned
+        self.writes = {}  # key: ["set", value as JSON] or ["incr", amount]
+        if store is not None:
+            self.used = store["used"]
+
+    def install(self, env: GlobalEnv):
+        env['kv-get'] = self.get
+        env['kv-set'] = self.set
+        env['kv-incr'] = self.incr
+
+    def _value(self, key) -> str | None:
+        if self.store is None:
+            raise CustomCommandSyntaxError("Only custom commands can keep data.")
+        if not isinstance(key, str):
+            raise CustomCommandSyntaxError(f"data keys must be strings, not {type(key).__name__}")
+        if key not in self.values:
+            if self.connection is None:
+                if not os.path.exists(self.store["path"]):  # Nothing's been stored on the server yet.
+                    self.values[key] = None
+                    return None
+                self.connection = sqlite3.connect(self.store["path"])
+            row = self.connection.execute("SELECT value FROM data WHERE cc = ? AND key = ?",
+                                          (self.store["cc"], key)).fetchone()
+            self.values[key] = row[0] if row else None
+        return self.values[key]
+
+    def _put(self, key: str, value: str):
+        old = self.values[key]
+        used = self.used + entry_size(key, value) - entry_size(key, old)
+        if used > self.store["quota"]:
+            raise _quota_error(self.store["quota"])
+        self.meter.charge(len(value) // ITEMS_PER_FUEL)
+        self.used = used
+        self.values[key] = value
+
+    def get(self, key, default=None):
+        """
+        (kv-get key default): The value stored under a key, or the default if there isn't one.
+        """
+        value = self._value(key)
+        if value is None:
+            return default
+        self.meter.charge(len(value) // ITEMS_PER_FUEL)
+        self.meter.allocate(len(value))
+        return json.loads(value)
+
+    def set(self, key, value):
+        """
+        (kv-set key value): Stores a value under a key.
+        """
+        self._value(key)
+        try:
+            value = json.dumps(value)
+        except (TypeError, ValueError):
+            raise CustomCommandSyntaxError(f"can't store {type(value).__name__}; only numbers, strings, lists and "
+                                           f"dicts can be stored") from None
+        self._put(key, value)
+        self.writes[key] = ["set", value]
+
+    def incr(self, key, amount=1):
+        """
+        (kv-incr key amount): Adds to the number stored under a key, starting from 0 if there isn't one.
+        :return: The new number.
+        """
+        if not isinstance(amount, Number) or isinstance(amount, bool):
+            raise CustomCommandSyntaxError(f"can't add {type(amount).__name__} to a stored number")
+        old = self._value(key)
+        total = 0 if old is None else json.loads(old)
+        if not isinstance(total, Number) or isinstance(total, bool):
+            raise CustomCommandSyntaxError(f"can't add to {key}, which doesn't hold a number")
+        total += amount
+        self._put(key, json.dumps(total))
+        write = self.writes.get(key)
+        if write is None or write[0] == "incr":
+            self.writes[key] = ["incr", amount + (write[1] if write else 0)]
+        else:
+            self.writes[key] = ["set", self.values[key]]
+        return total
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
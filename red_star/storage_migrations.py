@@ -0,0 +1,291 @@
+from __future__ import annotations
+import json
+import logging
+from typing import NamedTuple
+
+from typing import TYPE_CHECKING
+if TYPE_CHECKING:
+    from pathlib import Path
+    from typing import Callable, Iterator, Optional
+    from red_star.config_manager import ConfigManager, JsonValues
+
+STAMP_FILE_NAME = "storage_version.json"
+
+
+class StorageMigration(NamedTuple):
+    version: int
+    description: str
+    migrate: Callable[[MigrationContext], None]
+
+
+migrations: list[StorageMigration] = []
+
+
+def storage_migration(version: int, description: str):
+    """
+    Registers a function as a storage migration. Migrations are run in version order, exactly once per data directory.
+    Versions must be unique and only ever appended to; an already-released migration must never be renumbered.
+    :param version: The storage version the migration brings the data directory to.
+    :param description: A short description of the migration, for the logs.
+    """
+    def decorator(func: Callable[[MigrationContext], None]):
+        if any(m.version == version for m in migrations):
+            raise ValueError(f"Duplicate storage migration version {version}.")
+        migrations.append(StorageMigration(version, description, func))
+        migrations.sort(key=lambda m: m.version)
+        return func
+    return decorator
+
+
+class MigrationContext:
+    """
+    Gives migrations access to the data directory. Storage files are read at most once and written out together
+    when the migration finishes, and legacy files are only retired once the new data has been written.
+    """
+
+    def __init__(self, config_manager: ConfigManager, guild_ids: set[str],
+                 save_args: Optional[dict[str, dict]] = None):
+        self.config_manager = config_manager
+        self.guild_ids = guild_ids
+        self.save_args = {} if save_args is None else save_args
+        self.logger = logging.getLogger("red_star.storage_migrations")
+        self.storage_files: dict[Path, JsonValues] = {}
+        self.retired_files: list[tuple[Path, str]] = []
+
+    def load_legacy_file(self, name: str, folder: Optional[Path] = None) -> Optional[JsonValues]:
+        """
+        Loads a legacy data file, if it exists.
+        :param name: The file name.
+        :param folder: The folder the file lives in. Defaults to the config folder.
+        :return: The file's contents, or None if there is no such file.
+        """
+        path = (self.config_manager.config_path if folder is None else folder) / name
+        try:
+            with path.open(encoding="utf-8") as fp:
+                return json.load(fp)
+        except FileNotFoundError:
+            return None
+
+    def retire_legacy_file(self, name: str, description: str, folder: Optional[Path] = None):
+        path = (self.config_manager.config_path if folder is None else folder) / name
+        self.retired_files.append((path, description))
+
+    def storage(self, guild_id: str, plugin_name: str, what: str) -> Optional[dict]:
+        """
+        Gets the storage contents of a plugin in a guild for modification.
+        :param guild_id: The guild ID.
+        :param plugin_name: The plugin name.
+        :param what: A description of the data being converted, for the warning if the guild isn't known.
+        :return: The storage contents, or None if the bot is no longer in that guild.
+        """
+        if guild_id not in self.guild_ids:
+            self.logger.warning(f"Server with ID {guild_id} not found! Is the bot still in this server?\n"
+                                f"Skipping conversion of this server's {what}...")
+            return None
+        return self._storage(self.config_manager.storage_path / guild_id / (plugin_name + ".json"))
+
+    def existing_storage(self, plugin_name: str) -> Iterator[tuple[str, dict]]:
+        """
+        Iterates over the storage contents of a plugin in every guild that has any.
+        :param plugin_name: The plugin name.
+        :return: An iterator of guild ID, storage contents pairs.
+        """
+        for path in self.config_manager.storage_path.glob(f"*/{plugin_name}.json"):
+            yield path.parent.name, self._storage(path)
+
+    def _storage(self, path: Path) -> dict:
+        try:
+            return self.storage_files[path]
+        except KeyError:
+            pass
+        try:
+            with path.open(encoding="utf-8") as fp:
+                contents = json.load(fp)
+        except FileNotFoundError:
+            contents = {}
+        self.storage_files[path] = contents
+        return contents
+
+    def commit(self):
+        for path, contents in self.storage_files.items():
+            path.parent.mkdir(parents=True, exist_ok=True)
+            # Written the same way the plugin owning the file writes it.
+            save_args = self.save_args.get(path.stem, {"ensure_ascii": False})
+            with path.open("w", encoding="utf-8") as fp:
+                json.dump(contents, fp, **save_args)
+        for path, description in self.retired_files:
+            if path.exists():
+                old_path = path.replace(path.with_name(path.name + ".old"))
+                self.logger.info(f"Old {description} converted to new format. "
+                                 f"Old data now located at {old_path} - you may delete this file.")
+        self.storage_files.clear()
+        self.retired_files.clear()
+
+
+def run_storage_migrations(config_manager: ConfigManager, guild_ids: set[str],
+                           save_args: Optional[dict[str, dict]] = None):
+    """
+    Brings the data directory up to the latest storage version. The version reached is recorded in a stamp file, so
+    each migration runs exactly once and an up-to-date data directory costs a single file read.
+    :param config_manager: The config manager, for the config and storage paths.
+    :param guild_ids: The IDs of all guilds the bot is in.
+    :param save_args: The arguments each plugin writes its storage files with, by plugin name.
+    """
+    logger = logging.getLogger("red_star.storage_migrations")
+    stamp_path = config_manager.storage_path / STAMP_FILE_NAME
+    try:
+        with stamp_path.open(encoding="utf-8") as fp:
+            current_version = json.load(fp)["version"]
+    except FileNotFoundError:
+        current_version = 0
+    except (json.decoder.JSONDecodeError, KeyError, TypeError):
+        logger.warning(f"Storage version stamp {stamp_path} is corrupt. Re-running all storage migrations...")
+        current_version = 0
+
+    pending = [m for m in migrations if m.version > current_version]
+    if not pending:
+        return
+    context = MigrationContext(config_manager, guild_ids, save_args)
+    stamp_path.parent.mkdir(parents=True, exist_ok=True)
+    for migration in pending:
+        logger.debug(f"Running storage migration {migration.version}: {migration.description}")
+        migration.migrate(context)
+        context.commit()
+        with stamp_path.open("w", encoding="utf-8") as fp:
+            json.dump({"version": migration.version}, fp)
+    logger.info(f"Storage migrated to version {pending[-1].version}.")
+
+
+# Migrations
+
+def _port_per_guild_file(context: MigrationContext, file_name: str, plugin_name: str, key: str, what: str):
+    old_storage = context.load_legacy_file(file_name)
+    if old_storage is None:
+        return
+    for guild_id, data in old_storage.items():
+        new_storage = context.storage(guild_id, plugin_name, what)
+        if new_storage is not None:
+            new_storage[key] = data
+    context.retire_legacy_file(file_name, what)
+
+
+@storage_migration(1, "Move channel manager data out of channel_manager.json")
+def _port_channel_manager(context: MigrationContext):
+    old_storage = context.load_legacy_file("channel_manager.json")
+    if old_storage is None:
+        return
+    for guild_id, channel_data in old_storage.items():
+        new_storage = context.storage(guild_id, "channel_manager", "channel manager storage")
+        if new_storage is not None:
+            new_storage.clear()
+            new_storage.update(channel_data)
+    context.retire_legacy_file("channel_manager.json", "channel manager storage")
+
+
+@storage_migration(2, "Move custom commands and CC bans out of ccs.json")
+def _port_custom_commands(context: MigrationContext):
+    old_storage = context.load_legacy_file("ccs.json")
+    if old_storage is None:
+        return
+    for guild_id, bans in old_storage.pop("bans", {}).items():
+        new_storage = context.storage(guild_id, "custom_commands", "CC ban storage")
+        if new_storage is not None:
+            bans.update(new_storage.get("bans", {}))
+            new_storage["bans"] = bans
+    for guild_id, cc_data in old_storage.items():
+        new_storage = context.storage(guild_id, "custom_commands", "CC storage")
+        if new_storage is not None:
+            cc_data.update(new_storage.get("ccs", {}))
+            new_storage["ccs"] = cc_data
+    context.retire_legacy_file("ccs.json", "CC storage")
+
+
+@storage_migration(3, "Move levelling data out of xp.json")
+def _port_levelling(context: MigrationContext):
+    _port_per_guild_file(context, "xp.json", "levelling", "xp", "XP storage")
+
+
+@storage_migration(4, "Move channel print documents out of walls.json")
+def _port_channel_print(context: MigrationContext):
+    _port_per_guild_file(context, "walls.json", "channel_print", "documents", "channel print document storage")
+
+
+@storage_migration(5, "Move music player bans out of music_player.json")
+def _port_music_player(context: MigrationContext):
+    old_storage = context.load_legacy_file("music_player.json")
+    if old_storage is None:
+        return
+    for guild_id, bans in old_storage.get("banned_users", {}).items():
+        new_storage = context.storage(guild_id, "music_player", "music ban storage")
+        if new_storage is not None:
+            bans.update(new_storage.get("banned_users", {}))
+            new_storage["banned_users"] = bans
+    context.retire_legacy_file("music_player.json", "music ban storage")
+
+
+@storage_migration(6, "Move reminders out of reminders.json")
+def _port_reminders(context: MigrationContext):
+    _port_per_guild_file(context, "reminders.json", "reminder", "reminders", "reminder storage")
+
+
+@storage_migration(7, "Move roleplay bios out of bios.json")
+def _port_roleplay(context: MigrationContext):
+    old_storage = context.load_legacy_file("bios.json")
+    if old_storage is None:
+        return
+    for guild_id, data in old_storage.items():
+        new_storage = context.storage(guild_id, "roleplay", "bio storage")
+        if new_storage is not None:
+            data.update(new_storage)
+            new_storage.clear()
+            new_storage.update(data)
+    context.retire_legacy_file("bios.json", "bio storage")
+
+
+@storage_migration(8, "Move role request reaction messages out of role_request_reaction_messages.json")
+def _port_role_request(context: MigrationContext):
+    old_storage = context.load_legacy_file("role_request_reaction_messages.json")
+    if old_storage is None:
+        return
+    # We have no way to check which guild a message belongs to, so we have no choice but to put all
+    # message IDs in all guilds.
+    for guild_id in context.guild_ids:
+        new_storage = context.storage(guild_id, "role_request", "role request reaction message storage")
+        new_storage.setdefault("role_request_reaction_messages", {}).update(old_storage)
+    context.retire_legacy_file("role_request_reaction_messages.json", "role request reaction message storage")
+
+
+@storage_migration(9, "Convert role request reaction messages to the typed format")
+def _port_role_request_reacts(context: MigrationContext):
+    for _, storage in context.existing_storage("role_request"):
+        for message_id, react_config in storage.get("role_request_reaction_messages", {}).items():
+            if isinstance(react_config, list):
+                storage["role_request_reaction_messages"][message_id] = {
+                    "reacts": react_config,
+                    "type": 0  # MESSAGE_TYPE.NORMAL
+                }
+            elif "required" not in react_config:
+                react_config["required"] = []
+
+
+@storage_migration(10, "Move MotD files into plugin storage")
+def _port_motd(context: MigrationContext):
+    motds_folder = context.config_manager.storage_path.parent / "motds"
+    config_changed = False
+    for guild_id in context.guild_ids:
+        # Looked up through the server's defaults too, since a server's config only keeps what differs from them.
+        motd_config = context.config_manager.get_server_view(guild_id).get("motd", {})
+        motd_file = motd_config.get("motd_file")
+        if motd_file is None:
+            continue
+        old_motds = context.load_legacy_file(motd_file, folder=motds_folder)
+        if old_motds is not None:
+            context.storage(guild_id, "motd", "MotD storage")["motds"] = old_motds
+            try:
+                del motd_config["motd_file"]
+            except KeyError:
+                pass  # Only set in the defaults, which other servers may still be using.
+            else:
+                config_changed = True
+    if config_changed:
+        context.config_manager.save_config()
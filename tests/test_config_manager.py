@@ -0,0 +1,60 @@
+"""
+Checks that hand edits of the config file are applied to the live config without losing unsaved changes.
+"""
+import json
+from red_star.config_manager import ConfigManager
+
+BASE_CONFIG = {
+    "global": {"__config_version": 3, "bot_maintainers": [1], "custom_commands": {"rslisp_max_depth": 1000}},
+    "default": {"custom_commands": {"cc_prefix": "!!", "cc_limit": 25}},
+    "100": {"custom_commands": {"cc_limit": 10}}
+}
+
+
+def make_config_manager(tmp_path) -> ConfigManager:
+    config_path = tmp_path / "config"
+    config_path.mkdir()
+    (config_path / "config.json").write_text(json.dumps(BASE_CONFIG), encoding="utf-8")
+    return ConfigManager(config_path, tmp_path / "storage")
+
+
+def edited(**changes) -> dict:
+    config = json.loads(json.dumps(BASE_CONFIG))
+    for section, values in changes.items():
+        config[section] = values
+    return config
+
+
+def test_edited_values_are_applied_and_published(tmp_path):
+    config_manager = make_config_manager(tmp_path)
+    published = []
+    config_manager.subscribe(lambda change: published.append(change.path), "default")
+    changes = config_manager.apply_config(edited(default={"custom_commands": {"cc_prefix": "??", "cc_limit": 25}}))
+    assert [(c.scope, c.path) for c in changes] == [("default", ("custom_commands", "cc_prefix"))]
+    assert config_manager.config["default"]["custom_commands"]["cc_prefix"] == "??"
+    assert published == [("custom_commands", "cc_prefix")]
+
+
+def test_values_deleted_from_the_file_are_deleted(tmp_path):
+    config_manager = make_config_manager(tmp_path)
+    config_manager.apply_config(edited(**{"100": {"custom_commands": {}}}))
+    assert "cc_limit" not in config_manager.config["100"]["custom_commands"]
+
+
+def test_unsaved_runtime_changes_survive_a_hand_edit(tmp_path):
+    config_manager = make_config_manager(tmp_path)
+    # A server joined and a setting changed since the file was last written.
+    config_manager.config["200"] = {"motd": {"enabled": True}}
+    config_manager.config["100"]["custom_commands"]["cc_prefix"] = "$"
+    config_manager.apply_config(edited(default={"custom_commands": {"cc_prefix": "??", "cc_limit": 25}}))
+    assert config_manager.config["200"] == {"motd": {"enabled": True}}
+    assert config_manager.config["100"]["custom_commands"] == {"cc_limit": 10, "cc_prefix": "$"}
+
+
+def test_edits_are_compared_against_the_last_save(tmp_path):
+    config_manager = make_config_manager(tmp_path)
+    config_manager.config["100"]["custom_commands"]["cc_limit"] = 5
+    config_manager.save_config()
+    assert not config_manager.apply_config(json.loads(config_manager.config_file_path.read_text()))
+    config_manager.apply_config(edited(**{"100": {"custom_commands": {"cc_limit": 7}}}))
+    assert config_manager.config["100"]["custom_commands"]["cc_limit"] == 7
@@ -0,0 +1,70 @@
+"""
+Checks that config changes are only published to the subscribers of the paths they touch.
+"""
+import json
+from red_star.config_manager import ConfigManager
+
+BASE_CONFIG = {
+    "global": {"__config_version": 3, "bot_maintainers": [1]},
+    "default": {"logger": {"log_event_blacklist": [], "log_output_interval": 5}},
+    "100": {"logger": {"log_output_interval": 10}}
+}
+
+
+def make_config_manager(tmp_path) -> ConfigManager:
+    config_path = tmp_path / "config"
+    config_path.mkdir()
+    (config_path / "config.json").write_text(json.dumps(BASE_CONFIG), encoding="utf-8")
+    return ConfigManager(config_path, tmp_path / "storage")
+
+
+def subscribe(config_manager: ConfigManager, scope: str, *path: str) -> list:
+    published = []
+    config_manager.subscribe(lambda change: published.append((change.scope, change.path)), scope, path)
+    return published
+
+
+def test_subscribers_fire_only_for_their_path(tmp_path):
+    config_manager = make_config_manager(tmp_path)
+    published = subscribe(config_manager, "100", "logger", "log_output_interval")
+    config = config_manager.get_server_view("100")["logger"]
+    config["log_event_blacklist"] = ["on_message"]
+    config_manager.get_server_view("200")["logger"]["log_output_interval"] = 1
+    config_manager.global_view["logger"] = {"log_output_interval": 1}
+    assert published == []
+    config["log_output_interval"] = 20
+    assert published == [("100", ("logger", "log_output_interval"))]
+
+
+def test_changes_to_sections_and_defaults_reach_subscribers_below_them(tmp_path):
+    config_manager = make_config_manager(tmp_path)
+    published = subscribe(config_manager, "100", "logger", "log_output_interval")
+    config_manager.get_server_view("100")["logger"] = {"log_output_interval": 20}
+    config_manager.default_view["logger"]["log_output_interval"] = 1
+    assert published == [("100", ("logger",)), ("default", ("logger", "log_output_interval"))]
+
+
+def test_section_subscribers_hear_of_everything_in_it(tmp_path):
+    config_manager = make_config_manager(tmp_path)
+    published = subscribe(config_manager, "100", "logger")
+    config = config_manager.get_server_view("100")["logger"]
+    config["log_output_interval"] = 20
+    config["log_event_blacklist"].append("on_message")
+    assert published == [("100", ("logger", "log_output_interval")), ("100", ("logger", "log_event_blacklist"))]
+
+
+def test_unsubscribed_callbacks_stop_firing(tmp_path):
+    config_manager = make_config_manager(tmp_path)
+    published = []
+    subscription = config_manager.subscribe(published.append, "100", ("logger",))
+    config_manager.unsubscribe(subscription)
+    config_manager.get_server_view("100")["logger"]["log_output_interval"] = 20
+    assert published == []
+
+
+def test_a_failing_subscriber_doesnt_stop_the_rest(tmp_path):
+    config_manager = make_config_manager(tmp_path)
+    config_manager.subscribe(lambda change: 1 / 0, "100", ("logger",))
+    published = subscribe(config_manager, "100", "logger")
+    config_manager.get_server_view("100")["logger"]["log_output_interval"] = 20
+    assert published == [("100", ("logger", "log_output_interval"))]
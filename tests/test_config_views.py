@@ -0,0 +1,72 @@
+"""
+Checks that config views read through from server overrides to the defaults, and only ever store overrides.
+"""
+import json
+from types import SimpleNamespace
+from red_star.config_manager import ConfigManager
+
+BASE_CONFIG = {
+    "global": {"__config_version": 3, "bot_maintainers": [1]},
+    "default": {"custom_commands": {"cc_prefix": "!!", "cc_limit": 25, "cc_role_whitelist": ["admin"]}},
+    "100": {"custom_commands": {"cc_limit": 10}}
+}
+PLUGIN_DEFAULTS = {"cc_prefix": "!", "cc_limit": 50, "cc_role_whitelist": [], "cc_fuel_budget": 1000}
+GUILD = SimpleNamespace(id=100)
+
+
+def make_config_manager(tmp_path) -> ConfigManager:
+    config_path = tmp_path / "config"
+    config_path.mkdir()
+    (config_path / "config.json").write_text(json.dumps(BASE_CONFIG), encoding="utf-8")
+    return ConfigManager(config_path, tmp_path / "storage")
+
+
+def test_lookups_fall_through_the_layers(tmp_path):
+    config = make_config_manager(tmp_path).get_server_config(GUILD, "custom_commands", PLUGIN_DEFAULTS)
+    assert config["cc_limit"] == 10
+    assert config["cc_prefix"] == "!!"
+    assert config["cc_fuel_budget"] == 1000
+    assert sorted(config) == sorted(PLUGIN_DEFAULTS)
+    assert config.resolve() == {"cc_prefix": "!!", "cc_limit": 10, "cc_role_whitelist": ["admin"],
+                                "cc_fuel_budget": 1000}
+
+
+def test_only_overrides_are_stored(tmp_path):
+    config_manager = make_config_manager(tmp_path)
+    config = config_manager.get_server_config(GUILD, "custom_commands", PLUGIN_DEFAULTS)
+    config.resolve()
+    assert config_manager.config["100"] == {"custom_commands": {"cc_limit": 10}}
+    config["cc_fuel_budget"] = 500
+    assert config_manager.config["100"] == {"custom_commands": {"cc_limit": 10, "cc_fuel_budget": 500}}
+    assert config_manager.config["default"] == BASE_CONFIG["default"]
+    assert PLUGIN_DEFAULTS["cc_fuel_budget"] == 1000
+
+
+def test_default_changes_show_through_existing_views(tmp_path):
+    config_manager = make_config_manager(tmp_path)
+    config = config_manager.get_server_config(GUILD, "custom_commands", PLUGIN_DEFAULTS)
+    other = config_manager.get_server_config(SimpleNamespace(id=200), "custom_commands")
+    assert config["cc_prefix"] == other["cc_prefix"] == "!!"
+    config_manager.default_view["custom_commands"]["cc_prefix"] = "??"
+    assert config["cc_prefix"] == other["cc_prefix"] == "??"
+    config_manager.default_view["custom_commands"]["cc_limit"] = 5
+    assert config["cc_limit"] == 10
+    assert other["cc_limit"] == 5
+
+
+def test_deleting_an_override_reveals_the_default(tmp_path):
+    config = make_config_manager(tmp_path).get_server_config(GUILD, "custom_commands", PLUGIN_DEFAULTS)
+    del config["cc_limit"]
+    assert config["cc_limit"] == 25
+
+
+def test_lists_are_copied_into_the_server_when_modified(tmp_path):
+    config_manager = make_config_manager(tmp_path)
+    config = config_manager.get_server_config(GUILD, "custom_commands", PLUGIN_DEFAULTS)
+    whitelist = config["cc_role_whitelist"]
+    whitelist.append("mod")
+    assert whitelist == ["admin", "mod"]
+    assert config_manager.config["100"]["custom_commands"]["cc_role_whitelist"] == ["admin", "mod"]
+    assert config_manager.config["default"]["custom_commands"]["cc_role_whitelist"] == ["admin"]
+    whitelist.remove("admin")
+    assert config["cc_role_whitelist"] == ["mod"]
@@ -0,0 +1,151 @@
+"""
+Checks that RSLisp programs compiled into closures run the way they did under the tree-walking evaluator that the
+compiler replaced, and that variables resolve to the right frame slots.
+"""
+import pytest
+from red_star.plugins.rs_lisp import Env, Scope, _resolve, compile_ast, lisp_eval, parse, standard_env
+from red_star.rs_errors import CustomCommandSyntaxError
+
+# What the tree-walking evaluator gave for each program: its result's repr, or None if it failed, and its output.
+BASELINE = [
+    ('"plain string"', "'plain string'", ''),
+    ('"escaped \\"quotes\\" and \\\\ backslash"', '\'escaped "quotes" and \\\\ backslash\'', ''),
+    ('"semicolon \\; inside and a\\nnewline"', "'semicolon ; inside and a\\nnewline'", ''),
+    ('(list 1 -2 3.5 -0.25 1e3 "x")', "[1, -2, 3.5, -0.25, 1000.0, 'x']", ''),
+    ('(do ; a comment\n (+ 1 2) ; another\n)', '3', ''),
+    ('(f "a" "b;c" "(not a list)")', "'ab;c(not a list)'", ''),
+    ('(list (list 1 2) (list) (list (list 3)))', '[[1, 2], [], [[3]]]', ''),
+    ('(quote (a b (c "d")))', "['a', 'b', ['c', ['quote', 'd']]]", ''),
+    ('(+ 1 2)', '3', ''),
+    ('(- 5)', '-5', ''),
+    ('(- 10 3)', '7', ''),
+    ('(// 17 5)', '3', ''),
+    ('(% 17 5)', '2', ''),
+    ('(** 2 100)', '1267650600228229401496703205376', ''),
+    ('(round (/ 22 7) 3)', '3.143', ''),
+    ('(sort (list 3 1 2))', '[1, 2, 3]', ''),
+    ('(sum (range 10))', '45', ''),
+    ('(str "upper" "abc")', "'ABC'", ''),
+    ('(max 1 7 3)', '7', ''),
+    ('(do (define x 1) (:= x (+ x 1)) x)', '2', ''),
+    ('(do (define x 1) (define f (lambda () x)) (define x 2) (f))', '2', ''),
+    ('(do (define x 1) (define f (lambda () (:= x 5))) (f) x)', '5', ''),
+    ('(do (define x 1) (define f (lambda (x) (:= x 5))) (f 3) x)', '1', ''),
+    ('(do (define f (lambda (x) (do (define y (* x 2)) y))) (f 21))', '42', ''),
+    ('(do (define make (lambda (n) (lambda (x) (+ x n)))) (define add3 (make 3)) (add3 4))', '7', ''),
+    ('(do (define counter (lambda () (do (define n 0) (lambda () (do (:= n (+ n 1)) n))))) (define c '
+     '(counter)) (c) (c) (c))',
+     '3', ''),
+    ('(do (define fact (lambda (n) (if (<= n 1) 1 (* n (fact (- n 1)))))) (fact 20))', '2432902008176640000', ''),
+    ('(do (define fib (lambda (n) (if (< n 2) n (+ (fib (- n 1)) (fib (- n 2)))))) (fib 15))', '610', ''),
+    ('(do (define compose (lambda (f g) (lambda (x) (f (g x))))) ((compose (lambda (x) (* x 2)) (lambda '
+     '(x) (+ x 1))) 5))',
+     '12', ''),
+    ('(map (lambda (x) (* x x)) (list 1 2 3))', '[1, 4, 9]', ''),
+    ('(do (define fs (list)) (define i 0) (while (< i 3) (do (append fs (lambda () i)) (:= i (+ i 1)))) '
+     '(map (lambda (g) (g)) fs))',
+     '[3, 3, 3]', ''),
+    ('(do (define outer (lambda (a) (do (define inner (lambda (b) (+ a b))) (inner 10)))) (outer 5))', '15', ''),
+    ('(do (define l (list 1 (list 2 3))) l:1:0)', '2', ''),
+    ('(do (define l (list 1 2 3)) (:= l:1 20) l)', '[1, 20, 3]', ''),
+    ('(do (define l (list 1 2 3)) (define i 2) l:i)', '3', ''),
+    ('(if (> 3 2) "yes" "no")', "'yes'", ''),
+    ('(do (define i 0) (define t 0) (while (< i 5) (do (:= t (+ t i)) (:= i (+ i 1)))) t)', '10', ''),
+    ('(do (print "a" 1) (print) (print "b") 7)', '7', 'a 1\n\nb\n'),
+    ('(try (/ 1 0) "caught")', "'caught'", ''),
+    ('(try (raise "boom") "caught")', "'caught'", ''),
+    ('(raise "boom")', None, ''),
+    ('(unquote (quote (+ 1 2)))', '3', ''),
+    ('(>> "upper" "abc")', "'ABC'", ''),
+    ('(>> "split" "a,b,c" ",")', "['a', 'b', 'c']", ''),
+    ('(args)', "'one two three'", ''),
+    ('(args 0)', "'one'", ''),
+    ('(args 5)', 'None', ''),
+    ('(args *)', "['one', 'two', 'three']", ''),
+    ('(args 1 *)', "['two', 'three']", ''),
+    ('(/ 1 0)', None, ''),
+    ('undefined_name', None, ''),
+    ('(undefined_name 1)', None, ''),
+    ('(+ 1 "a")', None, ''),
+    ('(do (define x 1) (define f (lambda () (do (define y x) (define x 2) (list y x)))) (f))', '[1, 2]', ''),
+    ('(do (define x 1) (define f (lambda () (do (:= x 7) (define x 2) x))) (list (f) x))', '[2, 7]', ''),
+    ('(do (define a 1) (define f (lambda (b) (lambda (c) (lambda (d) (list a b c d))))) '
+     '(((f 2) 3) 4))',
+     '[1, 2, 3, 4]', ''),
+    ('(do (define f (lambda (b) (lambda (c) (lambda (d) (do (:= b (+ b 10)) (list b c d)))))) (define g '
+     '((f 2) 3)) (g 4) (g 5))',
+     '[22, 3, 5]', ''),
+    ('(do (define f (lambda () (do (unquote (quote (define z 3))) z))) (f))', '3', ''),
+    ('(do (define z 1) (define f (lambda () (do (define q z) (unquote (quote (define z 3))) '
+     '(list q z)))) (list (f) z))',
+     '[[1, 3], 1]', ''),
+    ('(do (define len 5) len)', '5', ''),
+    ('(do (define f (lambda () (define len 5))) (f) (len "abc"))', '3', ''),
+    ('(do (define f (lambda (a b) (list a b))) (f 1))', None, ''),
+    ('(do (define f (lambda (x) (do (define x (* x 2)) x))) (f 4))', '8', ''),
+    ('(do (define l (list 1 2 3)) (define f (lambda (i) l:i)) (f 1))', '2', ''),
+    ('(do (define f (lambda () (do (define l (list 4 5)) (:= l:0 9) l))) (f))', '[9, 5]', ''),
+    ('(do (define f (lambda () (print "in f"))) (f) (f) 1)', '1', 'in f\nin f\n'),
+    ('(do (define f (lambda () undefined_name)) (f))', None, ''),
+    ('(do (define f (lambda () (:= undefined_name 1))) (f))', None, ''),
+]
+
+
+def environment():
+    env = standard_env(fuel=10 ** 6)
+    env['argstring'] = "one two three"
+    env['args'] = ["one", "two", "three"]
+    return env
+
+
+@pytest.mark.parametrize("source, result, output", BASELINE)
+def test_compiled_program_behaves_like_the_baseline(source, result, output):
+    env = environment()
+    try:
+        got = repr(compile_ast(parse(source))(env))
+    except CustomCommandSyntaxError:
+        got = None
+    assert (got, str(env['_rsoutput'])) == (result, output)
+
+
+@pytest.mark.parametrize("source, result, output", BASELINE)
+def test_evaluating_outside_the_top_level_behaves_the_same(source, result, output):
+    env = environment()
+    try:
+        got = repr(lisp_eval(parse(source), Env(outer=env)))
+    except CustomCommandSyntaxError:
+        got = None
+    assert (got, str(env['_rsoutput'])) == (result, output)
+
+
+def test_variables_resolve_to_slots():
+    outer = Scope(("a", "b"), ("c", "a"))
+    inner = Scope(("d",), (), parent=outer)
+    assert outer.names == ("a", "b", "c")
+    assert _resolve("d", inner) == (0, 0)
+    assert _resolve("c", inner) == (1, 2)
+    assert _resolve("len", inner) is None
+    assert _resolve("a", Scope((), (), parent=inner, dynamic=True)) is False
+
+
+def test_tail_calls_dont_nest():
+    source = '(do (define f (lambda (n) (if (== n 0) "done" (f (- n 1))))) (f 5000))'
+    assert compile_ast(parse(source))(environment()) == "done"
+
+
+def test_deep_recursion_carries_on_past_pythons_recursion_limit():
+    source = '(do (define f (lambda (n) (if (< n 1) 0 (+ 1 (f (- n 1)))))) (f 2000))'
+    assert compile_ast(parse(source))(standard_env(fuel=10 ** 6, max_depth=5000)) == 2000
+    with pytest.raises(CustomCommandSyntaxError, match="limit of 1000 nested calls"):
+        compile_ast(parse(source))(standard_env(fuel=10 ** 6, max_depth=1000))
+
+
+@pytest.mark.parametrize("source, result, output", BASELINE)
+def test_programs_behave_the_same_on_the_explicit_stack(source, result, output):
+    env = environment()
+    env.meter.native_depth = 0
+    try:
+        got = repr(compile_ast(parse(source))(env))
+    except CustomCommandSyntaxError:
+        got = None
+    assert (got, str(env['_rsoutput'])) == (result, output)
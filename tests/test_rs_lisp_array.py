@@ -0,0 +1,68 @@
+"""
+Checks numeric array builtins, and that they're charged for and checked by how many items they go through.
+"""
+from array import array
+import pytest
+from red_star.plugins.rs_lisp import ProgramCache, lisp_eval, parse, standard_env
+from red_star.plugins.rs_lisp_pool import run_program
+from red_star.rs_errors import CustomCommandSyntaxError
+
+
+def evaluate(source: str):
+    return lisp_eval(parse(source), standard_env(fuel=10 ** 6))
+
+
+def run(source: str, **limits) -> dict:
+    request = {"source": source, "scope": "1", "name": None, "variables": {}, "roles": [],
+               "limits": {"fuel": 10 ** 6, "max_depth": 100, "max_value_size": 1 << 20} | limits}
+    return run_program(request, ProgramCache(1 << 20))
+
+
+@pytest.mark.parametrize("source, result", [
+    ('(array (list 1 2 3))', array('q', [1, 2, 3])),
+    ('(array (list 1 2.5))', array('d', [1.0, 2.5])),
+    ('(array (list (** 2 70)))', array('d', [2.0 ** 70])),
+    ('(v+ (array (range 3)) 10)', array('q', [10, 11, 12])),
+    ('(v* (array (range 3)) (array (list 2 2 2)))', array('q', [0, 2, 4])),
+    ('(v/ (array (list 1 2)) 2)', array('d', [0.5, 1.0])),
+    ('(v< (array (range 4)) 2)', array('q', [1, 1, 0, 0])),
+    ('(cumsum (array (range 5)))', array('q', [0, 1, 3, 6, 10])),
+    ('(sort (array (list 3 1 2)))', array('q', [1, 2, 3])),
+    ('(list (sum (array (range 5))) (mean (array (range 5))) (min (array (range 5))) (max (array (range 5))))',
+     [10, 2.0, 0, 4]),
+])
+def test_arrays_work_element_by_element(source, result):
+    assert evaluate(source) == result
+
+
+@pytest.mark.parametrize("source, counts", [
+    ('(histogram (array (list 1 2 2 3 10)) 3)', [4, 0, 1]),
+    ('(histogram (list 5 5) 2)', [2, 0]),
+    ('(histogram (list 1 2 3) 2 0 2)', [0, 2]),
+    ('(histogram (list) 2)', [0, 0]),
+])
+def test_histogram_counts_values_into_bins(source, counts):
+    assert evaluate(source) == array('q', counts)
+
+
+@pytest.mark.parametrize("source", ['(v+ (array (range 3)) (array (range 4)))', '(histogram (list 1) 0)'])
+def test_misused_array_builtins_fail_cleanly(source):
+    with pytest.raises(CustomCommandSyntaxError):
+        evaluate(source)
+
+
+def test_random_arrays_are_in_range():
+    dice = evaluate('(randints 1000 1 6)')
+    assert len(dice) == 1000 and set(dice) <= {1, 2, 3, 4, 5, 6}
+    fractions = evaluate('(randoms 1000)')
+    assert len(fractions) == 1000 and all(0 <= x < 1 for x in fractions)
+
+
+@pytest.mark.parametrize("source", ['(sum (array (range 10000000)))', '(cumsum (randints 10000000 1 6))'])
+def test_arrays_are_charged_by_their_length(source):
+    assert "The command ran out of fuel." in run(source, fuel=10000)["error"]
+
+
+def test_arrays_too_big_to_build_are_refused():
+    response = run('(randoms 100000000)', fuel=10 ** 9)
+    assert "The command tried to build a value of" in response["error"]
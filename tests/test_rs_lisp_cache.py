@@ -0,0 +1,122 @@
+"""
+Checks that compiled programs are reused until their source changes, which programs have their responses cached, and
+that cached responses are only given back to runs they'd be the same for.
+"""
+import pytest
+from red_star.plugins.rs_lisp import ProgramCache, ResultCache, ast_size, is_deterministic, parse, standard_env
+
+
+def test_programs_are_compiled_once_per_source():
+    cache = ProgramCache(1 << 20)
+    program = cache.get("guild", "cc", "(+ 1 2)")
+    assert program(standard_env(fuel=1000)) == 3
+    assert cache.get("guild", "cc", "(+ 1 2)") is program
+    assert cache.get("other guild", "cc", "(+ 1 2)") is not program
+    changed = cache.get("guild", "cc", "(+ 1 3)")
+    assert changed(standard_env(fuel=1000)) == 4
+    stats = cache.get_stats()
+    assert (stats["hits"], stats["misses"], stats["programs"]) == (1, 3, 2)
+
+
+def test_invalidated_programs_are_recompiled():
+    cache = ProgramCache(1 << 20)
+    program = cache.get("guild", "cc", "(+ 1 2)")
+    other = cache.get("guild", "other", "(+ 1 2)")
+    cache.invalidate("guild", "cc")
+    assert cache.get("guild", "other", "(+ 1 2)") is other
+    assert cache.get("guild", "cc", "(+ 1 2)") is not program
+    cache.invalidate("guild")
+    assert cache.get_stats()["programs"] == cache.get_stats()["size"] == 0
+
+
+def test_programs_are_evicted_to_stay_within_the_size():
+    source = "(list 1 2 3)"
+    cache = ProgramCache(ast_size(parse(source)) * 2)
+    for name in ("a", "b", "c"):
+        cache.get("guild", name, source)
+    # Using b last leaves c the least recently used when d comes in.
+    program = cache.get("guild", "c", source)
+    recent = cache.get("guild", "b", source)
+    cache.get("guild", "d", source)
+    stats = cache.get_stats()
+    assert stats["programs"] == 2
+    assert stats["evictions"] == 2
+    assert cache.get("guild", "b", source) is recent
+    assert cache.get("guild", "c", source) is not program
+
+
+def test_programs_too_large_to_cache_still_run():
+    cache = ProgramCache(1)
+    assert cache.get("guild", "cc", "(+ 1 2)")(standard_env(fuel=1000)) == 3
+    assert cache.get_stats()["programs"] == 0
+
+
+@pytest.mark.parametrize("source", [
+    '(+ 1 2)',
+    '(do (define sq (lambda (x) (* x x))) (sq 4))',
+    '(f "Hello " args)',
+])
+def test_pure_programs_are_deterministic(source):
+    assert is_deterministic(parse(source))
+
+
+@pytest.mark.parametrize("source", [
+    '(randint 1 6)',
+    '(choice (list 1 2 3))',
+    '(f "Hello " username)',
+    '(kv-get "count")',
+    '(kv-set "count" 1)',
+    '(kv-incr "count")',
+    '(do (define r randint) (r 1 6))',
+    '(runcc "other")',
+])
+def test_impure_programs_are_never_deterministic(source):
+    assert not is_deterministic(parse(source))
+
+
+LIMITS = {"fuel": 1000, "max_output": 100}
+
+
+def response(result):
+    return {"result": result, "output": ""}
+
+
+def test_responses_are_cached_by_arguments():
+    cache = ResultCache(2)
+    cache.put("guild", "cc", "(f args)", LIMITS, "a", response("a"))
+    assert cache.get("guild", "cc", "(f args)", LIMITS, "a") == response("a")
+    assert cache.get("guild", "cc", "(f args)", LIMITS, "b") is None
+    assert cache.get("other guild", "cc", "(f args)", LIMITS, "a") is None
+    assert cache.get_stats() == {"hits": 1, "misses": 2, "programs": 1, "responses": 1}
+
+
+def test_responses_are_dropped_when_the_source_changes():
+    cache = ResultCache(2)
+    cache.put("guild", "cc", "(f args)", LIMITS, "a", response("a"))
+    assert cache.get("guild", "cc", "(f args args)", LIMITS, "a") is None
+    cache.put("guild", "cc", "(f args args)", LIMITS, "a", response("aa"))
+    assert cache.get("guild", "cc", "(f args)", LIMITS, "a") is None
+
+
+def test_responses_are_dropped_when_the_limits_change():
+    cache = ResultCache(2)
+    cache.put("guild", "cc", "(f args)", LIMITS, "a", response("a"))
+    assert cache.get("guild", "cc", "(f args)", LIMITS | {"fuel": 10}, "a") is None
+    assert cache.get("guild", "cc", "(f args)", LIMITS | {"max_output": 1}, "a") is None
+    assert cache.get("guild", "cc", "(f args)", dict(reversed(LIMITS.items())), "a") == response("a")
+
+
+def test_least_recently_used_responses_go_first():
+    cache = ResultCache(2)
+    for arguments in ("a", "b"):
+        cache.put("guild", "cc", "(f args)", LIMITS, arguments, response(arguments))
+    cache.get("guild", "cc", "(f args)", LIMITS, "a")
+    cache.put("guild", "cc", "(f args)", LIMITS, "c", response("c"))
+    assert cache.get("guild", "cc", "(f args)", LIMITS, "b") is None
+    assert cache.get("guild", "cc", "(f args)", LIMITS, "a") == response("a")
+
+
+def test_long_responses_are_not_cached():
+    cache = ResultCache(2)
+    cache.put("guild", "cc", "(f args)", LIMITS, "a", response("a" * (ResultCache.max_response_length + 1)))
+    assert cache.get("guild", "cc", "(f args)", LIMITS, "a") is None
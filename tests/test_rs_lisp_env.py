@@ -0,0 +1,31 @@
+"""
+Checks that runs share one base environment, laying their own variables over it without ever changing it.
+"""
+from red_star.plugins.rs_lisp import base_env, lisp_eval, parse, standard_env
+
+PER_RUN = {"username", "usernick", "usermention", "authorname", "authornick", "argstring", "args", "_rsoutput"}
+
+
+def run(source: str, env=None):
+    return lisp_eval(parse(source), env if env is not None else standard_env(fuel=10 ** 6))
+
+
+def test_runs_only_hold_their_own_variables():
+    env = standard_env(fuel=1000)
+    assert set(env) == PER_RUN
+    assert env["len"] is base_env["len"]
+    run("(define x 1)", env)
+    assert set(env) == PER_RUN | {"x"}
+
+
+def test_shadowed_builtins_dont_leak_into_other_runs():
+    before = dict(base_env)
+    assert run('(do (define len 5) (:= pi 3) (define sqrt (lambda (x) x)) (list len pi (sqrt 4)))') == [5, 3, 4]
+    assert run('(list (len "abc") pi (sqrt 4))') == [3, base_env["pi"], 2.0]
+    assert base_env == before
+
+
+def test_variables_dont_carry_over_between_runs():
+    run('(define leftover 1)')
+    assert "leftover" not in base_env
+    assert run('(do (define found 0) (try (:= found leftover) (:= found -1)) found)') == -1
@@ -0,0 +1,95 @@
+"""
+Checks that programs are stopped cleanly when they go over the limits they're run under.
+"""
+import pytest
+from red_star.plugins.rs_lisp import ProgramCache
+from red_star.plugins.rs_lisp_pool import run_program
+
+
+def run(source: str, **limits) -> dict:
+    request = {"source": source, "scope": "1", "name": None, "variables": {}, "roles": [],
+               "limits": {"fuel": 10 ** 6, "max_depth": 100} | limits}
+    return run_program(request, ProgramCache(1 << 20))
+
+
+def test_endless_loops_run_out_of_fuel():
+    response = run('(while true 1)', fuel=10000)
+    assert "The command ran out of fuel." in response["error"]
+    assert 10000 <= response["fuel_used"] < 10300
+
+
+@pytest.mark.parametrize("source", ['(sum (range 1000000000))', '(** 9 9999999)', '(sort (tolist (range 10000000)))'])
+def test_builtins_are_charged_for_their_work_before_doing_it(source):
+    response = run(source, fuel=10000)
+    assert "The command ran out of fuel." in response["error"]
+
+
+def test_fuel_used_is_the_same_every_run():
+    source = '(do (define fib (lambda (n) (if (< n 2) n (+ (fib (- n 1)) (fib (- n 2)))))) (fib 12))'
+    responses = [run(source) for _ in range(3)]
+    assert responses[0]["result"] == "144"
+    assert responses[0]["fuel_used"] > 0
+    assert len({response["fuel_used"] for response in responses}) == 1
+
+
+def test_wall_clock_backstops_fuel():
+    response = run('(while true 1)', fuel=10 ** 12, max_runtime=0.05)
+    assert "The command ran too long." in response["error"]
+
+
+MEMORY_LIMITS = {"fuel": 10 ** 8, "max_value_size": 1 << 20, "max_allocation": 1 << 24}
+
+
+@pytest.mark.parametrize("source", [
+    '(* "a" 100000000)',
+    '(** 2 10000000)',
+    '(tolist (range 100000000))',
+    '(do (define s "ab") (while true (:= s (+ s s))))',
+    '(do (define l (list)) (while true (append l 1)))',
+])
+def test_values_too_big_to_build_are_refused(source):
+    response = run(source, **MEMORY_LIMITS)
+    assert "The command tried to build a value of" in response["error"]
+    assert response["error_type"] == "custom"
+
+
+@pytest.mark.parametrize("source", [
+    '(map (lambda (x) (tolist (range 10000))) (range 100000))',
+    '(do (define l (list)) (while true (:= l (+ l (list 1 2 3)))))',
+    '(do (define i 0) (while true (do (* "a" 100000) (:= i (+ i 1)))))',
+])
+def test_runs_allocating_too_much_run_out_of_memory(source):
+    response = run(source, **MEMORY_LIMITS)
+    assert "The command ran out of memory." in response["error"]
+    assert response["error_type"] == "custom"
+
+
+def test_lists_grown_in_place_count_towards_allocations():
+    source = ('(do (define ls (list)) (while true (do (define l (list)) (append ls l) (define i 0) '
+              '(while (< i 1000) (do (append l i) (:= i (+ i 1)))))))')
+    response = run(source, **MEMORY_LIMITS | {"max_allocation": 1 << 18})
+    assert "The command ran out of memory." in response["error"]
+
+
+def test_values_within_the_limits_are_built():
+    response = run('(do (define l (list)) (append l 1) (append l 2) (list (len (* "a" 1000)) (append "ab" "cd") l))',
+                   **MEMORY_LIMITS)
+    assert response["result"] == "[1000, 'abcd', [1, 2]]"
+
+
+def test_output_is_cut_off_as_soon_as_it_passes_the_limit():
+    response = run('(while true (print "spam"))', fuel=10 ** 9, max_output=100)
+    assert "The command printed more than the limit of 100 characters." in response["error"]
+    assert response["fuel_used"] < 1000
+
+
+def test_output_up_to_the_limit_is_kept():
+    response = run('(do (define i 0) (while (< i 20) (do (print "spam") (:= i (+ i 1)))))', max_output=100)
+    assert "error" not in response
+    assert response["output"] == "spam\n" * 20
+
+
+def test_programs_can_read_their_own_output():
+    response = run('(do (print "a") (print "b") (list (len _rsoutput) (+ _rsoutput "c") (== _rsoutput "a\\nb\\n")))',
+                   max_output=100)
+    assert response["result"] == "[4, 'a\\nb\\nc', True]"
@@ -0,0 +1,67 @@
+"""
+Checks that custom commands can import the definitions of others and call them, without getting caught in cycles.
+"""
+from red_star.plugins.rs_lisp import ProgramCache
+from red_star.plugins.rs_lisp_pool import run_program
+
+MODULES = {
+    "maths": '(do (print "loading maths") (define sq (lambda (x) (* x x))) (define _helper 1) (define cube '
+             '(lambda (x) (* x (sq x)))))',
+    "greet": '(f "hi " argstring " (" (len args) ")")',
+    "spin": '(while true 1)',
+    "ping": '(do (import "pong") 1)',
+    "pong": '(do (runcc "ping") 2)',
+}
+
+
+def run(source: str, name: str = None, cache: ProgramCache = None, **limits) -> dict:
+    request = {"source": source, "scope": "1", "name": name, "variables": {}, "roles": [], "modules": MODULES,
+               "limits": {"fuel": 10 ** 5, "max_depth": 100} | limits}
+    return run_program(request, cache or ProgramCache(1 << 20))
+
+
+def test_libraries_are_imported_once_per_run():
+    response = run('(do (import "maths") (import "maths" "cube") (list (sq 4) (cube 2)))')
+    assert response["result"] == "[16, 8]"
+    assert response["output"] == "loading maths\n"
+
+
+def test_only_the_definitions_asked_for_are_imported():
+    response = run('(do (import "maths" "sq") (define found 0) (try (:= found cube) (:= found -1)) (list (sq 3) '
+                   'found))')
+    assert response["result"] == "[9, -1]"
+
+
+def test_private_definitions_stay_private():
+    response = run('(import "maths" "_helper")')
+    assert "custom command maths doesn't define _helper" in response["error"]
+
+
+def test_custom_commands_can_be_called_with_arguments():
+    assert run('(runcc "GREET" "a" 2)')["result"] == "hi a 2 (2)"
+    assert run('(runcc "greet")')["result"] == "hi  (0)"
+
+
+def test_missing_modules_raise():
+    assert "no custom command nothing" in run('(import "nothing")')["error"]
+    assert "no custom command nothing" in run('(runcc "nothing")')["error"]
+
+
+def test_import_cycles_raise():
+    response = run('(import "pong")', name="ping")
+    assert "custom command ping depends on itself: ping -> pong -> ping" in response["error"]
+    response = run('(runcc "ping")')
+    assert "custom command ping depends on itself: ping -> pong -> ping" in response["error"]
+
+
+def test_called_commands_burn_the_callers_fuel():
+    response = run('(runcc "spin")', fuel=10000)
+    assert "The command ran out of fuel." in response["error"]
+    assert response["fuel_used"] >= 10000
+
+
+def test_libraries_are_compiled_once():
+    cache = ProgramCache(1 << 20)
+    for _ in range(3):
+        run('(do (import "maths") (sq 2))', cache=cache)
+    assert cache.get_stats()["misses"] == 1
@@ -0,0 +1,69 @@
+"""
+Checks that optimized programs give the same result and output as the programs they were optimized from.
+"""
+import pytest
+from red_star.plugins.rs_lisp import compile_ast, optimize, parse, reprint, standard_env
+
+PROGRAMS = [
+    '(do (define x (+ 1 2)) (* x (** 2 10)))',
+    '(f "Hello " "world " (+ 1 2) " " (str "upper" "abc"))',
+    '(if (> 3 2) "yes" (undefined))',
+    '(if (< 3 2) (undefined) (f "no" username))',
+    '(do (define sq (lambda (x) (* x x))) (define i 0) (define t 0) '
+    '(while (< i 10) (do (:= t (+ t (sq i))) (:= i (+ i 1)))) t)',
+    '(do (define n 5) (define i 0) (define t 0) (while (< i (* n 2)) (do (:= t (+ t (* n 3))) (:= i (+ i 1)))) '
+    '(list t i))',
+    '(do (define i 10) (while (< i 3) (:= i (/ 1 0))) i)',
+    '(do (define + -) (+ 5 3))',
+    '(do (define f (lambda (x) (+ x 1))) (define f 3) f)',
+    '(do (define f (lambda (x) (+ x 1))) (define y 4) (list (f y) (f 2) (f (f 1))))',
+    '(do (define pi 3) (* pi 2))',
+    '(/ 1 0)',
+    '(do (define i 0) (while (< i 3) (do (define j 0) (while (< j (+ i 2)) (:= j (+ j 1))) (:= i (+ i 1)))) '
+    '(list i j))',
+    '(do (define x 2) (define i 0) (while (< i 3) (do (print (* x x)) (:= i (+ i 1)))))',
+    '(do (define _loop0 1) (define x 2) (define i 0) (while (< i 3) (do (:= _loop0 (* x x)) (:= i (+ i 1)))) '
+    '_loop0)',
+    # Loops whose tests print or assign, which mustn't be worked out any more times than they were.
+    '(do (define n 3) (define i 0) (while (do (print "t") (< i (* 2 n))) (:= i (+ i 1))))',
+    '(do (define n 3) (define i 0) (define c 0) (while (do (:= c (+ c 1)) (< i (* 2 n))) (:= i (+ i 1))) c)',
+    # Calls to inlinable procedures passing arguments they don't use, which still have to be worked out.
+    '(do (define g (lambda (x y) x)) (g 1 (/ 1 0)))',
+    '(do (define g (lambda (x y) x)) (g 1 undefined))',
+    '(do (define g (lambda (x y) (* x 2))) (define n 10) (list (g 1 2) (g n (** n n))))',
+]
+
+
+def run(ast) -> tuple[str, str]:
+    env = standard_env(fuel=10 ** 6)
+    env['username'] = "tester"
+    try:
+        result = str(compile_ast(ast)(env))
+    except Exception as e:
+        result = f"error: {e}"
+    return result, str(env['_rsoutput'])
+
+
+@pytest.mark.parametrize("source", PROGRAMS)
+def test_optimized_program_behaves_the_same(source):
+    ast = parse(source)
+    optimized = optimize(ast)
+    assert reprint(ast) == reprint(parse(source)), "optimizing modified the original tree"
+    assert run(parse(reprint(optimized))) == run(ast)
+
+
+def test_loop_invariants_are_hoisted():
+    source = '(do (define n 5) (define i 0) (while (< i (* n 2)) (:= i (+ i 1))) i)'
+    assert '_loop0' in reprint(optimize(parse(source)))
+
+
+def test_loop_with_side_effects_in_test_is_left_alone():
+    source = '(do (define n 3) (define i 0) (while (do (print "t") (< i (* 2 n))) (:= i (+ i 1))))'
+    assert '_loop0' not in reprint(optimize(parse(source)))
+    assert run(parse(reprint(optimize(parse(source)))))[1] == "t\n" * 7
+
+
+def test_unused_arguments_are_still_worked_out():
+    source = '(do (define g (lambda (x y) x)) (g 1 (/ 1 0)))'
+    assert "division by zero" in run(parse(reprint(optimize(parse(source)))))[0]
+    assert '(g 1' not in reprint(optimize(parse('(do (define g (lambda (x y) x)) (g 1 2))')))
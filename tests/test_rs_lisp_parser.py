@@ -0,0 +1,20 @@
+"""
+Checks that the single-pass parser gives the same trees as the tokenizing parser it replaced.
+"""
+import pytest
+from red_star.plugins.rs_lisp import parse
+
+# The trees the old parser gave for programs that exercise its trickier parts.
+PARSED = [
+    ('"escaped \\"quotes\\" and \\\\ backslash"', ['quote', 'escaped "quotes" and \\ backslash']),
+    ('(list 1 -2 3.5 -0.25 1e3 "x")', ['list', 1, -2, 3.5, -0.25, 1000.0, ['quote', 'x']]),
+    ('(do ; a comment\n (+ 1 2) ; another\n)', ['do', ['+', 1, 2]]),
+    ('(f "a" "b;c" "(not a list)")', ['f', ['quote', 'a'], ['quote', 'b;c'], ['quote', '(not a list)']]),
+    ('(quote (a b (c "d")))', ['quote', ['a', 'b', ['c', ['quote', 'd']]]]),
+    ('(do (define l (list 1 2 3)) (:= l:1 20) l)', ['do', ['define', 'l', ['list', 1, 2, 3]], [':=', 'l:1', 20], 'l']),
+]
+
+
+@pytest.mark.parametrize("source, tree", PARSED)
+def test_parser_gives_the_same_trees(source, tree):
+    assert parse(source) == tree
@@ -0,0 +1,84 @@
+"""
+Checks running programs in the worker pool and cooperatively in the bot's process, in and out of REPL sessions.
+"""
+import asyncio
+import time
+from red_star.plugins.rs_lisp import ProgramCache
+from red_star.plugins.rs_lisp_pool import CooperativeRun, ExecutionPool, Sessions
+from red_star.rs_errors import CustomCommandSyntaxError
+
+
+def request(source: str, session: tuple = None) -> dict:
+    request = {"source": source, "scope": "1", "name": None, "variables": {}, "roles": [],
+               "limits": {"max_runtime": 5, "fuel": 100000, "max_depth": 100}}
+    if session is not None:
+        request["session"] = session
+    return request
+
+
+def test_pool_keeps_sessions_in_their_workers():
+    async def run():
+        pool = ExecutionPool(2, 1 << 20, max_sessions=4, session_ttl=60, session_size=1 << 16)
+        await pool.start()
+        alice, bob = (1, 10), (1, 11)
+        await pool.run(request('(define sq (lambda (x) (* x x)))', alice))
+        responses = [await pool.run(request('(sq 7)', alice)), await pool.run(request('(sq 7)', bob)),
+                     await pool.run(request('(sq 7)'))]
+        oversized = await pool.run(request('(define big (cumsum (randints 50000 0 9)))', alice))
+        after_reset = await pool.run(request('(sq 7)', alice))
+        drops = [await pool.run({"drop_session": bob}), await pool.run({"drop_session": bob})]
+        return responses, oversized, after_reset, drops
+
+    (in_session, other_session, no_session), oversized, after_reset, drops = asyncio.run(run())
+    assert in_session["result"] == "49"
+    assert "undefined var sq" in other_session["error"]
+    assert "undefined var sq" in no_session["error"]
+    assert oversized["session_reset"]
+    assert "undefined var sq" in after_reset["error"]
+    assert drops == [{"dropped": True}, {"dropped": False}]
+
+
+def test_cooperative_run_in_session_starts_each_run_afresh():
+    async def run():
+        cache = ProgramCache(1 << 20)
+        session = Sessions(2, 60, 1 << 16).get((1, 10))
+        first = await CooperativeRun(request('(do (define n 0) (print "hi") n)'), cache, 1000, session).run()
+        second = await CooperativeRun(request('(do (while (< n 100000) (:= n (+ n 1))) n)'), cache, 1000,
+                                      session).run()
+        third = await CooperativeRun(request('n'), cache, 1000, session).run()
+        return first, second, third
+
+    first, second, third = asyncio.run(run())
+    assert first["output"] == "hi\n"
+    assert "ran out of fuel" in second["error"]
+    assert third["output"] == "" and int(third["result"]) > 0 and third["fuel_used"] < 10
+
+
+def test_stopped_cooperative_runs_are_bounded(monkeypatch):
+    monkeypatch.setattr(CooperativeRun, "abandoned", set())
+    monkeypatch.setattr(CooperativeRun, "max_abandoned", 1)
+    monkeypatch.setattr(CooperativeRun, "stop_grace", 0.01)
+
+    async def run(source: str, variables: dict = None) -> str:
+        stuck = request(source)
+        stuck["variables"] = variables or {}
+        stuck["limits"]["fuel"] = 10 ** 9
+        try:
+            response = await CooperativeRun(stuck, ProgramCache(1 << 20), 1000).run(0.05)
+            return response.get("error", response["result"])
+        except CustomCommandSyntaxError as e:
+            return str(e)
+
+    async def runs():
+        looping = await run('(while 1 1)')
+        looping_abandoned = len(CooperativeRun.abandoned)
+        blocked = await run('(block)', {"block": lambda: time.sleep(0.3)})
+        refused = await run('(+ 1 2)')
+        await asyncio.sleep(0.4)
+        return looping, looping_abandoned, blocked, refused, await run('(+ 1 2)')
+
+    looping, looping_abandoned, blocked, refused, after = asyncio.run(runs())
+    assert looping == blocked == "The command ran too long."
+    assert looping_abandoned == 0
+    assert "Too many stopped commands" in refused
+    assert after == "3"
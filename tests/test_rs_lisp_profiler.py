@@ -0,0 +1,51 @@
+"""
+Checks that profiled programs run as they otherwise would, while counting what they evaluate and where it is.
+"""
+from red_star.plugins.rs_lisp import Profiler, compile_ast, parse, standard_env
+
+FIB = '(do\n (define fib (lambda (n) (if (< n 2) n (+ (fib (- n 1)) (fib (- n 2))))))\n (fib 10))'
+
+
+def profile(source: str, native_depth: int = None) -> tuple:
+    profiler = Profiler(source)
+    env = standard_env(fuel=10 ** 6)
+    if native_depth is not None:
+        env.meter.native_depth = native_depth
+    return profiler, profiler.program(env), env.meter.used
+
+
+def test_profiled_programs_run_as_usual():
+    env = standard_env(fuel=10 ** 6)
+    assert compile_ast(parse(FIB))(env) == 55
+    _, result, fuel_used = profile(FIB)
+    assert (result, fuel_used) == (55, env.meter.used)
+
+
+def test_evaluations_and_calls_are_counted():
+    profiler, _, _ = profile(FIB)
+    counts = {name: stats[0] for name, stats in profiler.calls.items()}
+    assert counts == {"do": 1, "fib": 177, "<": 177, "+": 88, "-": 176}
+    assert all(stats[3] == 0 for stats in profiler.stats.values())
+
+
+def test_report_lists_procedures_with_their_positions():
+    profiler, _, fuel_used = profile(FIB)
+    report = profiler.report(fuel_used)
+    assert f"and {fuel_used} fuel." in report
+    assert "Procedure fib:" in report
+    lines = report.splitlines()
+    assert any(line.endswith("177  (if(< n 2)n(+(fib(- n 1))(fib(- n 2))))  (line 2, column 26)") for line in lines)
+    assert any(line.endswith("177  fib") for line in lines)
+
+
+def test_calls_on_the_explicit_stack_are_counted_the_same():
+    profiler, result, _ = profile(FIB, native_depth=0)
+    assert result == 55
+    assert profiler.calls["fib"][0] == 177
+    assert all(stats[3] == 0 for stats in profiler.stats.values())
+
+
+def test_nothing_to_report_for_constants():
+    profiler, result, _ = profile('42')
+    assert result == 42
+    assert profiler.report(0) == "Nothing was recorded while the program ran.\n"
@@ -0,0 +1,43 @@
+"""
+Checks that lazy sequences only work out the items asked for, and are built into lists within a run's limits.
+"""
+import pytest
+from red_star.plugins.rs_lisp import ProgramCache
+from red_star.plugins.rs_lisp_pool import run_program
+
+
+def run(source: str, **limits) -> dict:
+    request = {"source": source, "scope": "1", "name": None, "variables": {}, "roles": [],
+               "limits": {"fuel": 10 ** 6, "max_depth": 100, "max_value_size": 1 << 20} | limits}
+    return run_program(request, ProgramCache(1 << 20))
+
+
+@pytest.mark.parametrize("source, result", [
+    ('(take 3 (lmap (lambda (x) (* x x)) (range 10)))', '[0, 1, 4]'),
+    ('(lfilter (lambda (x) (== (% x 3) 0)) (range 10))', '[0, 3, 6, 9]'),
+    ('(drop 7 (range 10))', '[7, 8, 9]'),
+    ('(take-while (lambda (x) (< x 3)) (range 10))', '[0, 1, 2]'),
+    ('(chunk 4 (range 10))', '[[0, 1, 2, 3], [4, 5, 6, 7], [8, 9]]'),
+    ('(fold + 0 (lmap (lambda (x) (* x 2)) (range 10)))', '90'),
+    ('(lmap + (range 3) (range 10 13))', '[10, 12, 14]'),
+    ('(do (define s (lmap (lambda (x) (* x 10)) (range 5))) (list (len s) (car s) (sum s) (sum s) (max s)))',
+     '[5, 0, 100, 100, 40]'),
+])
+def test_sequences_give_the_same_items_as_lists(source, result):
+    assert run(source)["result"] == result
+
+
+def test_only_the_items_asked_for_are_worked_out():
+    response = run('(take 5 (lmap (lambda (x) (* x x)) (lfilter (lambda (x) (== (% x 2) 0)) (range 1000000000))))')
+    assert response["result"] == "[0, 4, 16, 36, 64]"
+    assert response["fuel_used"] < 100
+
+
+def test_pulling_items_is_charged_for():
+    response = run('(sum (take 100000000 (range 1000000000)))', fuel=10000)
+    assert "The command ran out of fuel." in response["error"]
+
+
+def test_building_a_sequence_is_checked_against_the_value_size_limit():
+    response = run('(len (lmap (lambda (x) x) (range 100000000)))', fuel=10 ** 9)
+    assert "The command tried to build a value of" in response["error"]
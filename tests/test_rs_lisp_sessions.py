@@ -0,0 +1,67 @@
+"""
+Checks that REPL sessions keep what was defined in them until they go unused too long or make way for others.
+"""
+import pytest
+from red_star.plugins import rs_lisp_pool
+from red_star.plugins.rs_lisp import ProgramCache
+from red_star.plugins.rs_lisp_pool import Sessions, run_in_session
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(rs_lisp_pool, "monotonic", lambda: now[0])
+    return now
+
+
+def run(sessions: Sessions, key: tuple, source: str) -> dict:
+    request = {"source": source, "scope": "1", "name": None, "variables": {}, "roles": [], "session": key,
+               "limits": {"fuel": 10 ** 5, "max_depth": 100}}
+    return run_in_session(request, ProgramCache(1 << 20), sessions)
+
+
+def test_sessions_last_until_they_go_unused_for_too_long(clock):
+    sessions = Sessions(4, 60, 1 << 16)
+    alice = sessions.get("alice")
+    clock[0] += 50
+    assert sessions.get("alice") is alice
+    clock[0] += 50
+    assert sessions.get("alice") is alice
+    clock[0] += 61
+    sessions.get("bob")
+    assert "alice" not in sessions.sessions
+    assert sessions.get("alice") is not alice
+
+
+def test_the_least_recently_used_session_makes_way(clock):
+    sessions = Sessions(2, 60, 1 << 16)
+    alice, bob = sessions.get("alice"), sessions.get("bob")
+    clock[0] += 1
+    sessions.get("alice")
+    sessions.get("carol")
+    assert list(sessions.sessions) == ["alice", "carol"]
+    assert sessions.get("alice") is alice
+    assert sessions.get("bob") is not bob
+
+
+def test_dropping_sessions(clock):
+    sessions = Sessions(2, 60, 1 << 16)
+    sessions.get("alice")
+    assert sessions.drop("alice")
+    assert not sessions.drop("alice")
+
+
+def test_definitions_carry_over_until_the_session_expires(clock):
+    sessions = Sessions(2, 60, 1 << 16)
+    run(sessions, (1, 10), '(define sq (lambda (x) (* x x)))')
+    assert run(sessions, (1, 10), '(sq 7)')["result"] == "49"
+    assert "undefined var sq" in run(sessions, (1, 11), '(sq 7)')["error"]
+    clock[0] += 61
+    assert "undefined var sq" in run(sessions, (1, 10), '(sq 7)')["error"]
+
+
+def test_sessions_holding_on_to_too_much_are_reset(clock):
+    sessions = Sessions(2, 60, 1 << 16)
+    run(sessions, (1, 10), '(define sq (lambda (x) (* x x)))')
+    assert run(sessions, (1, 10), '(define big (tolist (range 100000)))')["session_reset"]
+    assert "undefined var sq" in run(sessions, (1, 10), '(sq 7)')["error"]
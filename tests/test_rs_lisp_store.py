@@ -0,0 +1,88 @@
+"""
+Checks that custom command stores apply a run's writes all at once, keep to their quotas, and only hold their
+database open while it's in use.
+"""
+import asyncio
+import json
+import pytest
+from red_star.plugins.rs_lisp import Meter
+from red_star.plugins.rs_lisp_store import DataSession, DataStore, entry_size
+from red_star.rs_errors import CustomCommandSyntaxError
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = DataStore(tmp_path / "data.db")
+    yield store
+    store.close()
+
+
+def stored(store: DataStore, cc: str) -> dict:
+    return {key: json.loads(value) for key, value in
+            store.connection.execute("SELECT key, value FROM data WHERE cc = ?", (cc,))}
+
+
+def test_writes_are_applied_and_counted(store):
+    store.write("cc", {"name": ["set", '"abc"'], "count": ["incr", 2]}, 100)
+    store.write("cc", {"count": ["incr", 3]}, 100)
+    assert stored(store, "cc") == {"name": "abc", "count": 5}
+    assert store.size("cc") == entry_size("name", '"abc"') + entry_size("count", "5")
+    store.sizes.clear()
+    assert store.size("cc") == entry_size("name", '"abc"') + entry_size("count", "5")
+
+
+def test_writes_over_quota_are_rolled_back(store):
+    store.write("cc", {"a": ["set", "1"]}, 10)
+    with pytest.raises(CustomCommandSyntaxError, match="data quota of 10 bytes"):
+        store.write("cc", {"a": ["set", "2"], "b": ["set", '"too long"']}, 10)
+    assert stored(store, "cc") == {"a": 1}
+    assert store.size("cc") == entry_size("a", "1")
+
+
+def test_shrinking_a_store_over_quota_is_allowed(store):
+    store.write("cc", {"a": ["set", '"long value"']}, 100)
+    store.write("cc", {"a": ["set", '"short"']}, 10)
+    assert stored(store, "cc") == {"a": "short"}
+
+
+def test_failed_incr_rolls_back_the_whole_run(store):
+    store.write("cc", {"name": ["set", '"abc"']}, 100)
+    with pytest.raises(CustomCommandSyntaxError, match="doesn't hold a number"):
+        store.write("cc", {"other": ["set", "1"], "name": ["incr", 1]}, 100)
+    assert stored(store, "cc") == {"name": "abc"}
+
+
+def test_stores_are_kept_apart_and_deleted(store):
+    store.write("one", {"a": ["set", "1"]}, 100)
+    store.write("two", {"a": ["set", "2"]}, 100)
+    store.delete("one")
+    assert stored(store, "one") == {} and store.size("one") == 0
+    assert stored(store, "two") == {"a": 2}
+
+
+def test_database_is_only_created_once_something_is_stored(tmp_path):
+    store = DataStore(tmp_path / "guild" / "data.db")
+    assert store.size("cc") == 0
+    store.delete("cc")
+    assert not store.path.exists()
+    session = DataSession({"path": str(store.path), "cc": "cc", "used": 0, "quota": 100}, Meter())
+    assert session.get("a", "default") == "default"
+    session.close()
+    assert not store.path.exists()
+    store.write("cc", {"a": ["set", "1"]}, 100)
+    assert store.path.exists()
+    store.close()
+
+
+def test_idle_database_is_closed_and_reopened(tmp_path):
+    async def use():
+        store = DataStore(tmp_path / "data.db", idle_ttl=0.01)
+        store.write("cc", {"a": ["set", "1"]}, 100)
+        await asyncio.sleep(0.05)
+        closed = store._connection is None
+        store.write("cc", {"b": ["set", "2"]}, 100)
+        values = stored(store, "cc")
+        store.close()
+        return closed, values
+
+    assert asyncio.run(use()) == (True, {"a": 1, "b": 2})
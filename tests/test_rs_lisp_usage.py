@@ -0,0 +1,66 @@
+"""
+Checks that rolling fuel usage windows count, expire and rank usage as runs are made.
+"""
+import pytest
+from red_star.plugins import rs_lisp_pool
+from red_star.plugins.rs_lisp_pool import UsageWindow
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(rs_lisp_pool, "monotonic", lambda: now[0])
+    return now
+
+
+def test_usage_is_counted_per_user_and_in_total(clock):
+    usage = UsageWindow(100)
+    usage.add("alice", 30)
+    clock[0] += 25
+    usage.add("alice", 20)
+    usage.add("bob", 5)
+    assert usage.used("alice") == 50
+    assert usage.used("bob") == 5
+    assert usage.used() == 55
+    assert usage.top(5) == [("alice", 50), ("bob", 5)]
+
+
+def test_usage_drops_out_of_the_window(clock):
+    usage = UsageWindow(100)
+    usage.add("alice", 30)
+    clock[0] += 50
+    usage.add("alice", 20)
+    clock[0] += 55
+    assert usage.used("alice") == 20
+    clock[0] += 50
+    assert usage.used("alice") == 0
+    assert usage.top(5) == []
+    assert "alice" not in usage.usage
+
+
+def test_wait_until_back_under_quota(clock):
+    usage = UsageWindow(100)
+    usage.add("alice", 30)
+    clock[0] += 40
+    usage.add("alice", 30)
+    assert usage.wait("alice", 0) == 0
+    assert usage.wait("alice", 100) == 0
+    # The first 30 has to drop out, which it does when its bucket leaves the window, 60 seconds from now.
+    assert usage.wait("alice", 50) == pytest.approx(60)
+    # Both have to drop out.
+    assert usage.wait("alice", 30) == pytest.approx(100)
+    clock[0] += 60
+    assert usage.wait("alice", 50) == 0
+
+
+def test_resizing_keeps_usage_and_changes_when_it_expires(clock):
+    usage = UsageWindow(100)
+    usage.add("alice", 30)
+    clock[0] += 50
+    usage.add("alice", 20)
+    usage.resize(1000)
+    assert usage.used("alice") == 50
+    clock[0] += 500
+    assert usage.used("alice") == 50
+    usage.resize(100)
+    assert usage.used("alice") == 0
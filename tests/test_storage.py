@@ -0,0 +1,49 @@
+"""
+Checks that plugin storage files are written, evicted and reloaded without losing or resurrecting data.
+"""
+import asyncio
+from red_star.config_manager import PluginStorageFile, StorageCache
+
+CACHE_CONFIG = {"storage_idle_ttl": 0, "storage_memory_budget": 1 << 20, "storage_sweep_interval": 0.01}
+
+
+def test_untouched_new_file_is_not_written(tmp_path):
+    storage_file = PluginStorageFile(tmp_path / "plugin.json")
+    assert storage_file.contents == {}
+    assert not storage_file.flush()
+    assert not storage_file.path.exists()
+
+
+def test_emptied_file_stays_empty_after_reload(tmp_path):
+    storage_file = PluginStorageFile(tmp_path / "plugin.json")
+    storage_file.contents["ccs"] = {"hello": "world"}
+    assert storage_file.flush()
+    storage_file.contents.clear()
+    assert storage_file.unload()
+    assert storage_file.contents == {}
+
+
+def test_save_writes_empty_contents(tmp_path):
+    storage_file = PluginStorageFile(tmp_path / "plugin.json")
+    storage_file.contents["key"] = 1
+    storage_file.save()
+    del storage_file.contents["key"]
+    storage_file.save()
+    assert storage_file.path.read_text() == "{}"
+
+
+def test_idle_files_are_swept_without_being_accessed(tmp_path):
+    async def sweep():
+        cache = StorageCache(CACHE_CONFIG)
+        storage_file = PluginStorageFile(tmp_path / "plugin.json", cache=cache)
+        storage_file.contents["key"] = "value"
+        cache.start()
+        try:
+            await asyncio.sleep(0.1)
+        finally:
+            cache.stop()
+        return cache, storage_file
+
+    cache, storage_file = asyncio.run(sweep())
+    assert not cache.resident
+    assert storage_file.path.read_text() == '{"key": "value"}'
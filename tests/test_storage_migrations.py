@@ -0,0 +1,55 @@
+"""
+Checks that legacy data is carried over into plugin storage by the storage migrations.
+"""
+import json
+from red_star.config_manager import ConfigManager
+from red_star.storage_migrations import STAMP_FILE_NAME, migrations, run_storage_migrations
+
+GUILD_ID = "123456789"
+
+
+def make_config_manager(tmp_path, config: dict) -> ConfigManager:
+    config_path = tmp_path / "config"
+    config_path.mkdir()
+    (config_path / "config.json").write_text(json.dumps(config), encoding="utf-8")
+    return ConfigManager(config_path, tmp_path / "storage")
+
+
+def read_storage(tmp_path, plugin_name: str) -> str:
+    return (tmp_path / "storage" / GUILD_ID / (plugin_name + ".json")).read_text(encoding="utf-8")
+
+
+def test_motd_file_set_in_server_defaults_is_migrated(tmp_path):
+    config_manager = make_config_manager(tmp_path, {
+        "global": {"__config_version": 3},
+        "default": {"motd": {"motd_file": "motds.json"}},
+        GUILD_ID: {}
+    })
+    (tmp_path / "motds").mkdir()
+    (tmp_path / "motds" / "motds.json").write_text(json.dumps({"jan": {"1": ["Happy new year!"]}}))
+    run_storage_migrations(config_manager, {GUILD_ID})
+    assert json.loads(read_storage(tmp_path, "motd")) == {"motds": {"jan": {"1": ["Happy new year!"]}}}
+    stamp = json.loads((tmp_path / "storage" / STAMP_FILE_NAME).read_text())
+    assert stamp["version"] == migrations[-1].version
+
+
+def test_motd_file_set_for_server_is_migrated_and_removed(tmp_path):
+    config_manager = make_config_manager(tmp_path, {
+        "global": {"__config_version": 3},
+        "default": {},
+        GUILD_ID: {"motd": {"motd_file": "server.json"}}
+    })
+    (tmp_path / "motds").mkdir()
+    (tmp_path / "motds" / "server.json").write_text(json.dumps({"mon": {}}))
+    run_storage_migrations(config_manager, {GUILD_ID})
+    assert json.loads(read_storage(tmp_path, "motd")) == {"motds": {"mon": {}}}
+    assert "motd_file" not in config_manager.config[GUILD_ID]["motd"]
+
+
+def test_storage_is_written_with_plugin_save_args(tmp_path):
+    config_manager = make_config_manager(tmp_path, {"global": {"__config_version": 3}, "default": {}})
+    (tmp_path / "config" / "walls.json").write_text(json.dumps({GUILD_ID: {"rules": ["Ünïcode"]}}))
+    save_args = {"indent": 2, "ensure_ascii": False}
+    run_storage_migrations(config_manager, {GUILD_ID}, {"channel_print": save_args})
+    assert read_storage(tmp_path, "channel_print") == json.dumps({"documents": {"rules": ["Ünïcode"]}}, **save_args)
+    assert (tmp_path / "config" / "walls.json.old").exists()